@@ -0,0 +1,195 @@
+"""Runs a list of queries, such as q2-drugandcondition-list.txt, across worker processes.
+
+Each query runs in one process, and the CPU-bound parts of the builder (merging, pair generation, CDW
+lookups) hold the GIL, so a batch is spread over processes rather than threads.  The workers pull
+queries from one shared queue, so a slow query holds up only its own worker.  Each worker sets up Rosetta
+once and keeps it, with its concept-level plans, for all the queries it runs; the CDW counts are built
+into a memory-mapped index before the workers start, so they share one copy.  A query that fails is
+retried, after a delay that doubles each time, by whichever worker is free.
+
+    python batch.py q2-drugandcondition-list.txt -q 2 -s omnicorp --workers 8 --results results.json"""
+import argparse
+import heapq
+import json
+import logging
+import os
+import time
+import builder
+from service import WorkerPool, load_backend
+from ratelimit import parse_ceilings
+
+def read_query_list(filename):
+    """(start, end) names from a tab-separated file with a header line: Drug and Condition columns,
+    or a single column (e.g. Disease) of starts.  Lines starting with # are skipped."""
+    queries = []
+    with open(filename, 'r') as infile:
+        infile.readline()
+        for line in infile:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            x = line.split('\t')
+            queries.append((x[0].strip(), x[1].strip() if len(x) > 1 and x[1].strip() else None))
+    return queries
+
+
+def prepare_shared_data(supports):
+    """Build the read-only data the workers map rather than load, before any of them start"""
+    if 'cdw' in supports:
+        import cdwindex
+        try:
+            cdwindex.open_index()
+        except OSError as e:
+            logging.getLogger('application').warning('No CDW index for the workers to share: %s', e)
+
+
+def run_batch(queries, pathway, supports, backend_spec='service:RosettaBackend', options=None, n_workers=None,
+              max_retries=2, retry_delay=30):
+    """Run each (start, end) in queries along pathway with supports, in n_workers processes (by default
+    one per core).  A failed query is run again up to max_retries times, waiting retry_delay seconds
+    before the first retry and twice as long before each one after.  If the workers keep failing to set
+    up the backend (see WorkerPool), the queries not yet running fail without retries.  Returns one
+    outcome per query, in order: start, end, state (done or failed), attempts, seconds, per-stage
+    timings, and the result (graph id, nodes, edges, and each supporter's failed, skipped and
+    unevaluated pairs) or the last error."""
+    logger = logging.getLogger('application')
+    backend = load_backend(backend_spec)
+    options = options or {}
+    n_workers = n_workers or os.cpu_count() or 1
+    outcomes = []
+    jobs = []
+    for i, (start, end) in enumerate(queries):
+        job = {'id': str(i), 'pathway': pathway, 'start': start, 'end': end, 'supports': list(supports)}
+        outcome = {'start': start, 'end': end, 'state': 'queued', 'attempts': 0, 'seconds': 0.0,
+                   'timings': {}, 'result': None, 'error': None}
+        try:
+            backend.validate(job)
+            jobs.append(job)
+        except ValueError as e:
+            outcome.update(state='failed', error=str(e))
+        outcomes.append(outcome)
+    if not jobs:
+        return outcomes
+    prepare_shared_data(supports)
+    pool = WorkerPool(backend_spec, options, n_workers=min(n_workers, len(jobs)))
+    for job in jobs:
+        pool.submit(job)
+    by_id = {job['id']: job for job in jobs}
+    started = {}
+    retries = []
+    remaining = len(jobs)
+    batch_start = time.perf_counter()
+
+    def finish(job_id, state, detail, retry=True):
+        nonlocal remaining
+        outcome = outcomes[int(job_id)]
+        if retry and job_id not in started:
+            # Its worker died before it could start it
+            outcome['attempts'] += 1
+        outcome['seconds'] += time.perf_counter() - started.pop(job_id, time.perf_counter())
+        if state == 'failed' and retry and outcome['attempts'] <= max_retries:
+            delay = retry_delay * 2 ** (outcome['attempts'] - 1)
+            logger.warning('Query %s -> %s failed (attempt %d); retrying in %.0fs',
+                           outcome['start'], outcome['end'], outcome['attempts'], delay)
+            outcome['error'] = detail
+            heapq.heappush(retries, (time.time() + delay, int(job_id)))
+            return
+        if state == 'done':
+            outcome.update(state=state, result=detail, error=None)
+        else:
+            outcome.update(state=state, error=detail)
+        remaining -= 1
+        finished = len(jobs) - remaining
+        logger.info('%s %s -> %s; %d of %d finished, %.1f queries/minute', state, outcome['start'], outcome['end'],
+                    finished, len(jobs), finished * 60 / (time.perf_counter() - batch_start))
+
+    pool.start()
+    try:
+        while remaining > 0:
+            now = time.time()
+            while retries and retries[0][0] <= now:
+                pool.submit(by_id[str(heapq.heappop(retries)[1])])
+            timeout = min(1, max(0, retries[0][0] - now)) if retries else 1
+            for kind, job_id, detail in pool.events(timeout):
+                if kind == 'started':
+                    started[job_id] = time.perf_counter()
+                    outcomes[int(job_id)]['attempts'] += 1
+                elif kind == 'stage':
+                    stage, seconds = detail
+                    outcomes[int(job_id)]['timings'][stage] = seconds
+                elif kind in ('done', 'failed'):
+                    finish(job_id, kind, detail)
+                elif kind == 'setup_failed':
+                    logger.error('A worker could not set up the backend:\n%s', detail)
+                    if pool.broken():
+                        # Nothing waiting will ever start; the queries already running may still finish
+                        error = 'The workers could not set up the backend:\n' + detail
+                        waiting = [job['id'] for job in pool.drain()] + [str(job_id) for _, job_id in retries]
+                        retries.clear()
+                        for job_id in waiting:
+                            finish(job_id, 'failed', error, retry=False)
+    finally:
+        pool.stop()
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a list of queries across worker processes')
+    parser.add_argument('queries', help='Tab-separated file of start (and end) names with a header line')
+    parser.add_argument('-p', '--pathway', help='The query pathway (see builder.py --help). Cannot be used with -q')
+    parser.add_argument('-q', '--question', type=int, choices=sorted(builder.QUESTIONS),
+                        help='Shortcut for the pathway, as in builder.py')
+    parser.add_argument('-s', '--support', action='append', required=True, help='Name of a support system')
+    parser.add_argument('-c', '--config', help='Rosetta environment configuration file.', default='greent.conf')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per core)')
+    parser.add_argument('--retries', type=int, default=2, help='Times to retry a failed query')
+    parser.add_argument('--retry-delay', type=float, default=30, help='Seconds before the first retry; doubles after')
+    parser.add_argument('--backend', default='service:RosettaBackend',
+                        help='module:Class to run queries with, e.g. bench.stubs:StubBackend')
+    parser.add_argument('--edge-store', help='Local SQLite store of program steps, shared by the workers')
+    parser.add_argument('--support-store', help='Local SQLite store of support results, shared by the workers')
+    parser.add_argument('--db-sessions', type=int, default=4, help='Most neo4j sessions open at once in each worker')
+    parser.add_argument('--program-workers', type=int, default=1, help="Threads to run each query's programs in")
+    parser.add_argument('--synonymize-workers', type=int, help="Threads for batched synonymization in each query")
+    parser.add_argument('--limit-services', action='store_true',
+                        help='Adapt the calls in flight to each remote service to its latency and errors')
+    parser.add_argument('--service-ceilings', type=parse_ceilings,
+                        help='Most calls in flight to a service from each worker, e.g. omnicorp=4,chemotext=2')
+    parser.add_argument('--prune', action='store_true', help='Remove dead ends from each graph before support')
+    parser.add_argument('--results', help='Write the outcome of each query to this file as JSON')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], default='INFO')
+    args = parser.parse_args()
+    if (args.pathway is None) == (args.question is None):
+        parser.error('Give one of -p and -q')
+    pathway = args.pathway if args.pathway is not None else builder.QUESTIONS[args.question]
+    logger = logging.getLogger('application')
+    logger.setLevel(getattr(logging, args.log_level))
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    options = {'config': args.config, 'db_sessions': args.db_sessions, 'log_level': args.log_level}
+    for option in ('edge_store', 'support_store', 'program_workers', 'synonymize_workers', 'service_ceilings'):
+        if getattr(args, option) is not None:
+            options[option] = getattr(args, option)
+    if args.prune:
+        options['prune'] = True
+    if args.limit_services:
+        options['limit_services'] = True
+    start = time.perf_counter()
+    outcomes = run_batch(read_query_list(args.queries), pathway, args.support, backend_spec=args.backend,
+                         options=options, n_workers=args.workers, max_retries=args.retries,
+                         retry_delay=args.retry_delay)
+    elapsed = time.perf_counter() - start
+    n_done = len([outcome for outcome in outcomes if outcome['state'] == 'done'])
+    print('{} of {} queries done in {:.1f}s ({:.1f} queries/minute)'.format(
+        n_done, len(outcomes), elapsed, n_done * 60 / elapsed if elapsed > 0 else 0))
+    for outcome in outcomes:
+        if outcome['state'] == 'failed':
+            print('Failed: {} -> {}: {}'.format(outcome['start'], outcome['end'],
+                                               (outcome['error'] or '').strip().split('\n')[-1]))
+    if args.results:
+        with open(args.results, 'w') as outf:
+            json.dump(outcomes, outf, indent=1)
+
+
+if __name__ == '__main__':
+    main()
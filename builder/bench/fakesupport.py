@@ -0,0 +1,40 @@
+"""A supporter module for the benchmarks.  It answers a deterministic fraction of pairs with a
+literature edge, after an optional delay standing in for the remote call."""
+import time
+import zlib
+from datetime import datetime as dt
+from greent.graph_components import KEdge
+from supporter import Supporter
+
+# Tunables, set by the benchmark runner before support is called
+HIT_RATE = 0.1
+LATENCY = 0.0
+
+def get_supporter(greent):
+    return FakeSupport(greent)
+
+
+class FakeSupport(Supporter):
+
+    symmetric = True
+
+    def __init__(self, greent):
+        super().__init__(greent)
+        self.hit_rate = HIT_RATE
+        self.latency = LATENCY
+
+    def term_to_term(self, node_a, node_b):
+        if self.latency:
+            time.sleep(self.latency)
+        # Deterministic in the (unordered) pair, so reruns see the same edges
+        first, second = sorted([node_a.identifier, node_b.identifier])
+        h = zlib.crc32(f'{first},{second}'.encode('utf-8'))
+        if (h % 10000) >= self.hit_rate * 10000:
+            return None
+        pmids = [f'PMID:{h % 100000 + i}' for i in range(h % 5 + 1)]
+        ke = KEdge('fake.term_to_term', dt.now(), 'fake:1', 'literature_co-occurence',
+                   f'{node_a.identifier},{node_b.identifier}', 'fake:1', 'literature_co-occurence',
+                   publications=pmids, is_support=True)
+        ke.source_node = node_a
+        ke.target_node = node_b
+        return ke
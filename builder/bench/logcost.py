@@ -0,0 +1,64 @@
+"""How much the support loop pays for logging at INFO.
+
+Replays the per-pair logging of the support loop over a synthetic graph's pair list twice: once the
+way it used to be written (an eagerly formatted f-string logger.info line per pair), and once through
+ProgressLog (a counter per pair and a periodic summary line).  Both write to a real, if discarded,
+log handler.  Run from the builder directory:
+
+    python -m bench.logcost --nodes 1000
+"""
+import argparse
+import logging
+import time
+from bench.run import build_graph, BenchmarkConfig, configure_logging
+from progress import ProgressLog
+
+def eager(logger, links, cache):
+    for source, target in links:
+        key = f"FakeSupport({source.identifier},{target.identifier})"
+        support_edge = cache.get(key)
+        if support_edge is not None:
+            logger.info(f"cache hit: {key} {support_edge}")
+        else:
+            logger.info(f"exec op: {key}")
+
+
+def summarized(logger, links, cache):
+    progress = ProgressLog(logger, 'FakeSupport', total=len(links))
+    for source, target in links:
+        key = f"FakeSupport({source.identifier},{target.identifier})"
+        support_edge = cache.get(key)
+        if support_edge is not None:
+            progress.event('cache hits', key)
+        else:
+            progress.event('calls', key)
+    progress.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost of per-pair logging in the support loop at INFO')
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    configure_logging('INFO')
+    logger = logging.getLogger('application')
+    config = BenchmarkConfig(argparse.Namespace(edges_per_node=3, synonyms=2, programs=1, cache_latency=0.0,
+                                                db_latency=0.0, seed=0, export_writers=0))
+    kgraph = build_graph(config, args.nodes)
+    links = [(kgraph.node_map[a], kgraph.node_map[b]) for a, b in kgraph.generate_all_links()]
+    cache = kgraph.rosetta.cache
+    results = {}
+    for name, function in (('per-pair info', eager), ('progress summary', summarized)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            function(logger, links, cache)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+        print('{:<18} {:>10.3f}s {:>12.0f} pairs/s'.format(name, best, len(links) / best))
+    print('speedup: {:.1f}x'.format(results['per-pair info'] / results['progress summary']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Offline benchmarks for KnowledgeGraph.
+
+Runs execute (add_edges), merge, prune, support and export against the stubs in bench.stubs at several graph
+sizes and reports throughput and peak traced memory.  Run from the builder directory:
+
+    python -m bench.run --sizes 500,2000,10000 --json bench.json
+
+Each scenario is run twice: once for timing, and once under tracemalloc for peak memory, since
+tracing slows everything down."""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from builder import KnowledgeGraph, export_edge, export_node_snapshot
+from exporter import BackgroundExporter
+from bench.stubs import StubRosetta, SyntheticQuery
+from bench import fakesupport
+
+SUPPORT_MODULE = 'bench.fakesupport'
+
+class BenchmarkConfig:
+    """The scenario settings from the command line.  Settings that only some scenarios use have defaults,
+    so that other benchmarks (bench.logcost) can build one from the few they set."""
+    def __init__(self, args):
+        self.edges_per_node = args.edges_per_node
+        self.synonyms = args.synonyms
+        self.programs = args.programs
+        self.cache_latency = args.cache_latency
+        self.db_latency = args.db_latency
+        self.seed = args.seed
+        self.export_writers = args.export_writers
+        self.service_latency = getattr(args, 'service_latency', 0.001)
+        self.program_workers = getattr(args, 'program_workers', 1)
+        self.synonymize_workers = getattr(args, 'synonymize_workers', 8)
+
+
+def build_graph(config, n_nodes, execute=True):
+    query = SyntheticQuery(n_nodes, n_nodes * config.edges_per_node, n_synonyms=config.synonyms,
+                           n_programs=config.programs, seed=config.seed)
+    rosetta = StubRosetta(cache_latency=config.cache_latency, db_latency=config.db_latency)
+    kgraph = KnowledgeGraph(query, rosetta)
+    if execute:
+        kgraph.execute()
+    return kgraph
+
+
+def bench_add_edges(config, n_nodes):
+    kgraph = build_graph(config, n_nodes, execute=False)
+    start = time.perf_counter()
+    kgraph.execute()
+    elapsed = time.perf_counter() - start
+    return elapsed, n_nodes * config.edges_per_node, 'edges'
+
+
+def bench_execute_programs(config, n_nodes):
+    """Programs that synonymize their nodes through the cache, as Programs do, with each miss costing
+    --service-latency; run in --program-workers threads, with --synonymize-workers batching each step's nodes"""
+    query = SyntheticQuery(n_nodes, n_nodes * config.edges_per_node, n_synonyms=config.synonyms,
+                           n_programs=config.programs, seed=config.seed, service_latency=config.service_latency)
+    rosetta = StubRosetta(cache_latency=config.cache_latency, db_latency=config.db_latency)
+    kgraph = KnowledgeGraph(query, rosetta, program_workers=config.program_workers,
+                            synonymize_workers=config.synonymize_workers)
+    start = time.perf_counter()
+    kgraph.execute()
+    elapsed = time.perf_counter() - start
+    return elapsed, n_nodes * config.edges_per_node, 'edges'
+
+
+def bench_merge(config, n_nodes):
+    kgraph = build_graph(config, n_nodes)
+    rng = random.Random(config.seed)
+    nodes = kgraph.graph.nodes()
+    by_type = {}
+    for node in nodes:
+        by_type.setdefault(node.node_type, []).append(node)
+    pairs = []
+    for same_type in by_type.values():
+        rng.shuffle(same_type)
+        pairs.extend(zip(same_type[0::2], same_type[1::2]))
+    pairs = pairs[:max(1, len(nodes) // 10)]
+    start = time.perf_counter()
+    for source, target in pairs:
+        kgraph.merge(source, target)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(pairs), 'merges'
+
+
+def bench_prune(config, n_nodes):
+    kgraph = build_graph(config, n_nodes)
+    n = len(kgraph.graph.nodes())
+    start = time.perf_counter()
+    kgraph.prune()
+    elapsed = time.perf_counter() - start
+    return elapsed, n, 'nodes'
+
+
+def bench_support(config, n_nodes):
+    kgraph = build_graph(config, n_nodes)
+    n = len(kgraph.graph.nodes())
+    start = time.perf_counter()
+    kgraph.support([SUPPORT_MODULE])
+    elapsed = time.perf_counter() - start
+    return elapsed, n * (n - 1) // 2, 'pairs'
+
+
+def bench_support_rerun(config, n_nodes):
+    """Support over a graph whose pairs have already been checked, listed in the opposite order,
+    through the same cache: the case of a repeated or overlapping query"""
+    kgraph = build_graph(config, n_nodes)
+    edges = [data['object'] for _, _, data in kgraph.graph.edges(data=True)]
+    kgraph.support([SUPPORT_MODULE])
+    rerun = build_graph(config, n_nodes, execute=False)
+    rerun.rosetta = kgraph.rosetta
+    rerun.add_edges(reversed(edges))
+    n = len(rerun.graph.nodes())
+    start = time.perf_counter()
+    rerun.support([SUPPORT_MODULE])
+    elapsed = time.perf_counter() - start
+    return elapsed, n * (n - 1) // 2, 'pairs'
+
+
+def bench_export(config, n_nodes):
+    kgraph = build_graph(config, n_nodes)
+    n = len(kgraph.graph.nodes()) + len(kgraph.graph.edges())
+    start = time.perf_counter()
+    kgraph.export()
+    elapsed = time.perf_counter() - start
+    return elapsed, n, 'records'
+
+
+def bench_pipeline(config, n_nodes):
+    """Support followed by export, one after the other"""
+    kgraph = build_graph(config, n_nodes)
+    start = time.perf_counter()
+    kgraph.support([SUPPORT_MODULE])
+    kgraph.export()
+    elapsed = time.perf_counter() - start
+    return elapsed, len(kgraph.graph.nodes()) + len(kgraph.graph.edges()), 'records'
+
+
+def bench_pipeline_async(config, n_nodes):
+    """Support with the export running in background writers"""
+    kgraph = build_graph(config, n_nodes)
+    start = time.perf_counter()
+    kgraph.start_export(BackgroundExporter(kgraph.database, export_node_snapshot, export_edge,
+                                           n_writers=config.export_writers))
+    kgraph.support([SUPPORT_MODULE])
+    kgraph.finish_export()
+    elapsed = time.perf_counter() - start
+    return elapsed, len(kgraph.graph.nodes()) + len(kgraph.graph.edges()), 'records'
+
+
+SCENARIOS = {'add_edges': bench_add_edges,
+             'execute_programs': bench_execute_programs,
+             'merge': bench_merge,
+             'prune': bench_prune,
+             'support': bench_support,
+             'support_rerun': bench_support_rerun,
+             'export': bench_export,
+             'pipeline': bench_pipeline,
+             'pipeline_async': bench_pipeline_async}
+
+# Scenarios that run support over all pairs, limited by --support-max-nodes
+ALL_PAIRS = set(['support', 'support_rerun', 'pipeline', 'pipeline_async'])
+
+def run_scenario(name, config, n_nodes):
+    function = SCENARIOS[name]
+    elapsed, n_ops, unit = function(config, n_nodes)
+    tracemalloc.start()
+    function(config, n_nodes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'scenario': name,
+            'nodes': n_nodes,
+            'seconds': elapsed,
+            'operations': n_ops,
+            'unit': unit,
+            'throughput': n_ops / elapsed if elapsed > 0 else float('inf'),
+            'peak_bytes': peak}
+
+
+def configure_logging(level):
+    """Send the application log somewhere that costs what a real log file costs, but keep it off the console"""
+    logger = logging.getLogger('application')
+    logger.setLevel(getattr(logging, level))
+    logger.propagate = False
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s: %(message)s'))
+    logger.addHandler(handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline KnowledgeGraph benchmarks')
+    parser.add_argument('--sizes', default='500,2000,10000', help='Comma separated graph sizes (nodes)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run')
+    parser.add_argument('--support-max-nodes', type=int, default=1000,
+                        help='Support checks all pairs, so only run it for sizes up to this')
+    parser.add_argument('--edges-per-node', type=int, default=3)
+    parser.add_argument('--synonyms', type=int, default=2, help='Synonyms per synthetic node')
+    parser.add_argument('--programs', type=int, default=1)
+    parser.add_argument('--hit-rate', type=float, default=0.1, help='Fraction of pairs the fake supporter supports')
+    parser.add_argument('--support-latency', type=float, default=0.0, help='Seconds per fake term_to_term call')
+    parser.add_argument('--cache-latency', type=float, default=0.0, help='Seconds per fake cache get/set')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Seconds per fake cypher statement')
+    parser.add_argument('--service-latency', type=float, default=0.001,
+                        help='Seconds per imitation service call in execute_programs')
+    parser.add_argument('--program-workers', type=int, default=1, help='Threads for execute_programs')
+    parser.add_argument('--synonymize-workers', type=int, default=8,
+                        help='Threads for batched synonymization in execute_programs; 0 synonymizes a node at a time')
+    parser.add_argument('--export-writers', type=int, default=4, help='Background writers for pipeline_async')
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    fakesupport.HIT_RATE = args.hit_rate
+    fakesupport.LATENCY = args.support_latency
+    config = BenchmarkConfig(args)
+    results = []
+    print('{:<14} {:>8} {:>10} {:>14} {:>12}'.format('scenario', 'nodes', 'seconds', 'throughput', 'peak MB'))
+    for n_nodes in [int(x) for x in args.sizes.split(',')]:
+        for name in args.scenarios.split(','):
+            if name in ALL_PAIRS and n_nodes > args.support_max_nodes:
+                continue
+            result = run_scenario(name, config, n_nodes)
+            results.append(result)
+            print('{:<14} {:>8} {:>10.3f} {:>9.0f} {:<6} {:>10.1f}'.format(
+                name, n_nodes, result['seconds'], result['throughput'], result['unit'] + '/s',
+                result['peak_bytes'] / 1e6))
+            sys.stdout.flush()
+    if args.json:
+        with open(args.json, 'w') as outf:
+            json.dump({'arguments': vars(args), 'results': results}, outf, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Deterministic, in-memory stand-ins for the parts of Rosetta that KnowledgeGraph talks to, so that
+the builder can be exercised without greent services, Redis or Neo4j.  Everything is generated from
+a seeded random.Random, so two runs with the same parameters build the same graph."""
+import random
+import time
+from datetime import datetime as dt
+from greent.graph_components import KNode, KEdge
+from greent import node_types
+
+# The clinical outcome pathway; the same shape as -q 2
+DEFAULT_PATHWAY = 'SGPCATD'
+# The edges a SyntheticProgram makes per step
+STEP_EDGES = 100
+
+class StubCache:
+    """Dictionary backed replacement for the Rosetta cache, with an optional delay on every
+    get and set to imitate a round trip to Redis."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.gets = 0
+        self.sets = 0
+        self.mgets = 0
+
+    def get(self, key):
+        self.gets += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.data.get(key)
+
+    def mget(self, keys):
+        """Any number of gets for the price of one round trip"""
+        self.mgets += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.sets += 1
+        if self.latency:
+            time.sleep(self.latency)
+        self.data[key] = value
+
+
+class StubResult:
+    def __init__(self, record=None):
+        self.record = record
+
+    def peek(self):
+        return self.record
+
+
+class StubSession:
+    """Accepts the cypher that export_node and export_edge send, and counts it.  Nodes are
+    remembered by id so that a second export of the same node takes the update path."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, statement, parameters=None, **kwargs):
+        self.driver.statements += 1
+        if self.driver.latency:
+            time.sleep(self.driver.latency)
+        parameters = parameters or kwargs
+        if statement.startswith('MATCH (a {id: {id}}) RETURN a'):
+            return StubResult(self.driver.nodes.get(parameters['id']))
+        if statement.startswith('CREATE (a:'):
+            self.driver.nodes[parameters['id']] = StubRecord(parameters)
+        return StubResult()
+
+    def begin_transaction(self):
+        return StubTransaction(self)
+
+    def close(self):
+        pass
+
+
+class StubTransaction:
+    def __init__(self, session):
+        self.session = session
+
+    def run(self, statement, parameters=None, **kwargs):
+        return self.session.run(statement, parameters, **kwargs)
+
+    def commit(self):
+        pass
+
+
+class StubRecord(dict):
+    """Looks enough like a neo4j record holding a node for export_node's update path"""
+
+    def __init__(self, parameters):
+        node = StubNode(parameters)
+        super().__init__(a=node)
+
+
+class StubNode(dict):
+    def __init__(self, parameters):
+        super().__init__(name=parameters.get('name'), synonyms=parameters.get('syn'))
+        self.labels = set([parameters.get('node_type')])
+
+
+class StubDriver:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.statements = 0
+        # Shared by the sessions of concurrent export writers
+        self.nodes = {}
+
+    def session(self):
+        return StubSession(self)
+
+
+class StubTypeGraph:
+    def __init__(self, driver):
+        self.driver = driver
+
+
+class StubService:
+    """Any remote lookup that enhance might make (labels, names) answered locally"""
+
+    def get_label(self, identifier):
+        return f'label of {identifier}'
+
+    def get_name(self, node):
+        return f'name of {node.identifier}'
+
+    def cell_get_cellname(self, identifier):
+        return [{'cellLabel': f'cell {identifier}'}]
+
+
+class StubCore:
+    def __init__(self):
+        service = StubService()
+        self.mondo = service
+        self.hgnc = service
+        self.uberongraph = service
+
+
+class StubSynonymizer:
+    """Synonymizes a node through rosetta.cache as greent's Synonymizer does, with a miss costing
+    latency seconds of (imitation) service call.  The synonyms are the ones the node was made with."""
+
+    def __init__(self, rosetta, latency=0.0):
+        self.rosetta = rosetta
+        self.latency = latency
+
+    def synonymize(self, node):
+        key = 'synonymize({})'.format(node.identifier)
+        synonyms = self.rosetta.cache.get(key)
+        if synonyms is None:
+            self.rosetta.service_calls.append(key)
+            time.sleep(self.latency)
+            synonyms = sorted(node.synonyms)
+            self.rosetta.cache.set(key, synonyms)
+        node.add_synonyms(synonyms)
+
+
+def synthetic_step(program, rng, n_edges):
+    """The op behind a step of a SyntheticProgram, returning (edge, node) pairs as greent ops do"""
+    return program.make_edges(rng, n_edges)
+
+
+class StubRosetta:
+    def __init__(self, cache_latency=0.0, db_latency=0.0):
+        self.cache = StubCache(cache_latency)
+        self.core = StubCore()
+        # Keys of the (imitation) service calls that synthetic programs made after missing the cache
+        self.service_calls = []
+        self.synonymizer = StubSynonymizer(self)
+        self.ops = {'synthetic.step': synthetic_step}
+        self.type_graph = StubTypeGraph(StubDriver(db_latency))
+
+    def get_ops(self, name):
+        return self.ops[name]
+
+
+class SyntheticProgram:
+    """Produces a layered graph along a pathway, in the shape of a Program's result: a list of
+    KEdges whose nodes carry synonyms.  A fraction of the node references use one of the node's
+    synonyms as its identifier, so that KnowledgeGraph has to collapse them through node_map."""
+
+    def __init__(self, program_number, pathway, n_nodes, n_edges, n_synonyms, seed, synonym_reference_rate=0.2,
+                 service_latency=None):
+        self.program_number = program_number
+        self.pathway = pathway
+        self.n_nodes = n_nodes
+        self.n_edges = n_edges
+        self.n_synonyms = n_synonyms
+        self.seed = seed
+        self.synonym_reference_rate = synonym_reference_rate
+        # If set, the program runs a step at a time through rosetta's ops and synonymizes each node
+        # through rosetta.synonymizer as a Program would, with a miss costing this many seconds
+        self.service_latency = service_latency
+        self.rosetta = None
+
+    def get_path_descriptor(self):
+        return {i: (i + 1, 1) for i in range(len(self.pathway) - 1)}
+
+    def make_node(self, rng, layer, index):
+        node_type = node_types.type_codes[self.pathway[layer]]
+        identifier = f'SYN{self.pathway[layer]}:{index}'
+        synonyms = set(f'SYN{self.pathway[layer]}ALT{k}:{index}' for k in range(self.n_synonyms))
+        if self.n_synonyms > 0 and rng.random() < self.synonym_reference_rate:
+            # Refer to the node by one of its other names
+            alternate = rng.choice(sorted(synonyms))
+            synonyms.discard(alternate)
+            synonyms.add(identifier)
+            identifier = alternate
+        node = KNode(identifier, node_type)
+        node.add_synonyms(synonyms)
+        if hasattr(node, 'contexts'):
+            node.contexts[self.program_number].add(layer)
+        return node
+
+    def make_edges(self, rng, n_edges):
+        """n_edges new edges, as (edge, node) pairs for each end of each edge"""
+        n_layers = len(self.pathway)
+        per_layer = max(1, self.n_nodes // n_layers)
+        results = []
+        for i in range(n_edges):
+            layer = rng.randrange(n_layers - 1)
+            source = self.make_node(rng, layer, rng.randrange(per_layer))
+            target = self.make_node(rng, layer + 1, rng.randrange(per_layer))
+            edge = KEdge('synthetic.step', dt.now(), 'synthetic:1', 'related_to', source.identifier,
+                         'synthetic:1', 'related_to')
+            edge.source_node = source
+            edge.target_node = target
+            results.extend([(edge, source), (edge, target)])
+        return results
+
+    def run_program(self):
+        rng = random.Random(self.seed + self.program_number)
+        edges = []
+        for start in range(0, self.n_edges, STEP_EDGES):
+            n_edges = min(STEP_EDGES, self.n_edges - start)
+            if self.service_latency is None:
+                results = self.make_edges(rng, n_edges)
+            else:
+                results = self.rosetta.get_ops('synthetic.step')(self, rng, n_edges)
+                for _, node in results:
+                    self.rosetta.synonymizer.synonymize(node)
+            edges.extend(edge for edge, _ in results[::2])
+        return edges
+
+
+class SyntheticDefinition:
+    def __init__(self, pathway):
+        self.start_values = ['SYN{}:0'.format(pathway[0])]
+        self.end_values = None
+        self.node_types = [node_types.type_codes[c] for c in pathway]
+        self.transitions = []
+
+
+class SyntheticQuery:
+    """Takes the place of a UserQuery; compiles to a fixed set of synthetic programs"""
+
+    def __init__(self, n_nodes, n_edges, n_synonyms=2, n_programs=1, pathway=DEFAULT_PATHWAY, seed=0,
+                 service_latency=None):
+        self.definition = SyntheticDefinition(pathway)
+        self.programs = [SyntheticProgram(i, pathway, n_nodes, n_edges // n_programs, n_synonyms, seed,
+                                          service_latency=service_latency)
+                         for i in range(n_programs)]
+
+    def compile_query(self, rosetta):
+        for program in self.programs:
+            program.rosetta = rosetta
+            if program.service_latency is not None:
+                rosetta.synonymizer.latency = program.service_latency
+        return True
+
+    def get_programs(self):
+        return self.programs
+
+
+class StubBackend:
+    """A backend for the builder service (service.py) that runs SyntheticQuery jobs against one
+    StubRosetta per worker.  A job gives its size as nodes (and optionally edges_per_node and seed);
+    the only support is the fake supporter."""
+
+    supports = ('bench.fakesupport',)
+
+    def __init__(self, cache_latency=0.0, db_latency=0.0, **options):
+        self.rosetta = StubRosetta(cache_latency=cache_latency, db_latency=db_latency)
+        self.database = None
+        self.run_options = {}
+
+    @classmethod
+    def validate(cls, job):
+        if not isinstance(job.get('nodes', 0), int):
+            raise ValueError('nodes must be an integer')
+        from service import check_budget, check_supports
+        check_supports(job, cls.supports)
+        check_budget(job)
+
+    def query(self, job):
+        n_nodes = job.get('nodes', 200)
+        return SyntheticQuery(n_nodes, n_nodes * job.get('edges_per_node', 3), seed=job.get('seed', 0))
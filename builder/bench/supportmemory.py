@@ -0,0 +1,40 @@
+"""How much memory support results take in the graph, as KEdges, and in KnowledgeGraph.support_table, as
+columns.  The table is kept alongside the edges rather than in place of them: the edges are what export
+writes and what later stages walk, and they carry what the columns don't (predicates, URLs, non-numeric
+properties such as CDW's ICD9 codes).  This reports what the table adds on top.  Run from the builder
+directory:
+
+    python -m bench.supportmemory --nodes 300 --hit-rate 0.1
+"""
+import argparse
+from bench.run import build_graph, BenchmarkConfig, configure_logging, SUPPORT_MODULE
+from bench import fakesupport
+from memprofile import MemoryProfiler
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory of support results as edges and as table columns')
+    parser.add_argument('--nodes', type=int, default=300)
+    parser.add_argument('--hit-rate', type=float, default=0.1, help='Fraction of pairs the fake supporter supports')
+    args = parser.parse_args()
+    configure_logging('WARNING')
+    fakesupport.HIT_RATE = args.hit_rate
+    config = BenchmarkConfig(argparse.Namespace(edges_per_node=3, synonyms=2, programs=1, cache_latency=0.0,
+                                                db_latency=0.0, seed=0, export_writers=0))
+    kgraph = build_graph(config, args.nodes)
+    profiler = MemoryProfiler()
+    profiler.start()
+    kgraph.support([SUPPORT_MODULE])
+    report = profiler.snapshot('support')
+    profiler.stop()
+    n_rows = len(kgraph.support_table)
+    print('{} support edges'.format(n_rows))
+    for structure in ('support edges', 'support table', 'cache'):
+        size = report['structures'].get(structure, 0)
+        print('{:<14} {:>10.2f} MB {:>10.0f} bytes/edge'.format(structure, size / 1e6, size / max(n_rows, 1)))
+    edges = report['structures'].get('support edges', 0)
+    if edges > 0:
+        print('the table adds {:.0%} to the edges'.format(report['structures'].get('support table', 0) / edges))
+
+
+if __name__ == '__main__':
+    main()
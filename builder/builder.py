@@ -1,17 +1,34 @@
-from greent.graph_components import KNode, KEdge
+# Heavy modules (greent's Rosetta and services, networkx, numpy and the supporters) are loaded
+# through startup.load when they are first needed, so that --help, --validate and --list-supports are quick.
 from greent import node_types
-from greent.rosetta import Rosetta
-from userquery import UserQuery
 import argparse
-import networkx as nx
 import logging
 import sys
-from neo4j.v1 import GraphDatabase
-from importlib import import_module
+import time
+import startup
 from lookup_utils import lookup_identifier
 from collections import defaultdict
 from pathlex import tokenize_path
+from checkpoint import Checkpointer, STAGES, query_fingerprint
+from supportguard import SupporterGuard
+from supporter import SupportFailure, has_bulk_lookup, term_to_terms
+from instrument import Instrumentation, NULL_INSTRUMENTATION
+from progress import ProgressLog
+from exporter import BackgroundExporter, export_snapshot
+from idtable import IdentifierTable, NodeRecord
+from supportstore import SupportResultStore, MISSING
+from edgestore import EdgeResultStore, StoreBackedCache, DEFAULT_TTL
+from dbaccess import Database, write_each
+from singleflight import CoalescingCache
+from synonymize import BatchSynonymizer, PrefetchCache
+from ratelimit import ServiceLimits, parse_ceilings
+from supportplan import SupportBudget, prioritize
+from prune import dead_ends
+from memprofile import MemoryBudget, MemoryProfiler, LINK_BYTES, parse_size, pair_blocks, spill_pairs, megabytes
 import calendar
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import copy
 
 def export_edge(edge,session):
     """The approach of updating edges will be to erase an old one and replace it in whole.   There's no real
@@ -73,13 +90,44 @@ def export_edge(edge,session):
              '''
 
 
-def export_node(node, session):
-    """Utility for writing updated nodes.  Goes in node?"""
+def support_key(supporter, source, target):
+    """The pair to look up for (source, target): (cache key, first node, second node, swapped).
+    A supporter that declares symmetric = True gives the same answer either way round, so its pairs
+    are put in identifier order, and the same pair is cached once however a query happens to list it."""
+    if getattr(supporter, 'symmetric', False) and target.identifier < source.identifier:
+        source, target, swapped = target, source, True
+    else:
+        swapped = False
+    return f"{supporter.__class__.__name__}({source.identifier},{target.identifier})", source, target, swapped
+
+
+def orient_support_edge(supporter, edge, source, target, swapped):
+    """Point a support edge looked up under its canonical pair at the pair that was asked for.
+    The edge and its properties are copied, so what is held in the cache is left alone; if the pair
+    was swapped, the supporter's reorient (if it has one) fixes up any directional properties."""
+    edge = copy.copy(edge)
+    edge.properties = dict(edge.properties)
+    if swapped and hasattr(supporter, 'reorient'):
+        supporter.reorient(edge)
+    edge.source_node = source
+    edge.target_node = target
+    return edge
+
+
+def export_node_snapshot(snapshot, session):
+    """export_node for an exporter.ExportNode"""
+    export_node(snapshot, session, list(snapshot.synonyms))
+
+
+def export_node(node, session, sorted_synonyms=None):
+    """Utility for writing updated nodes.  Goes in node?
+    sorted_synonyms, if given, is node.synonyms already sorted."""
     result = session.run("MATCH (a {id: {id}}) RETURN a", {"id": node.identifier})
     original_record = result.peek()
+    if sorted_synonyms is None:
+        sorted_synonyms = sorted(node.synonyms)
     if not original_record:
-        syns = list(node.synonyms)
-        syns.sort()
+        syns = sorted_synonyms
         session.run(
             "CREATE (a:%s {id: {id}, name: {name}, node_type: {node_type}, equivalent_identifiers: {syn}})"
             % (node.node_type),
@@ -89,19 +137,36 @@ def export_node(node, session):
         if node.node_type not in original_node.labels:
             #Note: You can't use query parameterization on node labels in neo4j - UGH
             session.run("MATCH (a {id: {identifier} }) SET a:%s" % (node.node_type,), identifier = node.identifier)
-        new_syns = list(node.synonyms)
-        new_syns.sort()
+        new_syns = sorted_synonyms
         if original_node['name'] != node.label or original_node['synonyms'] != new_syns:
             session.run("MATCH (a {id: {identifier} }) SET a.name = {name}, a.equivalent_identifiers= {synonyms}",
                         identifier = node.identifier, name = node.label, synonyms = new_syns)
 
 class KnowledgeGraph:
-    def __init__(self, userquery, rosetta):
+    def __init__(self, userquery, rosetta, checkpointer=None, instrumentation=None, support_store=None,
+                 edge_store=None, memory_budget=None, database=None, program_workers=1, support_budget=None,
+                 synonymize_workers=8, service_limits=None):
         """KnowledgeGraph is a local version of the query results. 
         After full processing, it gets pushed to neo4j.
+        If a Checkpointer is given, the graph is saved after each stage and periodically during support.
+        If an Instrumentation is given, per-stage timings and counters are recorded into it.
+        If a SupportResultStore is given, support results are looked up there first and saved to it.
+        If an EdgeResultStore is given, program steps are looked up there first and saved to it.
+        If a MemoryBudget is given, support checks fewer pairs, or keeps them on disk, rather than exceed it.
+        database is the dbaccess.Database to export through; by default one over the type graph's driver.
+        With program_workers > 1, the query's programs run concurrently in that many threads, and
+        identical cache misses among them (e.g. the same synonymize key) share one service call.
+        With a SupportBudget, support checks the most promising pairs first and stops when the budget is
+        spent; the pairs it didn't get to are left in support_unevaluated.
+        With synonymize_workers > 0, the nodes of each program step are synonymized together, cache misses
+        in that many threads, and each identifier once per query (see synonymize.py); 0 leaves it to the
+        programs, a node at a time.
+        With a ServiceLimits, the calls the builder and its supporters make to remote services go through
+        its adaptive per-service limits (see ratelimit.py).
         """
         self.logger = logging.getLogger('application')
-        self.graph = nx.MultiDiGraph()
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.graph = startup.load('networkx').MultiDiGraph()
         self.userquery = userquery
         self.rosetta = rosetta
         if not self.userquery.compile_query(self.rosetta):
@@ -109,39 +174,177 @@ class KnowledgeGraph:
             sys.exit(1)
         # node_map is a map from identifiers to the node associated.  It's useful because
         #  we are collapsing nodes along synonym edges, so each node might asked for in
-        #  multiple different ways.
+        #  multiple different ways.  Identifiers are interned in ids, and node_map is keyed
+        #  by the interned id.  node_records holds the NodeRecord for each node in the graph.
+        self.ids = IdentifierTable()
         self.node_map = {}
+        self.node_records = {}
+        self.checkpointer = checkpointer
+        # Progress through the support loop, restored from a checkpoint when resuming
+        self.support_state = None
+        # Per-supporter failure summaries from the last support run
+        self.support_failures = []
+        # Support results in columnar form, for ranking features
+        self.support_table = startup.load('supporttable').SupportTable(ids=self.ids)
+        self.support_store = support_store
+        self.edge_store = edge_store
+        self.memory_budget = memory_budget
+        self.program_workers = program_workers
+        self.support_budget = support_budget
+        self.synonymize_workers = synonymize_workers
+        self.service_limits = service_limits
+        # Supporter name -> the pairs (interned ids) a budgeted support run didn't get to
+        self.support_unevaluated = {}
+        # Whether choose_links settled for the pairs along query paths only
+        self.links_on_paths = False
+        # When exporting in the background, the BackgroundExporter that support edges are streamed to
+        self.exporter = None
+        self.exported_synonym_counts = {}
 
         #uri = 'bolt://localhost:7687'
         #self.driver = GraphDatabase.driver(uri, encrypted=False)
         # Use the same database connection as the type_graph.
         self.driver = self.rosetta.type_graph.driver
+        self.database = database if database is not None else Database(self.driver, instrumentation=self.metrics)
         
     def execute(self):
         """Execute the query that defines the graph"""
         self.logger.debug('Executing Query')
         self.logger.debug('Run Programs')
-        for program in self.userquery.get_programs():
-            result_graph = program.run_program( )
-            self.add_edges(result_graph)
+        cache = self.rosetta.cache
+        if self.edge_store is not None:
+            # Programs look up each step in rosetta.cache before calling a service
+            definition = self.userquery.definition
+            query = ','.join(definition.start_values or [])
+            if definition.end_values:
+                query += '->' + ','.join(definition.end_values)
+            self.rosetta.cache = StoreBackedCache(cache, self.edge_store, query, self.metrics)
+        programs = self.userquery.get_programs()
+        synonymizer = getattr(self.rosetta, 'synonymizer', None)
+        get_ops = getattr(self.rosetta, '__dict__', {}).get('get_ops')
+        try:
+            if self.program_workers > 1 and len(programs) > 1:
+                self.rosetta.cache = CoalescingCache(self.rosetta.cache, self.metrics)
+            if self.synonymize_workers > 0 and synonymizer is not None:
+                self.rosetta.cache = PrefetchCache(self.rosetta.cache)
+                limiter = None if self.service_limits is None else self.service_limits.limiter('synonymize')
+                batch = BatchSynonymizer(synonymizer, self.rosetta.cache, self.metrics, self.synonymize_workers,
+                                         limiter)
+                self.rosetta.synonymizer = batch
+                if hasattr(self.rosetta, 'get_ops'):
+                    self.rosetta.get_ops = batch.get_ops(self.rosetta.get_ops)
+            if self.program_workers > 1 and len(programs) > 1:
+                # Only the programs run in the pool; their results are added here, in program order
+                with ThreadPoolExecutor(self.program_workers) as pool:
+                    results = [pool.submit(self.run_program, program) for program in programs]
+                    for program, result in zip(programs, results):
+                        self.add_program_edges(program, result.result())
+            else:
+                for program in programs:
+                    self.add_program_edges(program, self.run_program(program))
+        finally:
+            self.rosetta.cache = cache
+            if synonymizer is not None:
+                self.rosetta.synonymizer = synonymizer
+                if get_ops is not None:
+                    self.rosetta.get_ops = get_ops
+                elif 'get_ops' in getattr(self.rosetta, '__dict__', {}):
+                    del self.rosetta.get_ops
         self.logger.debug('Query Complete')
 
+    def run_program(self, program):
+        try:
+            with self.metrics.timer('execute_program_seconds', program=program.program_number):
+                return program.run_program( )
+        finally:
+            # Whatever the program took leases on and didn't set (it raised, say), others needn't wait for
+            getattr(self.rosetta.cache, 'release_held', lambda: None)()
+
+    def add_program_edges(self, program, result_graph):
+        n_edges = self.graph.number_of_edges()
+        self.add_edges(result_graph)
+        self.metrics.count('execute_edges_added', self.graph.number_of_edges() - n_edges,
+                           program=program.program_number)
+
+    def checkpoint(self, stage, support_state=None):
+        """Save the graph as of the end of stage, if checkpointing is on"""
+        if self.checkpointer is not None:
+            self.checkpointer.save(self, stage, support_state)
+
+    def resume(self):
+        """Restore the graph from the last checkpoint.  Returns the last stage that completed,
+        or None if there was nothing to restore."""
+        if self.checkpointer is None:
+            return None
+        state = self.checkpointer.load()
+        if state is None:
+            return None
+        self.graph = state['graph']
+        self.node_map = state['node_map']
+        self.ids = state['ids']
+        self.node_records = state['node_records']
+        self.support_state = state['support_state']
+        if state.get('support_table') is not None:
+            self.support_table = state['support_table']
+        self.logger.info('Resuming after %s with %d nodes', state['stage'], len(self.graph.nodes()))
+        if self.support_state is not None:
+            # Support was interrupted, so the last completed stage is the one before it
+            return 'enhance'
+        return state['stage']
+
+    def save_snapshot(self, directory, stage):
+        """Write the graph, as of the end of stage, to a binary snapshot (see snapshot.py)"""
+        strings = self.ids.strings
+        startup.load('snapshot').write(directory, self.graph,
+                                       lambda node: [strings[k] for k in self.node_records[node].keys],
+                                       stage, query_fingerprint(self.userquery, []))
+
+    def load_snapshot(self, directory, keep_support=True, any_query=False):
+        """Replace the graph with the one in a snapshot, in place of crawling for it.  Support edges are
+        left out unless keep_support.  Returns the stage the snapshot was taken after.  Raises ValueError
+        if the snapshot was taken for another query (or for none it recorded), unless any_query.
+        Every node and edge kept goes into the graph here, so the snapshot is read into memory in one go
+        rather than decoded from the mapped arrays a value at a time; Snapshot.open on its own is the
+        lazy way in, for tools that only read part of a snapshot."""
+        snapshot = startup.load('snapshot').Snapshot.open(directory)
+        if snapshot.fingerprint != query_fingerprint(self.userquery, []):
+            if not any_query:
+                raise ValueError('Snapshot {} was taken for a different query'.format(directory))
+            self.logger.warning('Snapshot %s was taken for a different query; loading it anyway', directory)
+        snapshot.preload()
+        self.graph = startup.load('networkx').MultiDiGraph()
+        self.node_map = {}
+        self.node_records = {}
+        for i in range(snapshot.n_nodes):
+            node = snapshot.node(i)
+            self.graph.add_node(node)
+            record = self.node_records[node] = NodeRecord(self.ids.intern(node.identifier))
+            for k in snapshot.node_keys(i):
+                self.map_identifier(self.ids.intern(k), node, record)
+        edge_numbers = snapshot.edge_numbers(support=keep_support)
+        for k in edge_numbers:
+            source, target, edge = snapshot.edge(k)
+            self.graph.add_edge(snapshot.node(source), snapshot.node(target), object=edge)
+        self.logger.info('Loaded %d nodes and %d edges (of %d) from snapshot %s, taken after %s',
+                         snapshot.n_nodes, len(edge_numbers), snapshot.n_edges, directory, snapshot.stage)
+        return snapshot.stage
+
     def print_types(self):
         counts = defaultdict(int)
         for node in self.graph.nodes():
             counts[node.node_type] += 1
         for node_type in counts:
-            self.logger.info('{}: {}'.format(node_type, counts[node_type]))
+            self.logger.info('%s: %d', node_type, counts[node_type])
 
     def merge(self, source, target):
         """Source and target are both members of the graph, and we've found that they are
         synonyms.  Remove target, and attach all of target's edges to source"""
-        self.logger.debug('Merging {} and {}'.format(source.identifier, target.identifier))
+        self.logger.debug('Merging %s and %s', source.identifier, target.identifier)
         source.add_synonym(target)
         nodes_from_target = self.graph.successors(target)
         for s in nodes_from_target:
             # b/c this is a multidigraph, this is actually a map where the edges are the values
-            self.logger.debug('Node s: {}'.format(s))
+            self.logger.debug('Node s: %s', s)
             kedgemap = self.graph.get_edge_data(target, s)
             if kedgemap is None:
                 self.logger.error('s?')
@@ -152,7 +355,7 @@ class KnowledgeGraph:
                 self.graph.add_edge(source, s, object=kedge)
         nodes_to_target = self.graph.predecessors(target)
         for p in nodes_to_target:
-            self.logger.debug('Node p: {}'.format(p))
+            self.logger.debug('Node p: %s', p)
             kedgemap = self.graph.get_edge_data(p, target)
             if kedgemap is None:
                 self.logger.error('p?')
@@ -162,9 +365,11 @@ class KnowledgeGraph:
                 self.graph.add_edge(p, source, object=kedge)
         self.graph.remove_node(target)
         # now, any synonym that was mapping to the old target should be remapped to source
-        for k in self.node_map:
-            if self.node_map[k] == target:
+        source_record = self.node_records[source]
+        for k in self.node_records.pop(target).keys:
+            if self.node_map.get(k) is target:
                 self.node_map[k] = source
+                source_record.keys.append(k)
 
     '''
     def add_synonymous_edge(self, edge):
@@ -190,6 +395,7 @@ class KnowledgeGraph:
     '''
 
     def add_nonsynonymous_edge(self, edge, reverse_edges=False):
+        """Add edge, and its nodes if they are new.  Returns True if the edge was not already in the graph"""
         self.logger.debug(' New Nonsynonymous')
         # Found an edge between nodes. Add nodes if needed.
         source_node = self.add_or_find_node(edge.source_node)
@@ -210,7 +416,7 @@ class KnowledgeGraph:
                 potential_edges = set()
             if edge not in potential_edges:
                 self.graph.add_edge(target_node, source_node, object=edge)
-                self.logger.debug('Edge: {}'.format(self.graph.get_edge_data(target_node, source_node)))
+                self.logger.debug('Edge: %s', self.graph.get_edge_data(target_node, source_node))
             else:
                 self.logger.debug('Not adding repeating edge')
         else:
@@ -221,23 +427,29 @@ class KnowledgeGraph:
                 potential_edges = set()
             if edge not in potential_edges:
                 self.graph.add_edge(source_node, target_node, object=edge)
-                self.logger.debug('Edge: {}'.format(self.graph.get_edge_data(source_node, target_node)))
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug('Edge: %s', self.graph.get_edge_data(source_node, target_node))
+                return True
             else:
                 self.logger.debug('Not adding repeating edge')
+        return False
 
     def add_edges(self, edge_list, reverse_edges=False):
         """Add a list of edges (and the associated nodes) to the graph."""
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         for edge in edge_list:
-            try:
-                self.logger.debug('Edge: {} -> {}'.format(edge.source_node.identifier, edge.target_node.identifier))
-            except:
-
+            if debug:
+                try:
+                    self.logger.debug('Edge: %s -> %s', edge.source_node.identifier, edge.target_node.identifier)
+                except:
+                    pass
             self.add_nonsynonymous_edge(edge, reverse_edges)
 
     def find_node(self, node):
         """If node exists in graph, return it, otherwise, return None"""
-        if node.identifier in self.node_map:
-            return self.node_map[node.identifier]
+        iid = self.ids.get(node.identifier)
+        if iid is not None:
+            return self.node_map.get(iid)
         #We need to be less promiscuous here.   One thing that can happen is that OMIMs can unify what we consider
         # diseases and what we consider genes.  For now, we'll assume that our synonymization/normalization is working
         # well and # we don't have to sweat this.
@@ -247,9 +459,10 @@ class KnowledgeGraph:
         return None
 
     def add_or_find_node(self, node):
-        self.logger.debug("Add or find {}.  Synonyms: {}".format(node.identifier, ','.join(list(node.synonyms))))
         """Find a node that already exists in the graph, checking for synonyms.
         If not found, create it & add to graph"""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Add or find %s.  Synonyms: %s", node.identifier, ','.join(list(node.synonyms)))
         fnode = self.find_node(node)
         if fnode is not None:
             self.logger.debug(' found it')
@@ -258,69 +471,71 @@ class KnowledgeGraph:
         else:
             self.logger.debug(' didnt find it. Adding.')
             self.graph.add_node(node)
-            self.node_map[node.identifier] = node
+            record = self.node_records[node] = NodeRecord(self.ids.intern(node.identifier))
+            self.map_identifier(record.iid, node, record)
             for s in node.synonyms:
-                self.node_map[s] = node
+                self.map_identifier(self.ids.intern(s), node, record)
             return node
 
-    '''
-    Changes to userquery leave this no longer implemented.  We may wish to re-enable it in the future, but for now
-    let's kill it
-    
+    def map_identifier(self, iid, node, record):
+        self.node_map[iid] = node
+        record.keys.append(iid)
+
+    def write_node(self, node, session):
+        """export_node, with the synonym list sorted once per node rather than on every write"""
+        export_node(node, session, self.node_records[node].synonyms_for_export(node))
+
+    def export_snapshot(self, node):
+        """node as the background exporter should write it (see exporter.export_snapshot)"""
+        return export_snapshot(node, self.node_records[node].synonyms_for_export(node))
+
     def prune(self):
-        """Recursively remove poorly connected nodes.  In particular, each (non-terminal) node
-        must be connected to two different kinds of nodes."""
-        # TODO, that is maybe a bit too much.  You can't have disease-gene-disease for instance !
-        # But degree is not enough because you can have A and B both go to C but C doesn't go anywhere.
-        # Probably need to interact with the query to decide whether this node is pruneable or not.
-        self.logger.debug('Pruning Graph')
-        removed = True
-        # make the set of types that we don't want to prune.  These are the end points (both text and id versions).
-        ttypes = self.userquery.get_terminal_types()
-        if node_types.UNSPECIFIED in ttypes[1]:
-            # Any kind of end node will match, so stop
-            return
-        keep_types = set()
-        keep_types.update(ttypes[0])
-        keep_types.update(ttypes[1])
-        n_pruned = 0
-        while removed:
-            removed = False
-            to_remove = []
-            for node in self.graph.nodes():
-                if node.node_type in keep_types:
-                    continue
-                # Graph is directed.  graph.neighbors only returns successors
-                neighbors = self.graph.successors(node) + self.graph.predecessors(node)
-                neighbor_types = set([neighbor.node_type for neighbor in neighbors])
-                if len(neighbor_types) < 2:
-                    # TODO: this is a little hacky and only covers some of the cases.
-                    query_neighbor_types = self.userquery.get_neighbor_types(node.node_type)
-                    graph_neighbor_type = list(neighbor_types)[0]
-                    if (graph_neighbor_type, graph_neighbor_type) not in query_neighbor_types:
-                        to_remove.append(node)
-            for node in to_remove:
-                removed = True
-                n_pruned += 1
-                self.graph.remove_node(node)
-        self.logger.debug('Pruned {} nodes.'.format(n_pruned))
-    '''
+        """Remove the dead ends the programs left: nodes that are on no path from the query's start to its
+        end, in any program (see prune.dead_ends).  The query's endpoints are kept.  Reports the numbers
+        of nodes and edges removed, which are also returned."""
+        n_nodes = len(self.graph.nodes())
+        dead = dead_ends(self.graph, self.userquery.get_programs(), keep=self.endpoint_nodes())
+        n_removed_edges = 0
+        for node in dead:
+            # An edge between two dead ends goes with the first of them
+            n_removed_edges += self.graph.degree(node)
+            self.graph.remove_node(node)
+            for k in self.node_records.pop(node).keys:
+                if self.node_map.get(k) is node:
+                    del self.node_map[k]
+        self.metrics.count('prune_nodes', len(dead))
+        self.metrics.count('prune_edges', n_removed_edges)
+        self.logger.info('Pruned %d of %d nodes and %d edges.', len(dead), n_nodes, n_removed_edges)
+        return len(dead), n_removed_edges
 
     def enhance(self):
         """Enhance nodes,edges with good labels and properties"""
         # TODO: it probably makes sense to push this stuff into the KNode itself
         self.logger.debug('Enhancing nodes with labels')
+        core = self.core()
         for node in self.graph.nodes():
             from greent.util import Text
             if Text.get_curie(node.identifier) == 'DOID':
                 print('NOOO {}'.format(node.identifier))
                 exit()
-            prepare_node_for_output(node, self.rosetta.core)
+            prepare_node_for_output(node, core)
 
-    def support(self, support_module_names):
-        """Look for extra information connecting nodes."""
-        supporters = [import_module(module_name).get_supporter(self.rosetta.core)
-                      for module_name in support_module_names]
+    def core(self):
+        """rosetta.core, limited by service_limits if there are any"""
+        if self.service_limits is None:
+            return self.rosetta.core
+        return self.service_limits.core(self.rosetta.core)
+
+    def support(self, support_module_names, chunk_size=1000):
+        """Look for extra information connecting nodes.
+        Pairs are worked through in chunks of chunk_size, which is the granularity of lookups in the
+        local support store and of checkpoints."""
+        supporters = []
+        for module_name in support_module_names:
+            try:
+                supporters.append(startup.load(module_name).get_supporter(self.core()))
+            except Exception:
+                self.logger.exception('Could not create supporter %s. Continuing without it.', module_name)
         # TODO: how do we want to handle support edges
         # Questions: Are they new edges even if we have an edge already, or do we integrate
         #            Do we look for edges within a layer, e.g. to identify similar concepts
@@ -334,96 +549,392 @@ class KnowledgeGraph:
         #
         # Generate paths, (unique) edges along paths
         self.logger.debug('Building Support')
-        #links_to_check = self.generate_links_from_paths()
-        links_to_check = self.generate_all_links()
-        self.logger.debug('Number of pairs to check: {}'.format(len(links_to_check)))
+        state = self.support_state or {}
+        links_to_check = state.get('links')
+        if links_to_check is None:
+            links_to_check = self.choose_links()
+            if self.support_budget is not None:
+                with self.metrics.timer('support_prioritize_seconds'):
+                    links_to_check = self.prioritize_links(links_to_check)
+        self.logger.debug('Number of pairs to check: %d', len(links_to_check))
         if len(links_to_check) == 0:
             self.logger.error('No paths across the data.  Exiting without writing.')
             sys.exit(1)
         # Check each edge, add any support found.
+        n_supported = state.get('n_supported', 0)
+        first_supporter = state.get('supporter', 0)
+        first_position = state.get('position', 0)
+        if first_supporter > 0 or first_position > 0:
+            self.logger.info('Resuming support at supporter %d, pair %d', first_supporter, first_position)
+        guards = [SupporterGuard(supporter) for supporter in supporters]
+        budget = self.support_budget
+        if budget is not None:
+            budget.start()
+        self.support_unevaluated = {}
+        for supporter_number, guard in enumerate(guards):
+            if supporter_number < first_supporter:
+                continue
+            name = guard.name
+            with self.metrics.timer('support_prepare_seconds', supporter=name):
+                guard.prepare(self.graph.nodes())
+            if self.support_store is not None:
+                # Registers the supporter, and invalidates its stored results if its data has changed
+                try:
+                    self.support_store.generation(name, getattr(guard.supporter, 'data_version', None))
+                except Exception as e:
+                    self.support_store_failed('generation', name, e)
+            position = first_position if supporter_number == first_supporter else 0
+            # Per-pair events go to DEBUG; INFO gets a running summary every 30 seconds
+            progress = ProgressLog(self.logger, name, total=len(links_to_check) - position)
+            if budget is not None:
+                budget.share(len(guards) - supporter_number)
+            while position < len(links_to_check):
+                if budget is not None and budget.exhausted():
+                    self.leave_unevaluated(name, links_to_check, position)
+                    break
+                size = chunk_size if budget is None else budget.chunk_size(chunk_size)
+                chunk = links_to_check[position:position + size]
+                if hasattr(chunk, 'tolist'):
+                    # Pairs spilled to disk by choose_links
+                    chunk = chunk.tolist()
+                n_supported += self.support_chunk(guard, chunk, progress)
+                position += len(chunk)
+                if budget is not None:
+                    budget.checked(len(chunk))
+                if self.checkpointer is not None and self.checkpointer.support_due():
+                    self.checkpoint('support', {'links': links_to_check, 'supporter': supporter_number,
+                                                'position': position, 'n_supported': n_supported})
+            progress.finish()
+        self.support_state = None
+        self.support_failures = [guard.summary() for guard in guards]
+        for summary in self.support_failures:
+            summary['unevaluated_pairs'] = len(self.support_unevaluated.get(summary['supporter'], ()))
+        for guard in guards:
+            guard.log_summary()
+        self.logger.info('Support Completed.  Added %d edges.', n_supported)
+
+    def prioritize_links(self, links):
+        """links ordered most promising first (see supportplan.prioritize)"""
+        if hasattr(links, 'tolist'):
+            # Spilled to disk because they don't fit in memory; sorting them would bring them back
+            self.logger.warning('Support pairs are on disk; checking them unordered')
+            return links
+        endpoints = self.endpoint_nodes()
+        known = frozenset()
+        if self.support_store is not None:
+            try:
+                known = self.support_store.identifiers()
+            except Exception as e:
+                self.support_store_failed('identifiers', 'all', e)
+        budget = self.memory_budget
+        # If choose_links settled for the pairs along query paths, being on one ranks no pair above another
+        if not self.links_on_paths:
+            if budget is not None and not budget.allows(len(links) * LINK_BYTES):
+                self.logger.warning('Not enough memory left to find the pairs along query paths; ordering without them')
+            else:
+                try:
+                    return prioritize(links, self.node_map, self.graph, endpoints, self.generate_links_from_paths(),
+                                      known)
+                except Exception:
+                    self.logger.exception('Could not find the pairs along query paths; ordering without them')
+        return prioritize(links, self.node_map, self.graph, endpoints, (), known)
+
+    def endpoint_nodes(self):
+        """The nodes of the graph that the query's start and end values name"""
+        definition = self.userquery.definition
+        endpoints = []
+        for identifier in (definition.start_values or []) + (definition.end_values or []):
+            iid = self.ids.get(identifier)
+            if iid is not None and iid in self.node_map:
+                endpoints.append(self.node_map[iid])
+        return endpoints
+
+    def leave_unevaluated(self, name, links, position):
+        """Record that the budget ran out for supporter name with the pairs from position on unchecked"""
+        unevaluated = links[position:]
+        self.support_unevaluated[name] = unevaluated
+        self.metrics.count('support_unevaluated', len(unevaluated), supporter=name)
+        self.logger.warning('Support budget for %s spent with %d of %d pairs left unevaluated',
+                            name, len(unevaluated), len(links))
+
+    def write_unevaluated(self, filename):
+        """Write the pairs budgeted support didn't get to, as supporter, source and target identifiers"""
+        with open(filename, 'w') as outf:
+            outf.write('supporter\tsource\ttarget\n')
+            for name, links in self.support_unevaluated.items():
+                for source_id, target_id in links:
+                    outf.write('{}\t{}\t{}\n'.format(name, self.node_map[int(source_id)].identifier,
+                                                    self.node_map[int(target_id)].identifier))
+
+    def support_chunk(self, guard, chunk, progress):
+        """Check one chunk of (interned id) pairs with one supporter, and add any support found.
+        Pairs the supporter can't answer (Supporter.eligible_pairs) are dropped before any lookup.
+        Results come from the local support store if there is one, then the Rosetta cache, and the
+        rest are computed in one term_to_terms call.  Returns the number of support edges found."""
+        supporter = guard.supporter
+        name = guard.name
+        self.metrics.count('support_pairs', len(chunk), supporter=name)
+        if guard.disabled:
+            source_id, target_id = chunk[0]
+            guard.skip(support_key(supporter, self.node_map[source_id], self.node_map[target_id])[0], n=len(chunk))
+            self.metrics.count('support_skipped', len(chunk), supporter=name)
+            progress.event('skipped', n=len(chunk))
+            return 0
+        pairs = [(self.node_map[source_id], self.node_map[target_id]) for source_id, target_id in chunk]
+        # Supporters written without the Supporter base class are asked about every pair
+        eligible = set((id(a), id(b)) for a, b in getattr(supporter, 'eligible_pairs', list)(pairs))
+        rows = []
+        for (source_id, target_id), pair in zip(chunk, pairs):
+            if (id(pair[0]), id(pair[1])) in eligible:
+                rows.append((source_id, target_id) + pair + support_key(supporter, *pair))
+        if len(rows) < len(chunk):
+            self.metrics.count('support_ineligible', len(chunk) - len(rows), supporter=name)
+            progress.event('ineligible', n=len(chunk) - len(rows))
+        stored = {}
+        if self.support_store is not None:
+            # If the store can't be read, the pairs are looked up as though it had nothing
+            try:
+                stored = self.support_store.get_many(name, [(first.identifier, second.identifier)
+                                                            for _, _, _, _, _, first, second, _ in rows])
+            except Exception as e:
+                self.support_store_failed('get_many', name, e)
+        new_results = []
+        to_compute = []
         n_supported = 0
-        for supporter in supporters:
-            supporter.prepare(self.graph.nodes())
-            for source, target in links_to_check:
-                key = f"{supporter.__class__.__name__}({source.identifier},{target.identifier})"
-                log_text = "  -- {key}"
-                support_edge = self.rosetta.cache.get (key)
-                if support_edge is not None:
-                    self.logger.info (f"cache hit: {key} {support_edge}")
+        for row in rows:
+            source_id, target_id, source, target, key, first, second, swapped = row
+            if swapped:
+                self.metrics.count('support_pairs_swapped', supporter=name)
+            # Anything that goes wrong with one pair is recorded against the supporter, and we move on
+            try:
+                support_edge = stored.get((first.identifier, second.identifier), MISSING)
+                if support_edge is not MISSING:
+                    progress.event('stored', key)
+                    self.metrics.count('support_store_hits', supporter=name)
                 else:
-                    self.logger.info (f"exec op: {key}")
-                    support_edge = supporter.term_to_term(source, target)
-                    self.rosetta.cache.set (key, support_edge)
-                if support_edge is not None:
-                    n_supported += 1
-                    self.logger.debug('  -Adding support edge from {} to {}'.
-                                      format(source.identifier, target.identifier))
-                    self.add_nonsynonymous_edge(support_edge)
-        self.logger.debug('Support Completed.  Added {} edges.'.format(n_supported))
+                    support_edge = self.rosetta.cache.get (key)
+                    if support_edge is None:
+                        to_compute.append(row)
+                        continue
+                    progress.event('cache hits', key)
+                    self.metrics.count('support_cache_hits', supporter=name)
+                    new_results.append(((first.identifier, second.identifier), support_edge))
+                n_supported += self.add_support_edge(guard, row, support_edge)
+            except Exception as e:
+                guard.record_failure(key, e, call=False)
+                self.metrics.count('support_errors', supporter=name, error=type(e).__name__)
+                progress.event('errors')
+        for row, support_edge in zip(to_compute, self.compute_support(guard, to_compute, progress)):
+            if support_edge is MISSING:
+                # Failed, and recorded by compute_support.  Let anyone waiting on the key try it themselves.
+                getattr(self.rosetta.cache, 'release', lambda key: None)(row[4])
+                continue
+            source_id, target_id, source, target, key, first, second, swapped = row
+            try:
+                self.rosetta.cache.set (key, support_edge)
+                new_results.append(((first.identifier, second.identifier), support_edge))
+                n_supported += self.add_support_edge(guard, row, support_edge)
+            except Exception as e:
+                guard.record_failure(key, e, call=False)
+                self.metrics.count('support_errors', supporter=name, error=type(e).__name__)
+                progress.event('errors')
+        if self.support_store is not None and len(new_results) > 0:
+            try:
+                self.support_store.put_many(name, new_results)
+            except Exception as e:
+                self.support_store_failed('put_many', name, e)
+        return n_supported
+
+    def support_store_failed(self, operation, name, exception):
+        """Record that the support store failed (e.g. locked by another process, or a full disk); support
+        carries on without it"""
+        self.logger.warning('Support store %s failed for %s: %s: %s', operation, name, type(exception).__name__,
+                            exception)
+        self.metrics.count('support_store_errors', supporter=name, operation=operation,
+                           error=type(exception).__name__)
+
+    def compute_support(self, guard, rows, progress):
+        """Ask the supporter about rows (from support_chunk) that no store or cache could answer.  A
+        supporter with a bulk lookup of its own is asked about them all in one term_to_terms call; the
+        pairs that fails for (all of them, if the call itself raised) are retried one term_to_term at a
+        time, keeping the results the bulk call did get.  Other supporters are asked a pair at a time,
+        until the guard disables them.  Pairs that fail are recorded against the guard and come back as
+        MISSING, as do pairs skipped once the supporter is disabled."""
+        if len(rows) == 0:
+            return []
+        supporter = guard.supporter
+        name = guard.name
+        pairs = [(first, second) for _, _, _, _, _, first, second, _ in rows]
+        self.metrics.count('support_cache_misses', len(rows), supporter=name)
+        results = [MISSING] * len(rows)
+        pending = range(len(rows))
+        if has_bulk_lookup(supporter):
+            self.count_support_calls(guard, len(rows), progress)
+            try:
+                with self.metrics.timer('support_batch_seconds', supporter=name):
+                    results = list(supporter.term_to_terms(pairs))
+                if len(results) != len(pairs):
+                    raise ValueError('{} results for {} pairs'.format(len(results), len(pairs)))
+                pending = [i for i, result in enumerate(results) if isinstance(result, SupportFailure)]
+                if len(pending) > 0:
+                    self.logger.debug('%s term_to_terms failed on %d of %d pairs; retrying them one at a time',
+                                      name, len(pending), len(pairs))
+            except Exception as e:
+                self.logger.debug('%s term_to_terms failed (%s); retrying %d pairs one at a time', name, e, len(pairs))
+                self.metrics.count('support_batch_errors', supporter=name, error=type(e).__name__)
+                results = [MISSING] * len(rows)
+        for i in pending:
+            key = rows[i][4]
+            if guard.disabled:
+                guard.skip(key)
+                self.metrics.count('support_skipped', supporter=name)
+                progress.event('skipped')
+                results[i] = MISSING
+                continue
+            self.count_support_calls(guard, 1, progress)
+            with self.metrics.timer('support_call_seconds', supporter=name):
+                result = term_to_terms(supporter, [pairs[i]])[0]
+            if isinstance(result, SupportFailure):
+                guard.record_failure(key, result.exception)
+                self.metrics.count('support_errors', supporter=name, error=type(result.exception).__name__)
+                progress.event('errors')
+                result = MISSING
+            results[i] = result
+        return results
+
+    def count_support_calls(self, guard, n, progress):
+        """n more lookups for guard's supporter"""
+        progress.event('calls', n=n)
+        guard.calls += n
+        if self.support_budget is not None:
+            self.support_budget.charge(n)
+
+    def add_support_edge(self, guard, row, support_edge):
+        """Add a support edge found for a row from support_chunk.  Returns 1 if there was one, else 0."""
+        if support_edge is None:
+            return 0
+        source_id, target_id, source, target, key, first, second, swapped = row
+        support_edge = orient_support_edge(guard.supporter, support_edge, source, target, swapped)
+        self.logger.debug('  -Adding support edge from %s to %s', source.identifier, target.identifier)
+        self.support_table.add_ids(guard.name, source_id, target_id, support_edge)
+        if self.add_nonsynonymous_edge(support_edge) and self.exporter is not None:
+            self.exporter.put_edge((support_edge.source_node, support_edge.target_node, {'object': support_edge}))
+        self.metrics.count('support_edges_added', supporter=guard.name)
+        return 1
+
+    def choose_links(self):
+        """The pairs for support to check: a list of interned id pairs rather than a set, so that a resumed
+        run walks the pairs in the same order.  Normally every pair of nodes; if that would take the build
+        over its memory budget, only the pairs along query paths; and if those won't fit either (or there
+        are none), the pairs are kept in a disk-backed array."""
+        n_nodes = len(self.graph.nodes())
+        n_pairs = n_nodes * (n_nodes - 1) // 2
+        budget = self.memory_budget
+        self.links_on_paths = False
+        if budget is None or budget.allows(n_pairs * LINK_BYTES):
+            #return list(self.generate_links_from_paths())
+            return list(self.generate_all_links())
+        self.logger.warning('All %d pairs would need about %s, over the memory budget (%s in use of %s). '
+                            'Checking pairs along query paths only.', n_pairs, megabytes(n_pairs * LINK_BYTES),
+                            megabytes(budget.used()), megabytes(budget.max_bytes))
+        self.metrics.count('memory_degraded', action='path_links')
+        self.links_on_paths = True
+        # Kept in memory while they fit in what the budget has left, and spilled to disk as they come once they don't
+        room = max(0, budget.max_bytes - budget.used()) // LINK_BYTES
+        pairs = iter(self.generate_links_from_paths())
+        links = list(islice(pairs, room + 1))
+        if 0 < len(links) <= room:
+            links.sort()
+            return links
+        if len(links) > 0:
+            self.logger.warning('The path pairs are still over the memory budget (room for %d); spilling them to disk',
+                                room)
+            blocks = pair_blocks(pairs, links)
+            del links
+        else:
+            self.links_on_paths = False
+            self.logger.warning('No path pairs found; spilling all %d pairs to disk', n_pairs)
+            blocks = self.all_link_blocks()
+        self.metrics.count('memory_degraded', action='spill_links')
+        # With checkpoints on, the pairs are kept next to them, so that a checkpoint can refer to them
+        return spill_pairs(blocks, path=self.checkpointer.links_path() if self.checkpointer is not None else None)
+
+    def all_link_blocks(self):
+        """The pairs of generate_all_links, a block (all pairs with one first node) at a time"""
+        idlist = [self.node_records[node].iid for node in self.graph.nodes()]
+        for i, id_i in enumerate(idlist):
+            yield [(id_i, id_j) for id_j in idlist[i+1:]]
 
     def generate_all_links(self):
-        links_to_check = set()
-        nodelist = self.graph.nodes()
-        for i,node_i in enumerate(nodelist):
-            for node_j in nodelist[i+1:]:
-                links_to_check.add( (node_i, node_j) )
+        """Every pair of nodes in the graph, as pairs of interned ids"""
+        links_to_check = []
+        idlist = [self.node_records[node].iid for node in self.graph.nodes()]
+        for i,id_i in enumerate(idlist):
+            for id_j in idlist[i+1:]:
+                links_to_check.append( (id_i, id_j) )
         return links_to_check
 
     def generate_links_from_paths(self):
-        """This is going to assume that the first node is 0, which is bogus, but this is temp until support plan is figured out"""
-        links_to_check = set()
-        for program in self.userquery.get_programs():
-            ancestors = defaultdict(set)
-            current_nodes = set()
-            program_number = program.program_number
-            for node in self.graph.nodes():
-                if 0 in node.contexts[program_number]: #start node
-                    current_nodes.add(node)
-            path = program.get_path_descriptor()
-            nodenum = 0
-            while nodenum in path:
-                next_context,direction = path[nodenum]
-                self.logger.debug('Nodenum: {} {}'.format(nodenum,next_context))
-                next_nodes = set()
-                for node in current_nodes:
-                    self.logger.debug(' Current Node: {}'.format(node.identifier))
-                    if direction > 0:
-                        others = self.graph.successors(node)
-                    else:
-                        others = self.graph.predecessors(node)
-                    for other in others:
-                        self.logger.debug('  Testing other: {} {}=?={}'.format(other.identifier, other.contexts[program_number], next_context))
-                        if next_context in other.contexts[program_number]:
-                            self.logger.debug('Adding context for {}'.format(other))
-                            ancestors[other].add(node)
-                            ancestors[other].update(ancestors[node])
-                            next_nodes.add(other)
-                nodenum = next_context
-                current_nodes = next_nodes
-            for key in ancestors:
-                self.logger.debug("Ancestorkey {}".format(key))
-                for a in ancestors[key]:
-                    links_to_check.add( (key, a) )
-        return links_to_check
+        """Yields the pairs (interned ids) of each node and the nodes before it on a path of any of the query's
+        programs, once each.  Paths start at the nodes at position 0 (see pathlinks.path_pairs)."""
+        node_records = self.node_records
+        return startup.load('pathlinks').path_pairs(self.graph, self.userquery.get_programs(),
+                                                     lambda node: node_records[node].iid)
 
-    def export(self):
+    def export(self, chunk_size=1000):
         """Export to neo4j database."""
         # TODO: lots of this should probably go in the KNode and KEdge objects?
         self.logger.info("Writing to neo4j")
-        session = self.driver.session()
-        # Now add all the nodes
+        # One session, and a transaction per chunk of writes (retried by the Database on transient errors).
+        # Timings are taken per chunk, which is cheap enough to leave on.
+        with self.database.session() as session:
+            nodes = self.graph.nodes()
+            for chunk_start in range(0, len(nodes), chunk_size):
+                with self.metrics.timer('export_chunk_seconds', kind='node'):
+                    self.database.write(write_each, self.write_node, nodes[chunk_start:chunk_start + chunk_size],
+                                        session=session)
+            self.metrics.count('export_nodes', len(nodes))
+            edges = self.graph.edges(data=True)
+            for chunk_start in range(0, len(edges), chunk_size):
+                with self.metrics.timer('export_chunk_seconds', kind='edge'):
+                    self.database.write(write_each, export_edge, edges[chunk_start:chunk_start + chunk_size],
+                                        session=session)
+            self.metrics.count('export_edges', len(edges))
+        self.logger.info("Wrote %d nodes.", len(self.graph.nodes()))
+
+    def start_export(self, exporter):
+        """Begin writing the graph in the background.  Called once nodes are final (after enhance):
+        all nodes and the edges found so far are queued, and from then on support streams each new
+        edge to the exporter as it is found."""
+        self.logger.info("Writing to neo4j in the background")
+        self.exporter = exporter
         for node in self.graph.nodes():
-            export_node(node, session)
+            self.exported_synonym_counts[node] = len(node.synonyms)
+            exporter.put_node(self.export_snapshot(node))
+        exporter.nodes_complete()
         for edge in self.graph.edges(data=True):
-            export_edge(edge,session)
-        session.close()
-        self.logger.info("Wrote {} nodes.".format(len(self.graph.nodes())))
+            exporter.put_edge(edge)
+
+    def finish_export(self):
+        """Re-queue nodes that changed since they were queued (supporters can add synonyms in prepare),
+        then flush the exporter and wait for it.  Raises exporter.ExportError if anything couldn't be
+        written."""
+        for node in self.graph.nodes():
+            if len(node.synonyms) != self.exported_synonym_counts.get(node):
+                self.exporter.put_node(self.export_snapshot(node))
+        try:
+            self.exporter.close()
+        finally:
+            self.exporter = None
+        self.logger.info("Wrote %d nodes.", len(self.graph.nodes()))
 
 
 # TODO: push to node, ...
 def prepare_node_for_output(node, gt):
-    logging.getLogger('application').debug('Prepare: {}'.format(node.identifier))
-    logging.getLogger('application').debug('  Synonyms: {}'.format(' '.join(list(node.synonyms))))
+    logger = logging.getLogger('application')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Prepare: %s', node.identifier)
+        logger.debug('  Synonyms: %s', ' '.join(list(node.synonyms)))
     node.synonyms.update([mi['curie'] for mi in node.mesh_identifiers if mi['curie'] != ''])
     if node.node_type == node_types.DISEASE or node.node_type == node_types.GENETIC_CONDITION:
         if 'mondo_identifiers' in node.properties:
@@ -442,7 +953,7 @@ def prepare_node_for_output(node, gt):
             node.label = gt.uberongraph.cell_get_cellname(node.identifier)[0]['cellLabel']
         else:
             node.label = node.identifier
-    logging.getLogger('application').debug(node.label)
+    logger.debug(node.label)
 
 '''
 # Push to edge...
@@ -470,21 +981,140 @@ def prepare_edge_for_output(edge):
     '''
 
 
-def run_query(querylist, supports, rosetta, prune=False):
-    """Given a query, create a knowledge graph though querying external data sources.  Export the graph"""
-    kgraph = KnowledgeGraph(querylist, rosetta)
-    kgraph.execute()
+def run_query(querylist, supports, rosetta, prune=False, checkpoint_dir=None, resume=False,
+              metrics_json=None, metrics_prometheus=None, export_writers=0, support_table=None, support_store=None,
+              edge_store=None, edge_store_ttl=DEFAULT_TTL, memory_profile=False, memory_budget=None,
+              db_sessions=8, database=None, on_stage=None, program_workers=1, support_seconds=None,
+              support_calls=None, unevaluated=None, snapshot_in=None, snapshot_out=None, synonymize_workers=8,
+              service_limits=None, snapshot_any_query=False):
+    """Given a query, create a knowledge graph though querying external data sources.  Export the graph.
+    With prune=True, nodes on no path between the query's endpoints are removed before enhance.
+    If checkpoint_dir is given, the graph is checkpointed there after each stage, and with resume=True
+    the run picks up after the last completed stage (or part way through support).
+    If metrics_json or metrics_prometheus are given, timings and counters for each stage are written there.
+    With export_writers > 0, the graph is written to neo4j by that many background writers while support runs.
+    If support_table is given, the support results and their ranking features are written there
+    (.parquet or .arrow with pyarrow installed, otherwise .npz).
+    support_store is the path of a local SupportResultStore to read and save support results.
+    edge_store is the path of a local EdgeResultStore of program steps, shared by the queries of a batch;
+    steps older than edge_store_ttl seconds are fetched again.
+    With memory_profile=True, tracemalloc snapshots are logged after each stage.  memory_budget (bytes)
+    limits resident memory: support degrades to fewer or disk-backed pairs rather than exceed it.
+    The graph is written through database (a dbaccess.Database), which a batch of concurrent queries
+    can share so that together they stay within its sessions; by default one with db_sessions sessions.
+    With program_workers > 1 the query's programs run concurrently, coalescing identical service calls.
+    With synonymize_workers > 0 each program step's nodes are synonymized as a batch, misses in that many
+    threads; 0 leaves synonymization to the programs, a node at a time.
+    support_seconds and support_calls limit support, which then checks the most promising pairs first;
+    the pairs left unevaluated are written to unevaluated, if given.
+    With snapshot_in, the graph is loaded from that snapshot rather than crawled for; its support edges are
+    dropped and support runs again if any supports are given, otherwise it goes straight to export.  A
+    snapshot taken for another query is refused unless snapshot_any_query.
+    snapshot_out, if given, is where a snapshot of the graph is written after support.
+    With service_limits (a ratelimit.ServiceLimits, which queries in one process can share), remote calls
+    go through its adaptive per-service limits.
+    Each supporter's calls, failed and skipped pairs (see SupporterGuard.summary) are kept as the
+    KnowledgeGraph's support_failures and written to metrics_json under details.support.
+    on_stage(stage), if given, is called as each stage completes.  Returns the KnowledgeGraph."""
+    checkpointer = None
+    if checkpoint_dir is not None:
+        checkpointer = Checkpointer(checkpoint_dir, query_fingerprint(querylist, supports))
+    instrumentation = None
+    if metrics_json is not None or metrics_prometheus is not None:
+        instrumentation = Instrumentation()
+    profiler = None
+    if memory_profile:
+        profiler = MemoryProfiler(instrumentation=instrumentation)
+        profiler.start()
+    budget = MemoryBudget(memory_budget) if memory_budget is not None else None
+    store = SupportResultStore(support_store) if support_store is not None else None
+    steps = EdgeResultStore(edge_store, ttl=edge_store_ttl) if edge_store is not None else None
+    if database is None:
+        database = Database(rosetta.type_graph.driver, max_sessions=db_sessions, instrumentation=instrumentation)
+    if service_limits is not None and instrumentation is not None:
+        service_limits.instrument(instrumentation)
+    support_budget = None
+    if support_seconds is not None or support_calls is not None:
+        support_budget = SupportBudget(seconds=support_seconds, calls=support_calls)
+    kgraph = KnowledgeGraph(querylist, rosetta, checkpointer, instrumentation, store, steps, budget, database,
+                            program_workers=program_workers, support_budget=support_budget,
+                            synonymize_workers=synonymize_workers, service_limits=service_limits)
+    metrics = kgraph.metrics
+    completed = kgraph.resume() if resume else None
+    done = 0 if completed is None else STAGES.index(completed) + 1
+    if snapshot_in is not None and completed is None:
+        with metrics.timer('stage_seconds', stage='snapshot_in'):
+            stage = kgraph.load_snapshot(snapshot_in, keep_support=not supports, any_query=snapshot_any_query)
+        done = STAGES.index(stage) + 1
+        if supports:
+            done = min(done, STAGES.index('support'))
+    if done == len(STAGES):
+        logging.getLogger('application').info('Checkpoint shows this query is already exported.')
+        return kgraph
+    if done < 1:
+        with metrics.timer('stage_seconds', stage='execute'):
+            kgraph.execute()
+        kgraph.checkpoint('execute')
+        if profiler is not None:
+            profiler.snapshot('execute')
+        if on_stage is not None:
+            on_stage('execute')
     kgraph.print_types()
-    #if prune:
-    #    kgraph.prune()
-    kgraph.enhance()
-    kgraph.support(supports)
-    kgraph.export()
+    if done < 2:
+        if prune:
+            with metrics.timer('stage_seconds', stage='prune'):
+                kgraph.prune()
+        with metrics.timer('stage_seconds', stage='enhance'):
+            kgraph.enhance()
+        kgraph.checkpoint('enhance')
+        if profiler is not None:
+            profiler.snapshot('enhance')
+        if on_stage is not None:
+            on_stage('enhance')
+    if export_writers > 0:
+        kgraph.start_export(BackgroundExporter(database, export_node_snapshot, export_edge, n_writers=export_writers,
+                                               instrumentation=instrumentation))
+    if done < 3:
+        with metrics.timer('stage_seconds', stage='support'):
+            kgraph.support(supports)
+        kgraph.checkpoint('support')
+        if support_table is not None:
+            kgraph.support_table.write(support_table)
+        if unevaluated is not None:
+            kgraph.write_unevaluated(unevaluated)
+        metrics.detail('support', kgraph.support_failures)
+        if profiler is not None:
+            profiler.snapshot('support')
+        if on_stage is not None:
+            on_stage('support')
+    if snapshot_out is not None:
+        with metrics.timer('stage_seconds', stage='snapshot_out'):
+            kgraph.save_snapshot(snapshot_out, 'support')
+    with metrics.timer('stage_seconds', stage='export'):
+        if export_writers > 0:
+            kgraph.finish_export()
+        else:
+            kgraph.export()
+    kgraph.checkpoint('export')
+    if profiler is not None:
+        profiler.snapshot('export')
+        profiler.stop()
+    if on_stage is not None:
+        on_stage('export')
+    if store is not None:
+        store.close()
+    if steps is not None:
+        steps.close()
+    if metrics_json is not None:
+        instrumentation.write_json(metrics_json)
+    if metrics_prometheus is not None:
+        instrumentation.write_prometheus(metrics_prometheus)
+    return kgraph
 
 
 def generate_query(pathway, start_identifiers, end_identifiers=None):
     start, middle, end = pathway[0], pathway[1:-1], pathway[-1]
-    query = UserQuery(start_identifiers, start.nodetype)
+    query = startup.load('userquery').UserQuery(start_identifiers, start.nodetype)
     print(start.nodetype)
     for transition in middle:
         print(transition)
@@ -494,40 +1124,94 @@ def generate_query(pathway, start_identifiers, end_identifiers=None):
     return query
 
 
-def run(pathway, start_name, end_name,  supports, config):
-    """Programmatic interface.  Pathway defined as in the command-line input.
-       Arguments:
-         pathway: A string defining the query.  See command line help for details
-         start_name: The name of the entity at one end of the query
-         end_name: The name of the entity at the other end of the query. Can be None.
-         label: the label designating the result in neo4j
-         supports: array strings designating support modules to apply
-         config: Rosettta environment configuration. 
-    """
+def build_query(pathway, start_name, end_name, rosetta, service_limits=None):
+    """The UserQuery for a pathway (as on the command line) between the named start and end (end may be None).
+    The names are looked up through service_limits, if given."""
     # TODO: move to a more structured pathway description (such as json)
     steps = tokenize_path(pathway)
     # start_type = node_types.type_codes[pathway[0]]
     start_type = steps[0].nodetype
-    rosetta = setup(config)
-    start_identifiers = lookup_identifier(start_name, start_type, rosetta.core)
+    core = rosetta.core if service_limits is None else service_limits.core(rosetta.core)
+    start_identifiers = lookup_identifier(start_name, start_type, core)
     if end_name is not None:
         # end_type = node_types.type_codes[pathway[-1]]
         end_type = steps[-1].nodetype
-        end_identifiers = lookup_identifier(end_name, end_type, rosetta.core)
+        end_identifiers = lookup_identifier(end_name, end_type, core)
     else:
         end_identifiers = None
     print("Start identifiers: " + '..'.join(start_identifiers))
-    query = generate_query(steps, start_identifiers, end_identifiers)
-    run_query(query, supports, rosetta, prune=False)
+    return generate_query(steps, start_identifiers, end_identifiers)
+
+
+def run(pathway, start_name, end_name,  supports, config, checkpoint_dir=None, resume=False,
+        metrics_json=None, metrics_prometheus=None, log_level='DEBUG', export_writers=0, support_table=None,
+        support_store=None, edge_store=None, edge_store_ttl=DEFAULT_TTL, memory_profile=False, memory_budget=None,
+        db_sessions=8, program_workers=1, support_seconds=None, support_calls=None, unevaluated=None, prune=False,
+        snapshot_in=None, snapshot_out=None, synonymize_workers=8, limit_services=False, service_ceilings=None,
+        snapshot_any_query=False):
+    """Programmatic interface.  Pathway defined as in the command-line input.
+       Arguments:
+         pathway: A string defining the query.  See command line help for details
+         start_name: The name of the entity at one end of the query
+         end_name: The name of the entity at the other end of the query. Can be None.
+         label: the label designating the result in neo4j
+         supports: array strings designating support modules to apply
+         config: Rosettta environment configuration. 
+         checkpoint_dir: directory in which to checkpoint the graph after each stage (optional)
+         resume: pick up from the last checkpoint in checkpoint_dir
+         metrics_json: file to write a JSON report of per-stage timings and counters (optional)
+         metrics_prometheus: file to write the same metrics in the Prometheus text format (optional)
+         log_level: level for the application log.  At INFO, per-pair support lines become periodic summaries.
+         export_writers: if > 0, export to neo4j with this many background writers, overlapping support
+         support_table: file for the columnar support results and ranking features (optional)
+         support_store: path of a local store of support results, reused across runs (optional)
+         edge_store: path of a local store of program steps, shared by the queries of a batch (optional)
+         edge_store_ttl: seconds before a stored program step is fetched again
+         memory_profile: log where memory is going after each stage (slows the build down)
+         memory_budget: bytes of resident memory that support should stay within (optional)
+         db_sessions: most neo4j sessions open at once (export writers included)
+         program_workers: threads to run the query's programs in
+         synonymize_workers: threads for synonymizing each program step's nodes as a batch; 0 for a node at a time
+         limit_services: put remote calls through adaptive per-service limits (see ratelimit.py)
+         service_ceilings: service name -> most calls in flight to it, whatever its adaptive limit; implies limit_services
+         support_seconds: wall-clock budget for support, which then checks the most promising pairs first (optional)
+         support_calls: budget of supporter calls, likewise (optional)
+         unevaluated: file to list the pairs a budgeted support didn't get to (optional)
+         prune: remove the nodes that are on no path between the query's endpoints before support
+         snapshot_in: load the graph from this snapshot (built for the same query) instead of crawling (optional)
+         snapshot_out: write a snapshot of the graph here after support (optional)
+         snapshot_any_query: load snapshot_in even if it was taken for a different query
+    """
+    rosetta = setup(config, log_level)
+    service_limits = None
+    if limit_services or service_ceilings is not None:
+        service_limits = ServiceLimits(service_ceilings)
+    query = build_query(pathway, start_name, end_name, rosetta, service_limits)
+    run_query(query, supports, rosetta, prune=prune, checkpoint_dir=checkpoint_dir, resume=resume,
+              metrics_json=metrics_json, metrics_prometheus=metrics_prometheus, export_writers=export_writers,
+              support_table=support_table, support_store=support_store, edge_store=edge_store,
+              edge_store_ttl=edge_store_ttl, memory_profile=memory_profile, memory_budget=memory_budget,
+              db_sessions=db_sessions, program_workers=program_workers, support_seconds=support_seconds,
+              support_calls=support_calls, unevaluated=unevaluated, snapshot_in=snapshot_in,
+              snapshot_out=snapshot_out, synonymize_workers=synonymize_workers, service_limits=service_limits,
+              snapshot_any_query=snapshot_any_query)
 
 
-def setup(config):
+def setup(config, log_level='DEBUG'):
     logger = logging.getLogger('application')
-    logger.setLevel(level=logging.DEBUG)
-    rosetta = Rosetta(greentConf=config,debug=True)
+    logger.setLevel(level=getattr(logging, log_level))
+    rosetta = startup.load('greent.rosetta').Rosetta(greentConf=config,debug=True)
     return rosetta
 
 
+# The pathways of the -q shortcuts
+QUESTIONS = {1: 'DGX', 2: 'SGPCATD', 3: 'SGPCAT'}
+
+# The supporters that can be asked for with -s, and what they look for
+SUPPORTERS = {'omnicorp': 'Pubmed articles mentioning both nodes (OmniCorp)',
+              'chemotext': 'Co-occurrence of MeSH terms in Pubmed abstracts',
+              'cdw': 'Co-occurrence of ICD9 codes in the Carolina Data Warehouse'}
+
 helpstring = """Execute a query across all configured data sources.  The query is defined 
 using the -p argument, which takes a string.  Each character in the string 
 represents one high-level type of node that will be sequentially included 
@@ -562,13 +1246,13 @@ Examples:
 
 
 def main():
+    started = time.perf_counter()
     parser = argparse.ArgumentParser(description=helpstring,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('-s', '--support', help='Name of the support system',
+    parser.add_argument('-s', '--support', help='Name of the support system (required to run a query)',
                         action='append',
                         #choices=['chemotext', 'chemotext2', 'cdw'],
-                        choices=['omnicorp', 'chemotext', 'cdw'],
-                        required=True)
+                        choices=list(SUPPORTERS))
     parser.add_argument('-p', '--pathway', help='Defines the query pathway (see description). Cannot be used with -q',
                         required=False)
     parser.add_argument('-q', '--question',
@@ -578,29 +1262,111 @@ def main():
                         type=int)
     parser.add_argument('-c', '--config', help='Rosetta environment configuration file.',
                         default='greent.conf')
-    parser.add_argument('--start', help='Text to initiate query', required=True)
+    parser.add_argument('--start', help='Text to initiate query (required to run a query)', required=False)
     parser.add_argument('--end', help='Text to finalize query', required=False)
+    parser.add_argument('--checkpoint-dir', help='Directory for checkpoints written after each stage and during support',
+                        required=False)
+    parser.add_argument('--resume', help='Resume from the last checkpoint in --checkpoint-dir',
+                        action='store_true')
+    parser.add_argument('--metrics-json', help='Write per-stage timings and counters to this file as JSON',
+                        required=False)
+    parser.add_argument('--metrics-prometheus', help='Write per-stage timings and counters to this file as Prometheus metrics',
+                        required=False)
+    parser.add_argument('--log-level', help='Level for the application log. INFO replaces per-pair support lines with periodic summaries',
+                        choices=['DEBUG', 'INFO', 'WARNING'], default='DEBUG')
+    parser.add_argument('--export-writers', help='Export with this many background writers, overlapping the support stage',
+                        type=int, default=0)
+    parser.add_argument('--support-table', help='Write support results and ranking features to this file (.parquet, .arrow or .npz)',
+                        required=False)
+    parser.add_argument('--support-store', help='Local SQLite store of support results, reused across runs',
+                        required=False)
+    parser.add_argument('--edge-store', help='Local SQLite store of program steps, shared by the queries of a batch',
+                        required=False)
+    parser.add_argument('--edge-store-ttl', help='Hours before a stored program step is fetched again',
+                        type=float, default=DEFAULT_TTL / 3600)
+    parser.add_argument('--memory-profile', help='Log tracemalloc snapshots of where memory goes after each stage',
+                        action='store_true')
+    parser.add_argument('--memory-budget', help='Resident memory (e.g. 8G) that support degrades to stay within',
+                        type=parse_size, required=False)
+    parser.add_argument('--db-sessions', help='Most neo4j sessions open at once, export writers included',
+                        type=int, default=8)
+    parser.add_argument('--program-workers', help="Threads to run the query's programs in, coalescing identical calls",
+                        type=int, default=1)
+    parser.add_argument('--synonymize-workers', help="Threads for synonymizing each program step's nodes as a batch; 0 synonymizes a node at a time",
+                        type=int, default=8)
+    parser.add_argument('--limit-services', help='Adapt the calls in flight to each remote service to its latency and errors',
+                        action='store_true')
+    parser.add_argument('--service-ceilings', help='Most calls in flight to a service, whatever its adaptive limit, e.g. omnicorp=4,chemotext=2; implies --limit-services',
+                        type=parse_ceilings, required=False)
+    parser.add_argument('--support-seconds', help='Wall-clock budget for support, which then checks the most promising pairs first',
+                        type=float, required=False)
+    parser.add_argument('--support-calls', help='Budget of supporter calls, which likewise orders the pairs',
+                        type=int, required=False)
+    parser.add_argument('--unevaluated', help='Write the pairs a budgeted support did not get to to this file',
+                        required=False)
+    parser.add_argument('--prune', help="Remove dead ends (nodes on no path between the query's endpoints) before support",
+                        action='store_true')
+    parser.add_argument('--snapshot-in', help='Load the graph from this snapshot (taken for the same query) instead of crawling',
+                        required=False)
+    parser.add_argument('--snapshot-any-query', help='Load --snapshot-in even if it was taken for a different query',
+                        action='store_true')
+    parser.add_argument('--snapshot-out', help='Write a binary snapshot of the graph to this directory after support',
+                        required=False)
+    parser.add_argument('--list-supports', help='List the support systems and exit', action='store_true')
+    parser.add_argument('--validate', help='Check the pathway (-p or -q) and exit without running the query',
+                        action='store_true')
+    parser.add_argument('--import-report', help='Print how long the deferred module loads took', action='store_true')
     args = parser.parse_args()
+    if args.list_supports:
+        for name in SUPPORTERS:
+            print('{:<12} {}'.format(name, SUPPORTERS[name]))
+        return
     pathway = None
     if args.pathway is not None and args.question is not None:
         print('Cannot specify both question and pathway. Exiting.')
         sys.exit(1)
     if args.question is not None:
-        if args.question == 1:
-            pathway = 'DGX'
-            if args.end is not None:
-                print('--end argument not supported for question 1.  Ignoring')
-        elif args.question == 2:
-            pathway = 'SGPCATD'
-        elif args.question == 3:
-            pathway = 'SGPCAT'
-        if args.question in (2, 3):
+        pathway = QUESTIONS[args.question]
+        if args.question == 1 and args.end is not None:
+            print('--end argument not supported for question 1.  Ignoring')
+        if args.question in (2, 3) and not args.validate:
             if args.end is None:
                 print('--end required for question 2. Exiting')
                 sys.exit(1)
     else:
         pathway = args.pathway
-    run(pathway, args.start, args.end, args.support, config=args.config)
+    if args.validate:
+        if pathway is None:
+            print('--validate needs a pathway (-p or -q). Exiting')
+            sys.exit(1)
+        try:
+            steps = tokenize_path(pathway)
+        except (TypeError, ValueError) as e:
+            print('Invalid pathway {}: {}'.format(pathway, e))
+            sys.exit(1)
+        for step in steps:
+            print('{} ({}-{})'.format(step.nodetype, step.min_path_length, step.max_path_length))
+        if args.import_report:
+            print('\n'.join(startup.report(since=started)))
+        return
+    if args.support is None or args.start is None:
+        parser.error('--support and --start are required to run a query')
+    if args.resume and args.checkpoint_dir is None:
+        print('--resume requires --checkpoint-dir. Exiting')
+        sys.exit(1)
+    run(pathway, args.start, args.end, args.support, config=args.config,
+        checkpoint_dir=args.checkpoint_dir, resume=args.resume,
+        metrics_json=args.metrics_json, metrics_prometheus=args.metrics_prometheus, log_level=args.log_level,
+        export_writers=args.export_writers, support_table=args.support_table,
+        support_store=args.support_store, edge_store=args.edge_store, edge_store_ttl=args.edge_store_ttl * 3600,
+        memory_profile=args.memory_profile, memory_budget=args.memory_budget, db_sessions=args.db_sessions,
+        program_workers=args.program_workers, support_seconds=args.support_seconds,
+        support_calls=args.support_calls, unevaluated=args.unevaluated, prune=args.prune,
+        snapshot_in=args.snapshot_in, snapshot_out=args.snapshot_out, synonymize_workers=args.synonymize_workers,
+        limit_services=args.limit_services, service_ceilings=args.service_ceilings,
+        snapshot_any_query=args.snapshot_any_query)
+    if args.import_report:
+        print('\n'.join(startup.report(since=started)))
 
 
 if __name__ == '__main__':
@@ -1,20 +1,29 @@
 import json
-import os
 import logging
 from greent.graph_components import KEdge
 from greent import node_types
 from greent.util import Text
+from supporter import Supporter
+import cdwindex
 
+logger = logging.getLogger('application')
 
 def get_supporter(greent):
     return CDWSupport(greent)
 
-class CDWSupport():
+class CDWSupport(Supporter):
+
+    # Co-occurrence counts are symmetric; only c1/c2 and the ICD9 pair follow the nodes
+    symmetric = True
+    # term_to_term needs ICD9 codes for both nodes; prepare adds them to diseases and genetic conditions
+    prefixes = ('ICD9',)
 
     def __init__(self,greent):
+        super().__init__(greent)
         self.oxo = greent.oxo
         self.total = 269332
-        self.read_icd9()
+        # The count files are large, so they are opened on the first term_to_term rather than here
+        self.index = None
 
     def prepare(self,nodes):
         for node in nodes:
@@ -23,43 +32,21 @@ class CDWSupport():
                 if self.oxo.is_valid_curie_prefix( split_curie[0] ):
                     results = self.oxo.get_specific_synonym_expanding( node.identifier, 'ICD9CM' )
                     if len(results) == 0:
-                        logging.getLogger('application').warn('No ICD9 found for term: %s' % node.identifier)
+                        logger.warning('No ICD9 found for term: %s', node.identifier)
                     else:
                         for r in results:
-                            logging.getLogger('application').debug('ICD9 for {}: {}'.format( node.identifier, r['curie']))
+                            logger.debug('ICD9 for %s: %s', node.identifier, r['curie'])
                             if ( '-' in r['curie'] ):
-                                logging.getLogger('application').warn('ICD9 has a dash: {}'.format(r['curie']) )
+                                logger.warning('ICD9 has a dash: %s', r['curie'])
                             node.synonyms.add( r['curie'] )
                 else:
-                    logging.getLogger('application').warn('Bad curie?')
+                    logger.warning('Bad curie? %s', node.identifier)
 
 
     def read_icd9(self):
         #TODO: see that the files are available or pull them
-        fname = os.path.join( os.path.dirname(__file__), 'AllDxCounts.txt')
-        self.icd9_codes={}
-        with open(fname, 'r') as infile:
-            h = infile.readline()
-            for line in infile:
-                x = line.strip().split('|')
-                icd_code = x[0]
-                self.icd9_codes[icd_code] = int(x[1])
-        self.icd9_paircounts = {}
-        fname = os.path.join( os.path.dirname(__file__), 'ICD_Combo_Chi2.txt')
-        with open(fname,'r') as infile:
-            h = infile.readline()
-            for line in infile:
-                x = line.strip().split('\t')
-                k1 = ( x[0], x[1] )
-                k2 = ( x[1], x[0] )
-                data = {
-                'c1' : x[3],
-                'c2' : x[4],
-                'c'  : x[6],
-                'e'  : float(x[3]) * float(x[4]) / self.total,  #expected counts
-                'p'  : x[9]}
-                self.icd9_paircounts[k1] = data
-                self.icd9_paircounts[k2] = data
+        #The counts are memory-mapped from an index built (once) from AllDxCounts.txt and ICD_Combo_Chi2.txt
+        self.index = cdwindex.open_index()
 
     def make_edge(self,cooc_list, node_a, node_b):
         k,c = cooc_list[0]
@@ -72,6 +59,8 @@ class CDWSupport():
 
     def term_to_term(self,node_a,node_b,limit = 10000):
         """Given two diseases, check the co-occurrence """
+        if self.index is None:
+            self.read_icd9()
         icd9_a = list(filter( lambda x: x.startswith('ICD9'), node_a.synonyms ) )
         icd9_b = list(filter( lambda x: x.startswith('ICD9'), node_b.synonyms ) )
         if (len(icd9_a) == 0)  or (len(icd9_b) == 0):
@@ -80,28 +69,37 @@ class CDWSupport():
         co_occurrences = []
         for icd9a_curie in icd9_a:
             icd9a = Text.un_curie(icd9a_curie)
-            if icd9a not in self.icd9_codes:
-                logging.getLogger('application').debug('Dont have data for {}'.format(icd9a))
+            counta = self.index.count(icd9a)
+            if counta is None:
+                logger.debug('Dont have data for %s', icd9a)
                 continue
             for icd9b_curie in icd9_b:
                 icd9b = Text.un_curie(icd9b_curie)
-                if icd9b not in self.icd9_codes:
-                    logging.getLogger('application').debug('Dont have data for {}'.format(icd9b))
+                countb = self.index.count(icd9b)
+                if countb is None:
+                    logger.debug('Dont have data for %s', icd9b)
                     continue
                 #Now we have nodes that both have ICD9 codees and the both map to our results!
                 k = (icd9a, icd9b)
-                if k not in self.icd9_paircounts:
+                pair = self.index.pair(icd9a, icd9b)
+                if pair is None:
                     #There were less than 11 shared counts.
-                    counta = self.icd9_codes[icd9a]
-                    countb = self.icd9_codes[icd9b]
                     expected = float(counta) * float(countb) / self.total
                     co_occurrences.append( (k, {'c1': counta, 'c2': countb, 'c': '<11', 'e': expected, 'p':None}) )
                 else:
-                    co_occurrences.append( (k, self.icd9_paircounts[k] ) )
+                    c1, c2, c, p = pair
+                    co_occurrences.append( (k, {'c1': c1, 'c2': c2, 'c': c, 'e': float(c1) * float(c2) / self.total, 'p': p}) )
         if len(co_occurrences) > 0:
             return self.make_edge(co_occurrences, node_a, node_b)
         return None
 
+    def reorient(self,edge):
+        """Swap the per-node counts and ICD9 codes of an edge found for the reversed pair"""
+        c = dict(edge.properties)
+        c['c1'], c['c2'] = c['c2'], c['c1']
+        c['icd9'] = list(reversed(c['icd9']))
+        edge.properties = c
+
 def test():
     from greent.rosetta import Rosetta
     from greent.graph_components import KNode
@@ -0,0 +1,112 @@
+"""The Carolina Data Warehouse co-occurrence counts as numpy arrays saved next to the text files they
+come from.  Reading the text files into dicts takes a while and a lot of memory in every process that
+uses the CDW supporter; the saved arrays are memory-mapped instead, so loading is immediate and the
+worker processes of a batch share one copy of the data through the page cache."""
+import logging
+import os
+import numpy as np
+
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+COUNTS_FILE = 'AllDxCounts.txt'
+PAIRS_FILE = 'ICD_Combo_Chi2.txt'
+INDEX_DIRECTORY = 'cdw-index'
+ARRAYS = ('codes', 'counts', 'pair_keys', 'pair_values')
+
+class CDWIndex:
+    """ICD9 code counts and code-pair counts.  codes is sorted, and counts[i] is the count of codes[i];
+    pair_keys is the sorted i * len(codes) + j for each pair (in both orders) with its c1, c2, c and p
+    (as they appear in the pairs file) in the same row of pair_values."""
+
+    def __init__(self, codes, counts, pair_keys, pair_values):
+        self.codes = codes
+        self.counts = counts
+        self.pair_keys = pair_keys
+        self.pair_values = pair_values
+
+    @classmethod
+    def read(cls, counts_file, pairs_file):
+        """Build the index from the CDW text files"""
+        code_counts = {}
+        with open(counts_file, 'r') as infile:
+            infile.readline()
+            for line in infile:
+                x = line.strip().split('|')
+                code_counts[x[0]] = int(x[1])
+        codes = np.array(sorted(code_counts))
+        counts = np.array([code_counts[code] for code in codes], dtype=np.int64)
+        position = {code: i for i, code in enumerate(codes)}
+        keys = []
+        values = []
+        with open(pairs_file, 'r') as infile:
+            infile.readline()
+            for line in infile:
+                x = line.strip().split('\t')
+                # term_to_term only asks about pairs of codes that both have counts
+                if x[0] not in position or x[1] not in position:
+                    continue
+                row = (x[3], x[4], x[6], x[9])
+                i, j = position[x[0]], position[x[1]]
+                keys.append(i * len(codes) + j)
+                values.append(row)
+                keys.append(j * len(codes) + i)
+                values.append(row)
+        keys = np.array(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='mergesort')
+        pair_values = np.array(values).reshape(-1, 4)[order] if values else np.zeros((0, 4), dtype='U1')
+        return cls(codes, counts, keys[order], pair_values)
+
+    def save(self, directory):
+        """Write the arrays to directory, each replacing any older one in a single step"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            path = os.path.join(directory, name + '.npy')
+            temporary = '{}.{}.tmp.npy'.format(path[:-4], os.getpid())
+            np.save(temporary, getattr(self, name))
+            os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        return cls(*[np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in ARRAYS])
+
+    def position(self, code):
+        i = int(np.searchsorted(self.codes, code))
+        if i < len(self.codes) and self.codes[i] == code:
+            return i
+        return None
+
+    def count(self, code):
+        """The count of an ICD9 code, or None if there's no data for it"""
+        i = self.position(code)
+        return None if i is None else int(self.counts[i])
+
+    def pair(self, code_a, code_b):
+        """(c1, c2, c, p) for a pair of codes with at least 11 shared counts, otherwise None"""
+        i, j = self.position(code_a), self.position(code_b)
+        if i is None or j is None:
+            return None
+        key = i * len(self.codes) + j
+        k = int(np.searchsorted(self.pair_keys, key))
+        if k < len(self.pair_keys) and self.pair_keys[k] == key:
+            return tuple(str(value) for value in self.pair_values[k])
+        return None
+
+
+def is_current(directory, sources):
+    """Whether the saved index in directory is newer than all of its source files"""
+    try:
+        saved = min(os.path.getmtime(os.path.join(directory, name + '.npy')) for name in ARRAYS)
+    except OSError:
+        return False
+    return all(os.path.getmtime(source) <= saved for source in sources)
+
+
+def open_index(data_directory=DATA_DIRECTORY, index_directory=None):
+    """The memory-mapped index, built from the text files in data_directory first if it is missing or
+    older than they are"""
+    if index_directory is None:
+        index_directory = os.path.join(data_directory, INDEX_DIRECTORY)
+    sources = [os.path.join(data_directory, COUNTS_FILE), os.path.join(data_directory, PAIRS_FILE)]
+    if not is_current(index_directory, sources):
+        logging.getLogger('application').info('Building the CDW index in %s', index_directory)
+        CDWIndex.read(*sources).save(index_directory)
+    return CDWIndex.load(index_directory)
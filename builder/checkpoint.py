@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import logging
+import os
+import pickle
+import time
+from memprofile import map_pairs
+
+# The order in which run_query moves a KnowledgeGraph through the pipeline.  A checkpoint
+# records the last of these that completed.
+STAGES = ('execute', 'enhance', 'support', 'export')
+
+def query_fingerprint(userquery, supports):
+    """A short, stable name for a query + support combination, so that a checkpoint is never
+    resumed against a different question."""
+    definition = userquery.definition
+    transitions = [(t.in_type, t.out_type, t.min_path_length, t.max_path_length) for t in definition.transitions]
+    text = repr((definition.start_values, definition.end_values, definition.node_types, transitions, list(supports)))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class SpilledLinks:
+    """Stands in a checkpoint for support pairs that choose_links spilled to links_path(), so that
+    they aren't read back into memory to be pickled"""
+
+    def __init__(self, path, n_pairs):
+        self.path = path
+        self.n_pairs = n_pairs
+
+
+class Checkpointer:
+    """Saves the state of a KnowledgeGraph (graph, node_map and support progress) to a
+    gzipped pickle after each stage, and periodically during support.  Everything is
+    pickled in one dump so that the nodes in the graph, node_map and the support pair list
+    keep their identity when loaded; support pairs spilled to disk are referred to by path."""
+
+    def __init__(self, directory, fingerprint, support_interval=300):
+        """support_interval is the minimum number of seconds between checkpoints written
+        from inside the support loop."""
+        self.logger = logging.getLogger('application')
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.support_interval = support_interval
+        self.last_save = time.time()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self):
+        return os.path.join(self.directory, f'checkpoint-{self.fingerprint}.pkl.gz')
+
+    def links_path(self):
+        """Where choose_links keeps support pairs that don't fit in memory"""
+        return os.path.join(self.directory, f'checkpoint-{self.fingerprint}.links')
+
+    def save(self, kgraph, stage, support_state=None):
+        """Write the graph as of the end of stage.  The file is written to the side and moved
+        into place so that a crash while writing leaves the previous checkpoint intact."""
+        start = time.time()
+        state = {'fingerprint': self.fingerprint,
+                 'stage': stage,
+                 'graph': kgraph.graph,
+                 'node_map': kgraph.node_map,
+                 'ids': kgraph.ids,
+                 'node_records': kgraph.node_records,
+                 'support_table': kgraph.support_table,
+                 'support_state': self.spilled(support_state)}
+        tmp_path = self.path() + '.tmp'
+        with gzip.open(tmp_path, 'wb', compresslevel=3) as outf:
+            pickle.dump(state, outf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path())
+        self.last_save = time.time()
+        self.logger.info('Checkpoint after {} written to {} ({:.1f}s)'.format(stage, self.path(), self.last_save - start))
+
+    def spilled(self, support_state):
+        """support_state, with pairs mapped from links_path() replaced by a reference to the file"""
+        links = (support_state or {}).get('links')
+        filename = getattr(links, 'filename', None)
+        if filename is None or os.path.abspath(filename) != os.path.abspath(self.links_path()):
+            return support_state
+        return dict(support_state, links=SpilledLinks(self.links_path(), len(links)))
+
+    def support_due(self):
+        return time.time() - self.last_save >= self.support_interval
+
+    def load(self):
+        """Return the saved state, or None if there is no usable checkpoint for this query."""
+        if not os.path.exists(self.path()):
+            self.logger.info('No checkpoint found at {}'.format(self.path()))
+            return None
+        try:
+            with gzip.open(self.path(), 'rb') as inf:
+                state = pickle.load(inf)
+        except Exception as e:
+            # e.g. cut short by a full disk, or written by an incompatible version
+            self.logger.warning('Checkpoint {} cannot be read ({}: {}). Ignoring.'.format(
+                self.path(), type(e).__name__, e))
+            return None
+        if state.get('fingerprint') != self.fingerprint:
+            self.logger.warning('Checkpoint {} is for a different query. Ignoring.'.format(self.path()))
+            return None
+        links = (state.get('support_state') or {}).get('links')
+        if isinstance(links, SpilledLinks):
+            expected = links.n_pairs * 2 * 4
+            if not os.path.exists(links.path) or os.path.getsize(links.path) != expected:
+                self.logger.warning('The support pairs of checkpoint {} are missing from {}. Ignoring.'.format(
+                    self.path(), links.path))
+                return None
+            state['support_state']['links'] = map_pairs(links.path, links.n_pairs)
+        return state
+
+    def clear(self):
+        for path in (self.path(), self.links_path()):
+            if os.path.exists(path):
+                os.remove(path)
@@ -4,45 +4,56 @@ from greent.util import Text
 from greent import node_types
 from collections import defaultdict
 from datetime import datetime as dt
+from supporter import Supporter
+
+logger = logging.getLogger('application')
 
 def get_supporter(greent):
     return ChemotextSupport(greent)
 
 
-class ChemotextSupport():
+class ChemotextSupport(Supporter):
+
+    # Co-occurring articles don't depend on which node is asked about first
+    symmetric = True
 
     def __init__(self,greent):
-        self.greent = greent
+        super().__init__(greent)
         self.ctext = greent.chemotext
         self.identifier_to_label = defaultdict(list)
 
     def prepare(self,nodes):
         self.add_chemotext_terms( nodes )
 
+    def applicable(self,node):
+        """Only nodes with a MeSH synonym that chemotext knows can be queried"""
+        return len(self.identifier_to_label.get(node.identifier, [])) > 0
+
     def add_chemotext_terms(self,nodes):
         """For each mesh term in a node, find out what chemotext calls that thing so we can query for it"""
-        logging.getLogger('application').debug('{} nodes'.format(len(nodes) ))
+        logger.debug('%d nodes', len(nodes))
         for node in nodes:
-            logging.getLogger('application').debug('node: {}'.format(node.identifier) )
+            logger.debug('node: %s', node.identifier)
             mesh_identifiers = list( filter( lambda x: Text.get_curie(x)=='MESH', node.synonyms))
             for mesh_id in mesh_identifiers:
-                logging.getLogger('application').debug('  mesh_id: {}'.format(mesh_id) )
+                logger.debug('  mesh_id: %s', mesh_id)
                 bare_id = Text.un_curie(mesh_id)
                 cterm = self.ctext.get_chemotext_term_from_meshid( bare_id )
                 if cterm is None:
-                    logging.getLogger('application').warn("  Cannot find chemotext synonym for %s (%s) %s" % (bare_id,mesh_id,node.identifier))
+                    logger.warning("  Cannot find chemotext synonym for %s (%s) %s", bare_id, mesh_id, node.identifier)
                 else:
-                    logging.getLogger('application').debug('  node: {}, label: {}, chemotext: {}'.format(node.identifier, bare_id, cterm) )
+                    logger.debug('  node: %s, label: %s, chemotext: %s', node.identifier, bare_id, cterm)
                     self.identifier_to_label[node.identifier].append(cterm)
 
     def get_mesh_labels(self,node):
-        logging.getLogger('application').debug('{} to {}'.format(node.identifier, self.identifier_to_label[node.identifier]))
-        return self.identifier_to_label[ node.identifier ]
+        labels = self.identifier_to_label[ node.identifier ]
+        logger.debug('%s to %s', node.identifier, labels)
+        return labels
 
     def term_to_term(self,node_a,node_b,limit = 10000):
         """Given two terms, find articles in chemotext that connect them, and return as a KEdge.
         If nothing is found, return None"""
-        logging.getLogger('application').debug('identifiers: {} to {}'.format(node_a.identifier, node_b.identifier))
+        logger.debug('identifiers: %s to %s', node_a.identifier, node_b.identifier)
         meshes_a = self.get_mesh_labels(node_a)
         meshes_b = self.get_mesh_labels(node_b)
         articles=[]
@@ -55,7 +66,7 @@ class ChemotextSupport():
                     for data in result['data']:
                         articles += data['row']
         end = datetime.now()
-        logging.getLogger('application').debug('chemotext: {} to {}: {} ({})'.format(meshes_a, meshes_b, len(articles), end-start))
+        logger.debug('chemotext: %s to %s: %d (%s)', meshes_a, meshes_b, len(articles), end-start)
         if len(articles) > 0:
             #ke= KEdge( 'chemotext', 'term_to_term', { 'publications': articles }, is_support = True )
             pmids = [f'PMID:{x["pmid"]}' for x in articles]
@@ -5,13 +5,20 @@ from greent.service import ServiceContext
 from greent import chemotext2
 from greent import node_types
 #import nltk
+from supporter import Supporter
+
+logger = logging.getLogger('application')
 
 def get_supporter(greent):
     return Chemotext2Support(greent)
 
-class Chemotext2Support():
+class Chemotext2Support(Supporter):
+
+    # Similarity is symmetric; only the order of the matched terms follows the nodes
+    symmetric = True
 
     def __init__(self,greent):
+        super().__init__(greent)
         greent.chemotext2 = chemotext2.Chemotext2( ServiceContext.create_context() )
         self.chemotext2 = greent.chemotext2
         self.badwords = set(['disease','virus','infection','fever','syndrome','hemorrhagic','disorder',\
@@ -24,9 +31,10 @@ class Chemotext2Support():
                     'due','deficiency','extensive','large','small','pro','partial','complete','morbid', \
                     'central','distal','middle','deficit','defect','status','rhythm','like'])
 
-    def prepare(self,nodes):
-        pass
-     
+    def applicable(self,node):
+        """Similarity is between node labels, so a node needs one"""
+        return bool(node.label)
+
     def generate_phrases(self,phrase):
         """From a phrase, find the 1 or 2 word queries into chemotext"""
         #Adding the individual words when the phrase is longer than 1 has problems.  For instance
@@ -45,7 +53,7 @@ class Chemotext2Support():
     def term_to_term(self,node_a,node_b,limit = 10000):
         """Given two terms, find articles in chemotext that connect them, and return as a KEdge.
         If nothing is found, return None"""
-        logging.getLogger('application').debug('chemotext2: "{}" to "{}"'.format(node_a.label, node_b.label))
+        logger.debug('chemotext2: "%s" to "%s"', node_a.label, node_b.label)
         phrases_a = self.generate_phrases(node_a.label)
         phrases_b = self.generate_phrases(node_b.label)
         maxr = -1
@@ -60,8 +68,8 @@ class Chemotext2Support():
                     maxr = r
                     besta = p_a
                     bestb = p_b
-                logging.getLogger('application').debug('  "{}"-"{}": {} ({})'.format(p_a, p_b, r, maxr) ) 
-        logging.getLogger('application').debug(' "{}"-"{}": {}'.format(besta, bestb, maxr) ) 
+                logger.debug('  "%s"-"%s": %s (%s)', p_a, p_b, r, maxr)
+        logger.debug(' "%s"-"%s": %s', besta, bestb, maxr)
         if maxr > -1:
             ke= KEdge( 'chemotext2', 'term_to_term', { 'similarity':maxr, 'terms':[besta, bestb] }, is_support = True )
             ke.source_node = node_a
@@ -69,6 +77,12 @@ class Chemotext2Support():
             return ke
         return None
 
+    def reorient(self,edge):
+        """Swap the matched terms of an edge found for the reversed pair"""
+        properties = dict(edge.properties)
+        properties['terms'] = list(reversed(properties['terms']))
+        edge.properties = properties
+
 
 if __name__ == '__main__':
     test()
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from instrument import NULL_INSTRUMENTATION
+
+def transient_errors():
+    """The neo4j driver's exceptions that are worth retrying a transaction for (the driver has moved
+    them between versions), plus dropped connections"""
+    errors = [ConnectionError]
+    try:
+        from neo4j.exceptions import TransientError, ServiceUnavailable, SessionExpired
+        errors.extend([TransientError, ServiceUnavailable, SessionExpired])
+    except ImportError:
+        try:
+            from neo4j.v1 import TransientError, ServiceUnavailable, SessionExpired
+            errors.extend([TransientError, ServiceUnavailable, SessionExpired])
+        except ImportError:
+            pass
+    return tuple(errors)
+
+
+class Database:
+    """The builder's access to neo4j.
+
+    Sessions are handed out through session(), at most max_sessions at a time: callers past that
+    wait for one to be returned, so concurrent writers (and concurrent queries sharing one Database)
+    never open more connections than the pool allows.  read() and write() run a unit of work in a
+    transaction, retrying it with exponential backoff on transient errors.  Time spent waiting for
+    a session and in each transaction, and the retries, are recorded in the instrumentation.
+
+    The driver is normally the one Rosetta's type graph already holds; with only a uri, a driver
+    with a pool of max_sessions connections is created."""
+
+    def __init__(self, driver=None, uri=None, auth=None, max_sessions=8, max_retries=4, retry_delay=0.5,
+                 instrumentation=None):
+        self.logger = logging.getLogger('application')
+        if driver is None:
+            from neo4j.v1 import GraphDatabase
+            driver = GraphDatabase.driver(uri, auth=auth, encrypted=False, max_connection_pool_size=max_sessions)
+        self.driver = driver
+        self.max_sessions = max_sessions
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+        self.transient = transient_errors()
+
+    @contextmanager
+    def session(self):
+        """A session, returned to the pool when the block exits"""
+        with self.metrics.timer('db_session_wait_seconds'):
+            self.sessions.acquire()
+        try:
+            session = self.driver.session()
+            try:
+                yield session
+            finally:
+                session.close()
+        finally:
+            self.sessions.release()
+
+    def read(self, work, *args, session=None):
+        """work(tx, *args) in a read transaction; returns what work returns"""
+        return self.transaction('read', work, args, session)
+
+    def write(self, work, *args, session=None):
+        """work(tx, *args) in a write transaction; returns what work returns"""
+        return self.transaction('write', work, args, session)
+
+    def transaction(self, mode, work, args, session):
+        if session is None:
+            with self.session() as session:
+                return self.transaction(mode, work, args, session)
+        attempt = 0
+        while True:
+            try:
+                with self.metrics.timer('db_transaction_seconds', mode=mode):
+                    tx = session.begin_transaction()
+                    try:
+                        result = work(tx, *args)
+                    except BaseException:
+                        rollback = getattr(tx, 'rollback', None)
+                        if rollback is not None:
+                            try:
+                                rollback()
+                            except Exception:
+                                pass
+                        raise
+                    tx.commit()
+                return result
+            except self.transient as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.metrics.count('db_transaction_errors', mode=mode, error=type(e).__name__)
+                    raise
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                self.logger.warning('Transient %s in a %s transaction; retry %d of %d in %.1fs',
+                                    type(e).__name__, mode, attempt, self.max_retries, delay)
+                self.metrics.count('db_retries', mode=mode, error=type(e).__name__)
+                time.sleep(delay)
+            except Exception as e:
+                self.metrics.count('db_transaction_errors', mode=mode, error=type(e).__name__)
+                raise
+
+
+def write_each(tx, write, items):
+    """A unit of work for Database.write: write(item, tx) for each item, e.g. export_node over a batch"""
+    for item in items:
+        write(item, tx)
@@ -0,0 +1,173 @@
+import argparse
+import logging
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from supportstore import BUSY_TIMEOUT, MISSING
+
+# Programs cache each step under '<operation>(<input identifier>)'
+OPERATION_KEY = re.compile(r'^([\w.~-]+)\((.*)\)$')
+# Other keys of the same shape that programs read and write while they run, which aren't steps
+NOT_STEPS = frozenset(['synonymize'])
+
+# A week, in seconds
+DEFAULT_TTL = 7 * 24 * 3600
+
+class EdgeResultStore:
+    """A local SQLite store of program step results, shared by the queries of a batch.
+
+    Each row is the complete neighbour list that one operation returned for one input identifier
+    (the list of (KEdge, KNode) pairs a Program caches), with its provenance: when it was fetched,
+    the edge sources it came from, and the query that fetched it.  Rows older than ttl seconds are
+    treated as missing, and purge() deletes them."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.logger = logging.getLogger('application')
+        self.path = path
+        self.ttl = ttl
+        # Batch workers share the file; a writer holding it up is waited for, as with the support store
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # Programs run concurrently share the connection
+        self.lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS steps
+                           (operation TEXT NOT NULL, input TEXT NOT NULL, ctime REAL NOT NULL,
+                            n_results INTEGER NOT NULL, sources TEXT, query TEXT, results BLOB,
+                            PRIMARY KEY (operation, input)) WITHOUT ROWID''')
+        self.db.commit()
+
+    def get(self, operation, identifier):
+        """The stored neighbour list, or MISSING if there is none or it has expired"""
+        with self.lock:
+            row = self.db.execute('SELECT ctime, results FROM steps WHERE operation=? AND input=?',
+                                  (operation, identifier)).fetchone()
+        if row is None or row[0] < time.time() - self.ttl:
+            return MISSING
+        return pickle.loads(row[1])
+
+    def put(self, operation, identifier, results, query=None):
+        sources = set()
+        for result in results:
+            # Normally (edge, node) pairs
+            edge = result[0] if isinstance(result, tuple) else result
+            sources.add(getattr(edge, 'edge_source', None) or '')
+        sources.discard('')
+        sources = sorted(sources)
+        data = pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO steps VALUES (?,?,?,?,?,?,?)',
+                            (operation, identifier, time.time(), len(results), ','.join(sources), query, data))
+
+    def provenance(self, operation, identifier):
+        """(ctime, number of results, edge sources, query) for a stored step, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT ctime, n_results, sources, query FROM steps WHERE operation=? AND input=?',
+                                  (operation, identifier)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2].split(',') if row[2] else [], row[3]
+
+    def purge(self):
+        """Delete expired steps and give the space back"""
+        with self.lock:
+            with self.db:
+                n_deleted = self.db.execute('DELETE FROM steps WHERE ctime<?', (time.time() - self.ttl,)).rowcount
+            self.db.execute('VACUUM')
+        self.logger.info('Purged %d expired steps from %s', n_deleted, self.path)
+        return n_deleted
+
+    def counts(self):
+        """Number of live steps per operation"""
+        with self.lock:
+            return dict(self.db.execute('SELECT operation, COUNT(*) FROM steps WHERE ctime>=? GROUP BY operation',
+                                        (time.time() - self.ttl,)))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def step_key(key):
+    """(operation, identifier) for the rosetta.cache key of a program step, or None"""
+    match = OPERATION_KEY.match(key)
+    if match is None or match.group(1) in NOT_STEPS:
+        return None
+    return match.groups()
+
+
+class StoreBackedCache:
+    """Stands in for rosetta.cache while programs run.  Step results are looked up in the
+    EdgeResultStore before the Rosetta cache (and so before the services), and whatever the
+    programs fetch or find in the Rosetta cache is copied into the store.  Keys that don't look
+    like a program step (see step_key), such as the synonymizer's, go straight through to the
+    Rosetta cache.  A step the store can't read (locked too long by another process, or a corrupt
+    row) is looked up as though the store didn't have it."""
+
+    def __init__(self, cache, store, query=None, instrumentation=None):
+        self.cache = cache
+        self.store = store
+        self.query = query
+        self.metrics = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+    def get(self, key):
+        step = step_key(key)
+        if step is None:
+            return self.cache.get(key)
+        operation, identifier = step
+        try:
+            results = self.store.get(operation, identifier)
+        except Exception as e:
+            logging.getLogger('application').warning('Could not read %s(%s) from the edge store: %s: %s',
+                                                     operation, identifier, type(e).__name__, e)
+            self.count('edge_store_errors', operation)
+            results = MISSING
+        if results is not MISSING:
+            self.count('edge_store_hits', operation)
+            return results
+        self.count('edge_store_misses', operation)
+        results = self.cache.get(key)
+        if results is not None:
+            self.put(operation, identifier, results)
+        return results
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+        step = step_key(key)
+        if step is not None and value is not None:
+            self.put(step[0], step[1], value)
+
+    def put(self, operation, identifier, results):
+        try:
+            self.store.put(operation, identifier, results, self.query)
+        except Exception:
+            # The store is an optimization; the programs carry on without it
+            logging.getLogger('application').exception('Could not store %s(%s)', operation, identifier)
+            self.count('edge_store_errors', operation)
+
+    def count(self, name, operation):
+        if self.metrics is not None:
+            self.metrics.count(name, operation=operation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain a local store of program step results')
+    parser.add_argument('store', help='Path to the store')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL / 3600, help='Hours before a step expires')
+    parser.add_argument('--purge', action='store_true', help='Delete expired steps')
+    args = parser.parse_args()
+    store = EdgeResultStore(args.store, ttl=args.ttl * 3600)
+    if args.purge:
+        print('Removed {} expired steps'.format(store.purge()))
+    for operation, count in sorted(store.counts().items()):
+        print('{}: {} steps'.format(operation, count))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
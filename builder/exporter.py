@@ -0,0 +1,223 @@
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from instrument import NULL_INSTRUMENTATION
+from dbaccess import write_each
+
+# Put on a queue to tell a writer to stop
+_STOP = object()
+
+# What export_node reads of a node, taken when it is queued: supporters' prepare can still be adding
+# synonyms on the main thread while the writers work through the queue
+ExportNode = namedtuple('ExportNode', ['identifier', 'node_type', 'label', 'synonyms'])
+
+def export_snapshot(node, sorted_synonyms=None):
+    """node as it should be written now; sorted_synonyms, if given, is node.synonyms already sorted"""
+    if sorted_synonyms is None:
+        sorted_synonyms = sorted(node.synonyms)
+    return ExportNode(node.identifier, node.node_type, node.label, tuple(sorted_synonyms))
+
+
+class ExportError(Exception):
+    """Raised by barrier() and close() when nodes or edges could not be written"""
+
+class BackgroundExporter:
+    """Writes nodes and edges to neo4j from a set of writer threads while the rest of the build runs.
+
+    Nodes and edges go through separate bounded queues, so a producer that gets ahead of the
+    database blocks instead of filling memory.  Each writer holds its own session from the Database
+    (so there are never more writers than the Database allows sessions) and writes in batched
+    transactions, which the Database retries on transient errors.  Edges are only written once every node has been, because export_edge
+    matches its endpoints by id: writers hold off on the edge queue until nodes_complete() has been
+    called and the node queue has drained.  close() flushes everything and waits for the writers.
+
+    A batch that fails is written again an item at a time, so that one bad node or edge doesn't take
+    the rest of its batch with it; the items that fail on their own are recorded in errors.  A writer
+    that fails outright (e.g. it can't get a session) takes what is left on the queues off them
+    unwritten, so that nothing waits on it forever.  Either way barrier() and close() raise ExportError
+    once the queues are done with."""
+
+    def __init__(self, database, write_node, write_edge, n_writers=4, batch_size=500, queue_size=10000,
+                 instrumentation=None):
+        """database is a dbaccess.Database.  write_node(node, session) and write_edge(edge, session) do
+        the actual writing; they are export_node and export_edge from builder."""
+        self.logger = logging.getLogger('application')
+        self.database = database
+        if n_writers > database.max_sessions:
+            self.logger.info('Using %d export writers, the number of database sessions allowed', database.max_sessions)
+            n_writers = database.max_sessions
+        self.write_node = write_node
+        self.write_edge = write_edge
+        self.batch_size = batch_size
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.node_queue = queue.Queue(maxsize=queue_size)
+        self.edge_queue = queue.Queue(maxsize=queue_size)
+        self.nodes_queued = threading.Event()
+        self.nodes_written = threading.Event()
+        # (kind, item, error) for each node or edge that couldn't be written
+        self.errors = []
+        # The exception of the first writer to fail outright, if any
+        self.failure = None
+        self.n_nodes = 0
+        self.n_edges = 0
+        self.lock = threading.Lock()
+        self.writers = [threading.Thread(target=self.run_writer, name=f'export-writer-{i}', daemon=True)
+                        for i in range(n_writers)]
+        for writer in self.writers:
+            writer.start()
+
+    def put_node(self, node):
+        """node is best queued as an export_snapshot, if it may still change"""
+        self.node_queue.put(node)
+
+    def put_edge(self, edge):
+        """edge is a (source, target, {'object': kedge}) tuple, as from graph.edges(data=True)"""
+        self.edge_queue.put(edge)
+
+    def nodes_complete(self):
+        """Called once every node that the edges will refer to has been queued"""
+        self.nodes_queued.set()
+
+    def next_batch(self, items, first):
+        """Collect up to batch_size items from a queue without waiting, starting with first"""
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                item = items.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Leave the stop marker for this writer's next get
+                items.put(item)
+                items.task_done()
+                break
+            batch.append(item)
+        return batch
+
+    def write_batch(self, session, batch, write, kind):
+        with self.metrics.timer('export_batch_seconds', kind=kind):
+            try:
+                self.database.write(write_each, write, batch, session=session)
+            except (Exception, SystemExit) as e:
+                # export_edge exits on an edge without a predicate; don't let that take down the writer
+                if len(batch) == 1:
+                    self.logger.error('Failed to write %s %s: %r', kind, describe(batch[0]), e)
+                    with self.lock:
+                        self.errors.append((kind, describe(batch[0]), repr(e)))
+                    self.metrics.count('export_errors', kind=kind)
+                    return
+                self.logger.warning('Failed to write a batch of %d %ss (%r); writing them one at a time',
+                                    len(batch), kind, e)
+                self.metrics.count('export_batch_retries', kind=kind)
+                for item in batch:
+                    self.write_batch(session, [item], write, kind)
+                return
+        with self.lock:
+            if kind == 'node':
+                self.n_nodes += len(batch)
+            else:
+                self.n_edges += len(batch)
+        self.metrics.count('export_nodes' if kind == 'node' else 'export_edges', len(batch))
+
+    def run_writer(self):
+        try:
+            with self.database.session() as session:
+                self.write_until_stopped(session)
+        except BaseException as e:
+            self.logger.exception('An export writer failed; what is left to export will not be written')
+            with self.lock:
+                if self.failure is None:
+                    self.failure = e
+            self.drain()
+
+    def drain(self):
+        """Take everything off the queues unwritten until stopped, for a writer that can't write"""
+        while True:
+            for items, kind in ((self.node_queue, 'node'), (self.edge_queue, 'edge')):
+                try:
+                    item = items.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                items.task_done()
+                if item is _STOP:
+                    return
+                self.metrics.count('export_dropped', kind=kind)
+
+    def write_until_stopped(self, session):
+        while True:
+            # Nodes first, always.  Only look at edges once all nodes are known to be in the database.
+            if not self.nodes_written.is_set():
+                try:
+                    node = self.node_queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self.nodes_queued.is_set() and self.node_queue.unfinished_tasks == 0:
+                        self.nodes_written.set()
+                    continue
+                if node is _STOP:
+                    self.node_queue.task_done()
+                    return
+                self.write_all(session, self.node_queue, node, self.write_node, 'node')
+                continue
+            # Late node updates (e.g. synonyms added by a supporter's prepare) are still taken in preference
+            try:
+                node = self.node_queue.get_nowait()
+                if node is not _STOP:
+                    self.write_all(session, self.node_queue, node, self.write_node, 'node')
+                    continue
+                self.node_queue.task_done()
+            except queue.Empty:
+                pass
+            try:
+                edge = self.edge_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if edge is _STOP:
+                self.edge_queue.task_done()
+                return
+            self.write_all(session, self.edge_queue, edge, self.write_edge, 'edge')
+
+    def write_all(self, session, items, first, write, kind):
+        """Write a batch from items starting with first, marking it done however the writing went"""
+        batch = self.next_batch(items, first)
+        try:
+            self.write_batch(session, batch, write, kind)
+        finally:
+            for _ in batch:
+                items.task_done()
+
+    def barrier(self):
+        """Wait until everything queued so far has been written (or dropped by a failed writer).  Raises
+        ExportError if anything couldn't be written."""
+        self.nodes_complete()
+        self.node_queue.join()
+        self.nodes_written.set()
+        self.edge_queue.join()
+        with self.lock:
+            failure, errors = self.failure, list(self.errors)
+        if failure is not None:
+            raise ExportError('An export writer failed: {!r}'.format(failure)) from failure
+        if errors:
+            raise ExportError('{} nodes or edges could not be written, e.g. {} {}: {}'.format(len(errors), *errors[0]))
+
+    def close(self):
+        """Flush, stop the writers and wait for them.  Raises ExportError, once the writers are stopped,
+        if anything couldn't be written."""
+        start = time.time()
+        try:
+            self.barrier()
+        finally:
+            for _ in self.writers:
+                self.edge_queue.put(_STOP)
+            for writer in self.writers:
+                writer.join()
+            self.logger.info('Background export finished: %d nodes, %d edges, %d failed (final flush %.1fs)',
+                             self.n_nodes, self.n_edges, len(self.errors), time.time() - start)
+
+
+def describe(item):
+    """A node (or snapshot) by its identifier, an edge by its ends"""
+    if isinstance(item, tuple) and len(item) == 3:
+        return '{}->{}'.format(getattr(item[0], 'identifier', item[0]), getattr(item[1], 'identifier', item[1]))
+    return getattr(item, 'identifier', repr(item))
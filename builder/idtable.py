@@ -0,0 +1,55 @@
+import sys
+from array import array
+
+class IdentifierTable:
+    """Interns identifier strings (CURIEs) to small integer ids.
+
+    The same CURIE turns up in many KNodes and synonym sets over a build; the table keeps one copy
+    of each string and gives it an id, so that the builder's hot dictionaries (node_map, support
+    bookkeeping) hash and store ints rather than strings.  Ids are only meaningful within one
+    table: anything that outlives the run (cache keys, the database) still uses the strings."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, identifier):
+        return identifier in self.ids
+
+    def intern(self, identifier):
+        iid = self.ids.get(identifier)
+        if iid is None:
+            identifier = sys.intern(identifier)
+            iid = self.ids[identifier] = len(self.strings)
+            self.strings.append(identifier)
+        return iid
+
+    def get(self, identifier):
+        """The id of identifier, or None if it has never been interned"""
+        return self.ids.get(identifier)
+
+    def string(self, iid):
+        return self.strings[iid]
+
+
+class NodeRecord:
+    """The builder's bookkeeping for one node in the graph: its interned id, the ids of every name
+    that node_map sends to it (so a merge can move them without scanning node_map), and its sorted
+    synonym list, computed once and only recomputed if the synonyms change."""
+
+    __slots__ = ('iid', 'keys', 'sorted_synonyms', 'n_synonyms')
+
+    def __init__(self, iid):
+        self.iid = iid
+        self.keys = array('i')
+        self.sorted_synonyms = None
+        self.n_synonyms = -1
+
+    def synonyms_for_export(self, node):
+        if self.sorted_synonyms is None or self.n_synonyms != len(node.synonyms):
+            self.sorted_synonyms = sorted(node.synonyms)
+            self.n_synonyms = len(node.synonyms)
+        return self.sorted_synonyms
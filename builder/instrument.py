@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+# Upper bounds (seconds) of the latency histogram buckets.  Anything slower lands in +Inf.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _labelkey(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def report(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'buckets': {str(b): c for b, c in zip(list(self.buckets) + ['+Inf'], self.counts)}}
+
+
+class Timer:
+    """Context manager that records its elapsed time into a histogram of an Instrumentation"""
+
+    def __init__(self, instrumentation, name, labels):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.instrumentation.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+class Instrumentation:
+    """Counters and latency histograms for a builder run, keyed by metric name and labels
+    (e.g. count('support_pairs', supporter='OmnicorpSupport')).  At the end of the run the
+    results can be written as a JSON report or in the Prometheus text format.  The JSON report also
+    carries any details, records such as the support failures that don't reduce to numbers."""
+
+    enabled = True
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+        self.details = {}
+        self.created = time.time()
+        # Background export writers record from their own threads
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1, **labels):
+        key = (name, _labelkey(labels))
+        with self.lock:
+            self.counters[key] += n
+
+    def gauge(self, name, value, **labels):
+        """Record the current value of something (e.g. memory in use); the last value set is kept"""
+        key = (name, _labelkey(labels))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labelkey(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def detail(self, name, value):
+        """Put value (anything JSON can write) in the JSON report as details[name]"""
+        with self.lock:
+            self.details[name] = value
+
+    def report(self):
+        counters = defaultdict(list)
+        for (name, labels), value in sorted(self.counters.items()):
+            counters[name].append({'labels': dict(labels), 'value': value})
+        gauges = defaultdict(list)
+        for (name, labels), value in sorted(self.gauges.items()):
+            gauges[name].append({'labels': dict(labels), 'value': value})
+        histograms = defaultdict(list)
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda x: x[0]):
+            entry = histogram.report()
+            entry['labels'] = dict(labels)
+            histograms[name].append(entry)
+        return {'started': self.created,
+                'elapsed': time.time() - self.created,
+                'counters': counters,
+                'gauges': gauges,
+                'histograms': histograms,
+                'details': dict(self.details)}
+
+    def write_json(self, path):
+        with open(path, 'w') as outf:
+            json.dump(self.report(), outf, indent=2)
+
+    def prometheus_text(self, prefix='robokop_builder_'):
+        def labeltext(labels, extra=()):
+            items = list(labels) + list(extra)
+            if len(items) == 0:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, v) for k, v in items) + '}'
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append('{}{}_total{} {}'.format(prefix, name, labeltext(labels), value))
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append('{}{}{} {}'.format(prefix, name, labeltext(labels), value))
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda x: x[0]):
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append('{}{}_bucket{} {}'.format(prefix, name, labeltext(labels, [('le', bound)]), cumulative))
+            lines.append('{}{}_sum{} {}'.format(prefix, name, labeltext(labels), histogram.sum))
+            lines.append('{}{}_count{} {}'.format(prefix, name, labeltext(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, 'w') as outf:
+            outf.write(self.prometheus_text())
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullInstrumentation:
+    """Stands in for Instrumentation when metrics are off.  Every call is a no-op."""
+
+    enabled = False
+    _timer = _NullTimer()
+
+    def count(self, name, n=1, **labels):
+        pass
+
+    def gauge(self, name, value, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return self._timer
+
+    def detail(self, name, value):
+        pass
+
+    def report(self):
+        return {}
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
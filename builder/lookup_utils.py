@@ -1,11 +1,29 @@
 import logging
 from greent import node_types
+import nameindex
+
+# Ontology -> its offline name index (or None, without one), opened on first use
+local_indexes = {}
+
+def lookup_local_name( ontology, name ):
+    """The identifiers an ontology's offline name index (see nameindex.py) has for name, matched as the
+    remote search does; empty if there is no index or no match, when the remote search is the fallback."""
+    if ontology not in local_indexes:
+        try:
+            local_indexes[ontology] = nameindex.open_index( ontology )
+        except (OSError, ValueError) as e:
+            logging.getLogger('application').warning('Could not open the {} name index: {}'.format(ontology, e))
+            local_indexes[ontology] = None
+    index = local_indexes[ontology]
+    return [] if index is None else index.lookup( name )
 
 def lookup_phenotype_by_name( name, greent ):
     """Return type is a list of HPO identifiers."""
     logger=logging.getLogger('application')
-    #This performs a case-insensitive exact match, and also inverts comma-ed names
-    hpo_ids =  greent.hpo.search( name )
+    hpo_ids = lookup_local_name( 'hp', name )
+    if len(hpo_ids) == 0:
+        #This performs a case-insensitive exact match, and also inverts comma-ed names
+        hpo_ids =  greent.hpo.search( name )
     if len(hpo_ids) == 0:
         logger.error('Could not convert phenotype name: {}.'.format(name))
     else:
@@ -20,8 +38,10 @@ def lookup_disease_by_name( disease_name, greent ):
     (in order), a DOID, a UMLS, and an EFO.
     Return type is a list of identifiers."""
     logger=logging.getLogger('application')
-    #This performs a case-insensitive exact match, and also inverts comma-ed names
-    mondo_ids =  greent.mondo.search( disease_name )
+    mondo_ids = lookup_local_name( 'mondo', disease_name )
+    if len(mondo_ids) == 0:
+        #This performs a case-insensitive exact match, and also inverts comma-ed names
+        mondo_ids =  greent.mondo.search( disease_name )
     #Take out phenotypes...
     mondo_ids = list( filter( lambda x: not x.startswith('HP'), mondo_ids))
     if len(mondo_ids) == 0:
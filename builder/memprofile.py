@@ -0,0 +1,204 @@
+import ast
+import logging
+import os
+import re
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from itertools import islice
+
+# Rough bytes per (source, target) pair in the support link list: a 2-tuple plus its list slot.
+# The ids themselves are shared with the NodeRecords.
+LINK_BYTES = 64
+
+def rss_bytes():
+    """Resident set size of this process.  Falls back to the peak RSS where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as inf:
+            return int(inf.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def parse_size(text):
+    """'512M', '8G', '1.5g' or a plain number of bytes -> bytes"""
+    match = re.match(r'^\s*([\d.]+)\s*([kmgt]?)b?\s*$', text.lower())
+    if match is None:
+        raise ValueError('Cannot read {} as a size'.format(text))
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' kmgt'.index(unit or ' '))
+
+
+def megabytes(n_bytes):
+    return '{:.1f} MB'.format(n_bytes / 1e6)
+
+
+class MemoryBudget:
+    """A limit on the resident memory of the build.  The builder asks it before building a large
+    structure, and degrades (e.g. fewer or disk-backed support pairs) rather than let the OOM killer
+    end the run."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+    def used(self):
+        return rss_bytes()
+
+    def allows(self, extra_bytes):
+        return self.used() + extra_bytes <= self.max_bytes
+
+    def exceeded(self):
+        return self.used() > self.max_bytes
+
+
+# Which part of the builder an allocation belongs to, decided by the innermost frame of its
+# traceback that one of these recognizes: (structure, files, functions in the builder's own files).
+STRUCTURES = (
+    ('links', ('pathlinks.py',), ('generate_all_links', 'generate_links_from_paths', 'choose_links', 'spill_pairs')),
+    ('node_map', ('idtable.py',), ('add_or_find_node', 'map_identifier', 'merge', 'find_node')),
+    ('support table', ('supporttable.py',), ()),
+    ('cache', ('supportstore.py', 'edgestore.py', 'cache.py', 'redis'), ('support_key',)),
+    ('support edges', ('omnicorp.py', 'chemotext.py', 'chemotext2.py', 'cdw.py', 'fakesupport.py'),
+     ('orient_support_edge', 'compute_support')),
+    ('graph', ('networkx',), ('add_nonsynonymous_edge', 'add_edges')),
+    ('services', ('greent',), ()),
+)
+
+class MemoryProfiler:
+    """Takes tracemalloc snapshots at stage boundaries and reports where the memory is: totals
+    grouped by builder structure (graph, node_map, support links, cache...) and the top
+    allocation sites.  Tracing slows the build down, so this is only on when asked for."""
+
+    def __init__(self, nframes=16, top=10, instrumentation=None):
+        self.logger = logging.getLogger('application')
+        self.nframes = nframes
+        self.top = top
+        self.metrics = instrumentation
+        self.builder_directory = os.path.dirname(os.path.abspath(__file__))
+        self.function_lines = {}
+        self.reports = []
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def functions(self, filename):
+        """line number -> name of the innermost function enclosing it, for one of the builder's files"""
+        lines = self.function_lines.get(filename)
+        if lines is None:
+            lines = self.function_lines[filename] = {}
+            try:
+                with open(filename) as inf:
+                    tree = ast.parse(inf.read())
+            except (OSError, SyntaxError, ValueError):
+                return lines
+            # ast.walk is breadth first, so inner functions overwrite their enclosing ones
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    last = max(getattr(child, 'lineno', node.lineno) for child in ast.walk(node))
+                    for line in range(node.lineno, last + 1):
+                        lines[line] = node.name
+        return lines
+
+    def classify(self, traceback):
+        """(structure, the frame that decided it) for one allocation traceback.  The traceback runs
+        from the oldest frame to the most recent, and the most recent recognized frame decides."""
+        for frame in reversed(traceback):
+            filename = frame.filename
+            function = None
+            if filename.startswith(self.builder_directory):
+                function = self.functions(filename).get(frame.lineno)
+            for structure, files, functions in STRUCTURES:
+                if function in functions or any(name in filename for name in files):
+                    return structure, frame
+        return 'other', traceback[-1]
+
+    def snapshot(self, stage):
+        """Log (and return) where traced memory is after stage"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')))
+        by_structure = defaultdict(int)
+        sites = []
+        for statistic in snapshot.statistics('traceback'):
+            structure, frame = self.classify(statistic.traceback)
+            by_structure[structure] += statistic.size
+            sites.append((statistic.size, statistic.count, structure, frame))
+        sites.sort(key=lambda site: -site[0])
+        traced = sum(by_structure.values())
+        rss = rss_bytes()
+        self.logger.info('Memory after %s: %s traced, %s resident; %s', stage, megabytes(traced), megabytes(rss),
+                         ', '.join('{} {}'.format(structure, megabytes(size))
+                                   for structure, size in sorted(by_structure.items(), key=lambda x: -x[1])))
+        for size, count, structure, frame in sites[:self.top]:
+            self.logger.info('    %10s %8d blocks  %-14s %s:%d', megabytes(size), count, structure,
+                             os.path.basename(frame.filename), frame.lineno)
+        if self.metrics is not None:
+            self.metrics.gauge('memory_resident_bytes', rss, stage=stage)
+            for structure, size in by_structure.items():
+                self.metrics.gauge('memory_traced_bytes', size, stage=stage, structure=structure)
+        report = {'stage': stage, 'traced': traced, 'resident': rss, 'structures': dict(by_structure),
+                  'top': [(size, count, structure, '{}:{}'.format(frame.filename, frame.lineno))
+                          for size, count, structure, frame in sites[:self.top]]}
+        self.reports.append(report)
+        return report
+
+
+def pair_blocks(pairs, first=None, size=100000):
+    """The pairs from an iterator, a list of up to size at a time; after first, if given, which is
+    let go of once it has been used"""
+    if first is not None:
+        yield first
+        del first
+    while True:
+        block = list(islice(pairs, size))
+        if not block:
+            return
+        yield block
+
+
+def spill_pairs(blocks, directory=None, path=None):
+    """Write pairs of ints to a temporary file and map it back read-only, as an (n, 2) int32 array
+    that can be sliced like the list it replaces.  blocks is an iterable of lists (or arrays) of pairs,
+    so that the pairs never need to be in memory all at once.  The file is unlinked once mapped, unless
+    path is given, in which case the pairs are kept there (e.g. for a checkpoint to refer to)."""
+    import numpy as np
+    if path is None:
+        handle, spill_path = tempfile.mkstemp(prefix='support-links-', suffix='.bin', dir=directory)
+        outf = os.fdopen(handle, 'wb')
+    else:
+        spill_path = path + '.tmp'
+        outf = open(spill_path, 'wb')
+    n_pairs = 0
+    with outf:
+        for block in blocks:
+            block = np.asarray(block, dtype=np.int32).reshape(-1, 2)
+            block.tofile(outf)
+            n_pairs += len(block)
+    if n_pairs == 0:
+        os.remove(spill_path)
+        return np.zeros((0, 2), dtype=np.int32)
+    if path is not None:
+        os.replace(spill_path, path)
+        return map_pairs(path, n_pairs)
+    pairs = map_pairs(spill_path, n_pairs)
+    try:
+        os.remove(spill_path)
+    except OSError:
+        # e.g. Windows, which won't remove a mapped file; it goes with the temp directory
+        pass
+    return pairs
+
+
+def map_pairs(path, n_pairs):
+    """The n_pairs pairs that spill_pairs wrote to path, mapped read-only"""
+    import numpy as np
+    return np.memmap(path, dtype=np.int32, mode='r', shape=(n_pairs, 2))
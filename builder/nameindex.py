@@ -0,0 +1,211 @@
+"""Offline indexes of MONDO and HPO names, built from the ontologies' OBO dumps and saved next to them, so
+that query start and end names resolve without a round trip to the mondo and hpo search services.  The
+names are normalized, inverted where they have a comma ('Hypertension, Pulmonary' is also indexed as
+'pulmonary hypertension'), sorted by their UTF-8 bytes and written end to end to one file, with their
+offsets and identifiers in two others.  Loading memory-maps those files, which takes a millisecond or
+two, and a lookup is a binary search over the mapped names.  Only the standard library is used, so
+that resolving names doesn't pull numpy into startup."""
+import logging
+import mmap
+import os
+from array import array
+
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIRECTORY = 'name-index'
+# Ontology -> the OBO dump its names are read from, and the prefix of the identifiers kept from it
+ONTOLOGIES = {'mondo': ('mondo.obo', 'MONDO:'), 'hp': ('hp.obo', 'HP:')}
+FILES = ('names', 'offsets', 'rows', 'identifiers')
+
+def normalize(name):
+    """Names match case-insensitively, with any run of whitespace as one space"""
+    return ' '.join(name.lower().split())
+
+
+def invert(name):
+    """'hypertension, pulmonary' -> 'pulmonary hypertension'.  None unless name has exactly one comma."""
+    parts = name.split(',')
+    if len(parts) != 2:
+        return None
+    head, tail = parts[0].strip(), parts[1].strip()
+    if not head or not tail:
+        return None
+    return '{} {}'.format(tail, head)
+
+
+def read_obo(path, prefix):
+    """Yields (name, identifier) for the label and exact synonyms of each term in an OBO file whose id
+    starts with prefix, leaving out obsolete terms"""
+    def term_names(identifier, names, obsolete):
+        if identifier is not None and identifier.startswith(prefix) and not obsolete:
+            for name in names:
+                yield name, identifier
+    identifier, names, obsolete = None, [], False
+    in_term = False
+    with open(path, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            line = line.strip()
+            if line.startswith('['):
+                yield from term_names(identifier, names, obsolete)
+                identifier, names, obsolete = None, [], False
+                # Only [Term] stanzas name anything we look up
+                in_term = line == '[Term]'
+            elif not line or identifier is None and not line.startswith('id: '):
+                continue
+            elif line.startswith('id: ') and in_term:
+                identifier = line[4:].strip()
+            elif line.startswith('name: '):
+                names.append(line[6:])
+            elif line.startswith('synonym: "'):
+                text, _, scope = line[10:].rpartition('" ')
+                if scope.startswith('EXACT'):
+                    names.append(text.replace('\\"', '"'))
+            elif line == 'is_obsolete: true':
+                obsolete = True
+    yield from term_names(identifier, names, obsolete)
+
+
+class NameIndex:
+    """Normalized names, sorted by their UTF-8 bytes, each with an identifier it names.  The name in row i
+    is names[offsets[i]:offsets[i + 1]] and its identifier is identifiers[rows[i]].  A name naming
+    several identifiers has a row for each."""
+
+    def __init__(self, names, offsets, rows, identifiers):
+        self.names = names
+        self.offsets = offsets
+        self.rows = rows
+        self.identifiers = identifiers
+
+    @classmethod
+    def build(cls, pairs):
+        """The index of (name, identifier) pairs"""
+        entries = set()
+        for name, identifier in pairs:
+            name = normalize(name)
+            entries.add((name.encode('utf-8'), identifier))
+            inverted = invert(name)
+            if inverted is not None:
+                entries.add((inverted.encode('utf-8'), identifier))
+        entries = sorted(entries)
+        identifiers = sorted(set(identifier for _, identifier in entries))
+        number = {identifier: i for i, identifier in enumerate(identifiers)}
+        offsets = array('q', [0])
+        for name, _ in entries:
+            offsets.append(offsets[-1] + len(name))
+        rows = array('i', [number[identifier] for _, identifier in entries])
+        return cls(b''.join(name for name, _ in entries), offsets, rows, identifiers)
+
+    def save(self, directory):
+        """Write the index to directory, each file replacing any older one in a single step"""
+        os.makedirs(directory, exist_ok=True)
+        contents = {'names': self.names, 'offsets': self.offsets.tobytes(), 'rows': self.rows.tobytes(),
+                    'identifiers': '\n'.join(self.identifiers).encode('utf-8')}
+        for name in FILES:
+            path = os.path.join(directory, name)
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary, 'wb') as outfile:
+                outfile.write(contents[name])
+            os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, directory):
+        def mapped(name):
+            with open(os.path.join(directory, name), 'rb') as infile:
+                if os.fstat(infile.fileno()).st_size == 0:
+                    return b''
+                return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(os.path.join(directory, 'identifiers'), 'r', encoding='utf-8') as infile:
+            identifiers = infile.read().split('\n')
+        return cls(mapped('names'), memoryview(mapped('offsets')).cast('q'), memoryview(mapped('rows')).cast('i'),
+                   identifiers)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def name(self, i):
+        return self.names[self.offsets[i]:self.offsets[i + 1]]
+
+    def first(self, key):
+        """The first row whose name is not before key"""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def exact(self, name):
+        """The identifiers that name (normalized) names"""
+        key = normalize(name).encode('utf-8')
+        found = []
+        i = self.first(key)
+        while i < len(self) and self.name(i) == key:
+            found.append(self.identifiers[self.rows[i]])
+            i += 1
+        return found
+
+    def lookup(self, name):
+        """The identifiers that name names, or failing that, that its comma inversion does; as the mondo
+        and hpo search services match"""
+        found = self.exact(name)
+        if not found:
+            inverted = invert(normalize(name))
+            if inverted is not None:
+                found = self.exact(inverted)
+        return found
+
+    def prefix(self, text, limit=20):
+        """Up to limit (name, identifier) pairs, in name order, for the names that start with text"""
+        key = normalize(text).encode('utf-8')
+        found = []
+        i = self.first(key)
+        while i < len(self) and len(found) < limit:
+            name = self.name(i)
+            if not name.startswith(key):
+                break
+            found.append((name.decode('utf-8'), self.identifiers[self.rows[i]]))
+            i += 1
+        return found
+
+
+def is_current(directory, sources):
+    """Whether the saved index in directory is newer than all of its source files"""
+    try:
+        saved = min(os.path.getmtime(os.path.join(directory, name)) for name in FILES)
+    except OSError:
+        return False
+    return all(os.path.getmtime(source) <= saved for source in sources)
+
+
+def open_index(ontology, data_directory=DATA_DIRECTORY, index_directory=None):
+    """The index of an ontology's names, built from its OBO dump in data_directory first if that is newer
+    than the saved index.  None if there is neither an index nor a dump to build one from."""
+    if index_directory is None:
+        index_directory = os.path.join(data_directory, INDEX_DIRECTORY)
+    dump, prefix = ONTOLOGIES[ontology]
+    source = os.path.join(data_directory, dump)
+    directory = os.path.join(index_directory, ontology)
+    if os.path.exists(source):
+        if not is_current(directory, [source]):
+            logging.getLogger('application').info('Building the %s name index in %s', ontology, directory)
+            NameIndex.build(read_obo(source, prefix)).save(directory)
+    elif not all(os.path.exists(os.path.join(directory, name)) for name in FILES):
+        return None
+    return NameIndex.load(directory)
+
+
+def main():
+    """Build (or rebuild) the name indexes from whichever dumps are in the builder directory"""
+    logging.getLogger('application').addHandler(logging.StreamHandler())
+    logging.getLogger('application').setLevel(logging.INFO)
+    for ontology in sorted(ONTOLOGIES):
+        index = open_index(ontology)
+        if index is None:
+            print('No {} for {}'.format(ONTOLOGIES[ontology][0], ontology))
+        else:
+            print('{}: {} names'.format(ontology, len(index)))
+
+
+if __name__ == '__main__':
+    main()
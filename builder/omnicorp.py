@@ -5,6 +5,7 @@ from greent.util import LoggingUtil
 from greent import node_types
 from collections import defaultdict
 from datetime import datetime as dt
+from supporter import Supporter
 
 logger = LoggingUtil.init_logging (__file__, logging.DEBUG)
 
@@ -12,10 +13,13 @@ def get_supporter(greent):
     return OmnicorpSupport(greent)
 
 
-class OmnicorpSupport():
+class OmnicorpSupport(Supporter):
+
+    # Shared PMIDs don't depend on which node is asked about first
+    symmetric = True
 
     def __init__(self,greent):
-        self.greent = greent
+        super().__init__(greent)
         self.omnicorp = greent.omnicorp
 
     def term_to_term(self,node_a,node_b):
@@ -31,8 +35,3 @@ class OmnicorpSupport():
             ke.target_node = node_b
             return ke
         return None
-
-
-    def prepare(self,nodes):
-        #no node prep required
-        pass
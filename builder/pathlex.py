@@ -17,15 +17,23 @@ def t_EDGE(t):
 def t_error(t):
     raise TypeError("Unknown text '%s'" % (t.value,))
 
-lex.lex()
+# Built on first use rather than at import
+lexer = None
+
+def get_lexer():
+    global lexer
+    if lexer is None:
+        lexer = lex.lex()
+    return lexer
 
 def tokenize_path(path):
-    lex.input(path)
+    lexer = get_lexer()
+    lexer.input(path)
     steps = []
     Step = namedtuple('Step', ['nodetype', 'min_path_length', 'max_path_length' ] )
     mm = [1,1]
     end_ok = False
-    for tok in iter(lex.token, None):
+    for tok in iter(lexer.token, None):
         if tok.type == 'NODE':
             ntype = node_types.type_codes[ tok.value ]
             steps.append( Step( ntype, mm[0], mm[1] ) )
@@ -0,0 +1,54 @@
+"""The pairs of nodes along query paths: each node paired with every node that comes before it on a path
+of one of the programs.  Ancestors are propagated forward one path position at a time as bitsets (a
+Python int per node, bit i standing for node i of the graph), so that passing a hub's ancestors on
+to each of its successors is one OR of machine words rather than a copy of a set, and the pairs are
+only produced, a node at a time, as they are asked for."""
+from itertools import repeat
+import numpy as np
+from prune import path_steps, neighbors
+
+def bit_indices(bits, n_bytes):
+    """The indices of the bits set in bits, which fits in n_bytes"""
+    flags = np.unpackbits(np.frombuffer(bits.to_bytes(n_bytes, 'big'), dtype=np.uint8))
+    return (n_bytes * 8 - 1) - np.flatnonzero(flags)
+
+
+def path_ancestors(graph, program, index):
+    """node index -> bitset of the indices of the nodes before it on one of program's paths.  The
+    paths start at the nodes with position 0, as Program.get_path_descriptor assumes."""
+    program_number = program.program_number
+    forward, _, _ = path_steps(program)
+    nodes = graph.nodes()
+    ancestors = {}
+    current = set(i for i, node in enumerate(nodes) if 0 in node.contexts.get(program_number, ()))
+    position = 0
+    while position in forward:
+        next_position, direction = forward[position]
+        next_nodes = set()
+        for i in current:
+            carry = ancestors.get(i, 0) | (1 << i)
+            for other in neighbors(graph, nodes[i], direction):
+                if next_position in other.contexts.get(program_number, ()):
+                    j = index[other]
+                    ancestors[j] = ancestors.get(j, 0) | carry
+                    next_nodes.add(j)
+        position = next_position
+        current = next_nodes
+    return ancestors
+
+
+def path_pairs(graph, programs, node_id):
+    """Yields (node, ancestor) pairs, as node_id(node) (an int), for every node and each node before it on a path
+    of any of programs.  Each pair comes once, however many programs or paths it is on."""
+    nodes = graph.nodes()
+    index = {node: i for i, node in enumerate(nodes)}
+    combined = {}
+    for program in programs:
+        for i, bits in path_ancestors(graph, program, index).items():
+            combined[i] = combined.get(i, 0) | bits
+    ids = np.array([node_id(node) for node in nodes], dtype=np.int64)
+    n_bytes = (len(nodes) + 7) // 8
+    for i in sorted(combined):
+        bits = combined[i] & ~(1 << i)
+        if bits:
+            yield from zip(repeat(int(ids[i])), ids[bit_indices(bits, n_bytes)].tolist())
@@ -0,0 +1,48 @@
+import logging
+import time
+from collections import Counter
+
+class ProgressLog:
+    """Replaces per-item log lines in hot loops with periodic summaries.
+
+    Events are counted by kind, and an INFO line with the running totals is written at most
+    every interval seconds, plus once when the loop finishes.  The individual events are only
+    formatted and written when DEBUG is on for the logger, so at INFO the cost of an event is a
+    counter increment."""
+
+    def __init__(self, logger, title, total=None, interval=30.0):
+        self.logger = logger
+        self.title = title
+        self.total = total
+        self.interval = interval
+        self.counts = Counter()
+        self.n = 0
+        self.start = time.time()
+        self.next_report = self.start + interval
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+
+    def event(self, kind, detail=None, n=1):
+        """Count n events (normally one).  detail is only formatted if DEBUG is on"""
+        self.n += n
+        self.counts[kind] += n
+        if self.debug and detail is not None:
+            self.logger.debug('%s %s: %s', self.title, kind, detail)
+        if time.time() >= self.next_report:
+            self.report()
+
+    def report(self, final=False):
+        now = time.time()
+        self.next_report = now + self.interval
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        elapsed = now - self.start
+        if self.total:
+            done = '{}/{} ({:.0%})'.format(self.n, self.total, self.n / self.total)
+        else:
+            done = str(self.n)
+        self.logger.info('%s%s: %s in %.1fs (%.0f/s) %s', self.title, ' done' if final else '', done, elapsed,
+                         self.n / elapsed if elapsed > 0 else 0,
+                         ', '.join('{} {}'.format(v, k) for k, v in sorted(self.counts.items())))
+
+    def finish(self):
+        self.report(final=True)
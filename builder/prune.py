@@ -0,0 +1,89 @@
+"""Removal of dead ends from the graph a query's programs built.  Each program walks a path of node
+positions (Program.get_path_descriptor), and each node records the positions it was reached at
+(node.contexts[program_number]).  A node at a position is on a path only if it has a neighbor at the
+next position (unless it is the last) and one at the previous position (unless it is the first),
+joined by an edge in the path's direction; a node that is on no path in any program is a dead end,
+and removing it can make dead ends of its neighbors.
+
+Rather than rescanning the graph until nothing changes, dead_ends keeps a count of each node
+position's neighbors at the next and previous positions, and a worklist of the node positions whose
+count has reached zero.  Each dead node position is taken off the worklist once and decrements only
+its neighbors' counts, so the whole pass is linear in the size of the graph."""
+from collections import defaultdict
+
+def path_steps(program):
+    """For one program, the step forward from each position (position -> (next, direction)), the
+    step back to each position (position -> (previous, direction)), and the last position"""
+    forward = {}
+    back = {}
+    path = program.get_path_descriptor()
+    position = 0
+    while position in path and position not in forward:
+        next_position, direction = path[position]
+        forward[position] = (next_position, direction)
+        back[next_position] = (position, direction)
+        position = next_position
+    return forward, back, position
+
+
+def neighbors(graph, node, direction):
+    return graph.successors(node) if direction > 0 else graph.predecessors(node)
+
+
+def dead_ends(graph, programs, keep=()):
+    """The nodes of graph that are on no path of any of programs, found without changing graph.  Nodes
+    in keep (the query's endpoints) are never dead ends, though they count as neighbors only at the
+    positions where they are on a path; nor are nodes that carry no positions, since there is
+    nothing to judge them by."""
+    keep = set(keep)
+    # (node, program number, position) -> neighbors on a path at the next / previous position
+    ahead = {}
+    behind = {}
+    live_roles = defaultdict(int)
+    steps = {}
+    for program in programs:
+        steps[program.program_number] = path_steps(program)
+    worklist = []
+    for node in graph.nodes():
+        contexts = getattr(node, 'contexts', None)
+        if not contexts:
+            continue
+        for program_number, (forward, back, last) in steps.items():
+            for position in contexts.get(program_number, ()):
+                if position != last and position not in forward:
+                    continue
+                role = (node, program_number, position)
+                live_roles[node] += 1
+                if position != last:
+                    next_position, direction = forward[position]
+                    ahead[role] = sum(1 for other in neighbors(graph, node, direction)
+                                      if next_position in other.contexts.get(program_number, ()))
+                if position != 0:
+                    previous, direction = back[position]
+                    behind[role] = sum(1 for other in neighbors(graph, node, -direction)
+                                       if previous in other.contexts.get(program_number, ()))
+                if ahead.get(role, 1) == 0 or behind.get(role, 1) == 0:
+                    worklist.append(role)
+    dead_roles = set(worklist)
+    dead = []
+    while worklist:
+        role = worklist.pop()
+        node, program_number, position = role
+        live_roles[node] -= 1
+        if live_roles[node] == 0 and node not in keep:
+            dead.append(node)
+        forward, back, last = steps[program_number]
+        # Neighbors that counted this node behind them, then those that counted it ahead of them
+        for counts, step in ((behind, forward.get(position)), (ahead, back.get(position))):
+            if step is None:
+                continue
+            other_position, direction = step
+            towards = direction if counts is behind else -direction
+            for other in neighbors(graph, node, towards):
+                other_role = (other, program_number, other_position)
+                if other_role in counts and other_role not in dead_roles:
+                    counts[other_role] -= 1
+                    if counts[other_role] == 0:
+                        dead_roles.add(other_role)
+                        worklist.append(other_role)
+    return dead
@@ -0,0 +1,239 @@
+"""Adaptive limits on the calls in flight to each remote service.  A fixed limit either holds back a
+fast service or swamps a slow one (omnicorp, the chemotext Cypher endpoint, OXO, CTD, PubChem), and
+the right number changes with the service's load.  Each named service gets an AdaptiveLimiter instead,
+which raises its limit additively while calls come back as quickly as the service has shown it can
+answer, and halves it when a call fails or latency climbs well past that: the AIMD of TCP congestion
+control, with latency standing in for packet loss.  ServiceLimits hands out limited stand-ins for
+rosetta.core and its services, so that the builder, lookups and supporters call through them without
+knowing.  Only the methods that go to the service (REMOTE_METHODS) are limited and timed; local helpers
+such as oxo.is_valid_curie_prefix would otherwise pass for the service's latency."""
+import threading
+import time
+from instrument import NULL_INSTRUMENTATION
+
+DEFAULT_CEILING = 16
+# Service (as named on rosetta.core) -> the methods the builder and supporters call that go to it
+REMOTE_METHODS = {
+    'mondo': ('search', 'get_label'),
+    'hpo': ('search',),
+    'hgnc': ('get_name',),
+    'uberongraph': ('cell_get_cellname',),
+    'ctd': ('drugname_string_to_drug_identifier',),
+    'pharos': ('drugname_string_to_pharos_info',),
+    'chembio': ('drugname_to_pubchem',),
+    'omnicorp': ('get_shared_pmids',),
+    'chemotext': ('query', 'get_chemotext_term_from_meshid'),
+    'chemotext2': ('get_semantic_similarity',),
+    'oxo': ('get_specific_synonym_expanding',),
+}
+
+class AdaptiveLimiter:
+    """The in-flight limit on calls to one service.  Latency is judged a window of calls at a time: the
+    mean of each window of successful calls is compared with the service's usual latency, a moving
+    average of the window means that follows them down quickly (by fall) and up slowly (by rise), so
+    that it keeps up with a service that has become slower for everyone but not with the climb in
+    latency as the limit rises past what the service can take.  Means rather than minimums or medians,
+    so that a service whose calls are a steady mix of quick and slow ones (cached on its side or not,
+    say) isn't taken for one that is slowing down.  A call that completes with the limit in use, while the last window was within
+    tolerance times the usual latency, raises the limit by 1 / limit, i.e. by one per limit calls; a
+    failure, or a window past that, multiplies it by backoff.  The calls in flight when the limit is cut
+    were started under the old limit, so it is cut at most once until they are done.  The limit stays
+    between 1 and ceiling."""
+
+    def __init__(self, name, ceiling=DEFAULT_CEILING, initial=2, tolerance=1.5, backoff=0.5, window=20,
+                 fall=0.5, rise=0.02, instrumentation=None):
+        self.name = name
+        self.ceiling = ceiling
+        self.limit = float(min(initial, ceiling))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.window = window
+        self.fall = fall
+        self.rise = rise
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        # The latencies of the successful calls in the current window
+        self.samples = []
+        # The mean latency of the last window, and the moving average of the window means
+        self.latency = None
+        self.baseline = None
+        self.congested = False
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+        # Calls still in flight from before the last cut
+        self.holdover = 0
+
+    def acquire(self):
+        waited = None
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                start = time.perf_counter()
+                while self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                waited = time.perf_counter() - start
+            self.in_flight += 1
+        if waited is not None:
+            self.metrics.observe('ratelimit_wait_seconds', waited, service=self.name)
+
+    def release(self, seconds, failed=False):
+        """Record a call that took seconds (and failed, or not) and adjust the limit"""
+        with self.condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.calls += 1
+            # A call from before the last cut says nothing about the limit since
+            held = self.holdover > 0
+            if held:
+                self.holdover -= 1
+            self.error_rate += 0.2 * ((1.0 if failed else 0.0) - self.error_rate)
+            cut = False
+            if failed:
+                self.errors += 1
+                cut = True
+            else:
+                self.samples.append(seconds)
+                if len(self.samples) >= self.window:
+                    n = len(self.samples)
+                    self.latency = sum(self.samples) / n
+                    # How far the window's mean could be off, for a mix of quick and slow calls
+                    error = (sum((x - self.latency) ** 2 for x in self.samples) / (n - 1) / n) ** 0.5
+                    self.samples = []
+                    if self.baseline is None:
+                        self.baseline = self.latency
+                    self.congested = self.latency - error > self.tolerance * self.baseline
+                    rate = self.fall if self.latency < self.baseline else self.rise
+                    self.baseline += rate * (self.latency - self.baseline)
+                    cut = self.congested
+            if cut:
+                if not held and self.limit > 1:
+                    self.limit = max(1.0, self.limit * self.backoff)
+                    self.holdover = self.in_flight
+                    self.metrics.count('ratelimit_backoffs', service=self.name)
+            elif saturated and not self.congested:
+                self.limit = min(float(self.ceiling), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+            state = self.state()
+        self.metrics.count('ratelimit_calls', service=self.name)
+        if failed:
+            self.metrics.count('ratelimit_errors', service=self.name)
+        for key in ('limit', 'in_flight', 'latency_seconds', 'error_rate'):
+            if state[key] is not None:
+                self.metrics.gauge('ratelimit_' + key, state[key], service=self.name)
+
+    def call(self, function, *args, **kwargs):
+        """function(*args, **kwargs), once the limit allows"""
+        self.acquire()
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.release(time.perf_counter() - start, failed=True)
+            raise
+        self.release(time.perf_counter() - start)
+        return result
+
+    def state(self):
+        return {'service': self.name, 'limit': self.limit, 'ceiling': self.ceiling, 'in_flight': self.in_flight,
+                'latency_seconds': self.latency, 'baseline_seconds': self.baseline, 'error_rate': self.error_rate,
+                'calls': self.calls, 'errors': self.errors}
+
+
+class LimitedService:
+    """Stands in for a greent service (or anything else with methods that make remote calls), calling
+    its remote methods through limiter and anything else directly"""
+
+    def __init__(self, service, limiter, methods):
+        self.__dict__['service'] = service
+        self.__dict__['limiter'] = limiter
+        self.__dict__['methods'] = frozenset(methods)
+
+    def __getattr__(self, name):
+        value = getattr(self.service, name)
+        if name not in self.methods or not callable(value):
+            return value
+        limiter = self.limiter
+        def limited(*args, **kwargs):
+            return limiter.call(value, *args, **kwargs)
+        return limited
+
+    def __setattr__(self, name, value):
+        setattr(self.service, name, value)
+
+
+class LimitedCore:
+    """Stands in for rosetta.core: core.omnicorp, core.mondo, etc. are limited by the service's name"""
+
+    def __init__(self, core, limits):
+        self.__dict__['core'] = core
+        self.__dict__['limits'] = limits
+
+    def __getattr__(self, name):
+        return self.limits.service(name, getattr(self.core, name))
+
+    def __setattr__(self, name, value):
+        # Supporters may install a service of their own, e.g. chemotext2
+        setattr(self.core, name, value)
+
+
+class ServiceLimits:
+    """An AdaptiveLimiter per service name, made on first use, with ceilings[name] (or default_ceiling)
+    as its ceiling.  Shared by everything in a process that calls the services, so that what one query
+    learns about a service carries over to the next.  remote_methods (by default REMOTE_METHODS) names
+    the methods of each service that are limited; services it doesn't name aren't limited at all."""
+
+    def __init__(self, ceilings=None, default_ceiling=DEFAULT_CEILING, instrumentation=None, remote_methods=None):
+        self.ceilings = dict(ceilings or {})
+        self.remote_methods = REMOTE_METHODS if remote_methods is None else remote_methods
+        self.default_ceiling = default_ceiling
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def instrument(self, instrumentation):
+        """Report to instrumentation from now on, e.g. that of the next query"""
+        with self.lock:
+            self.metrics = instrumentation
+            for limiter in self.limiters.values():
+                limiter.metrics = instrumentation
+
+    def limiter(self, name):
+        with self.lock:
+            limiter = self.limiters.get(name)
+            if limiter is None:
+                limiter = self.limiters[name] = AdaptiveLimiter(
+                    name, self.ceilings.get(name, self.default_ceiling), instrumentation=self.metrics)
+            return limiter
+
+    def service(self, name, service):
+        """service, with its remote calls limited as name's"""
+        methods = self.remote_methods.get(name, ())
+        if not methods:
+            return service
+        return LimitedService(service, self.limiter(name), methods)
+
+    def core(self, core):
+        """rosetta.core, with each service's calls limited"""
+        return LimitedCore(core, self)
+
+    def state(self):
+        with self.lock:
+            limiters = sorted(self.limiters.items())
+        return [limiter.state() for _, limiter in limiters]
+
+
+def parse_ceilings(text):
+    """'omnicorp=4,chemotext=2' -> {'omnicorp': 4, 'chemotext': 2}"""
+    ceilings = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        try:
+            ceilings[name.strip()] = int(value)
+        except ValueError:
+            raise ValueError('Expected service=ceiling, not {!r}'.format(item))
+        if ceilings[name.strip()] < 1:
+            raise ValueError('The ceiling for {} must be at least 1'.format(name.strip()))
+    return ceilings
@@ -0,0 +1,554 @@
+"""A long-running builder: an HTTP/JSON service that takes queries as jobs into a bounded queue and
+runs them in a pool of worker processes.  Each worker imports the builder and sets up its backend
+(Rosetta, its cache and the neo4j driver, the supporter modules) once, so a job pays only for its own
+query rather than for interpreter start-up, imports and connections.
+
+    python service.py --port 8080 --workers 2 -c greent.conf
+
+    POST /jobs        {"pathway": "DGX", "start": "ebola", "end": null, "supports": ["chemotext"]}
+                      -> 202 {"id": ...}, or 503 when the queue is full.  An interactive job can
+                      bound its support with "support_seconds" (and/or "support_calls"), getting
+                      the most promising support edges found in that time
+    GET  /jobs/<id>   state (queued, running, done, failed), current stage, per-stage seconds, and once
+                      done the id of the exported graph with its node and edge counts, and for each
+                      supporter its calls and its failed, skipped and unevaluated pairs
+    GET  /jobs        every job the service remembers
+    GET  /health      workers and queue length; 503 while workers keep failing to set up
+
+The backend is named by an import string, so the service can be exercised without greent services or
+neo4j: --backend bench.stubs:StubBackend runs synthetic queries against the benchmark stubs."""
+import argparse
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from importlib import import_module
+from socketserver import ThreadingMixIn
+import builder
+import startup
+from checkpoint import query_fingerprint
+from pathlex import tokenize_path
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class Unavailable(Exception):
+    """The service can't take jobs at the moment"""
+
+
+def load_backend(spec):
+    """'module:Class' -> the class"""
+    module_name, _, class_name = spec.partition(':')
+    return getattr(import_module(module_name), class_name or 'Backend')
+
+
+class RosettaBackend:
+    """Runs jobs against the configured Rosetta and neo4j.  Built once in each worker.  run_options
+    (e.g. edge_store, support_store) are passed on to run_query for every job."""
+
+    supports = tuple(builder.SUPPORTERS)
+
+    def __init__(self, config='greent.conf', db_sessions=8, log_level='INFO', limit_services=False,
+                 service_ceilings=None, **run_options):
+        self.rosetta = builder.setup(config, log_level)
+        # Kept across jobs, so that each starts with what the last learned about the services
+        self.service_limits = None
+        if limit_services or service_ceilings is not None:
+            self.service_limits = builder.ServiceLimits(service_ceilings)
+        self.run_options = dict(run_options, service_limits=self.service_limits)
+        self.database = builder.Database(self.rosetta.type_graph.driver, max_sessions=db_sessions)
+        for module_name in self.supports:
+            startup.load(module_name)
+
+    @classmethod
+    def validate(cls, job):
+        """Raise ValueError if job can't be run"""
+        for field in ('pathway', 'start'):
+            if not isinstance(job.get(field), str) or not job[field]:
+                raise ValueError('{} is required'.format(field))
+        try:
+            tokenize_path(job['pathway'])
+        except (TypeError, ValueError) as e:
+            raise ValueError('Invalid pathway {}: {}'.format(job['pathway'], e))
+        check_supports(job, cls.supports)
+        check_budget(job)
+
+    def query(self, job):
+        return builder.build_query(job['pathway'], job['start'], job.get('end'), self.rosetta, self.service_limits)
+
+
+def check_budget(job):
+    for field in ('support_seconds', 'support_calls'):
+        value = job.get(field)
+        if value is not None and (not isinstance(value, (int, float)) or value < 0):
+            raise ValueError('{} must be a non-negative number'.format(field))
+
+
+def check_supports(job, allowed):
+    supports = job.get('supports')
+    if not isinstance(supports, list) or not supports:
+        raise ValueError('supports must be a non-empty list')
+    unknown = [name for name in supports if name not in allowed]
+    if unknown:
+        raise ValueError('Unknown supports {}; choose from {}'.format(', '.join(map(str, unknown)), ', '.join(allowed)))
+
+
+def work(backend_spec, options, connection):
+    """A worker process: set up the backend, then run the jobs it is sent on connection (its end of a
+    pipe, which unlike a queue has nothing in flight if the worker dies) until it's sent None, reporting
+    back on the same connection"""
+    try:
+        backend = load_backend(backend_spec)(**options)
+    except Exception:
+        connection.send(('setup_failed', None, traceback.format_exc()))
+        return
+    pid = os.getpid()
+    connection.send(('ready', None, pid))
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        job_id = job['id']
+        connection.send(('started', job_id, pid))
+        stage_started = [time.perf_counter()]
+
+        def on_stage(stage):
+            now = time.perf_counter()
+            connection.send(('stage', job_id, (stage, now - stage_started[0])))
+            stage_started[0] = now
+
+        try:
+            query = backend.query(job)
+            kgraph = builder.run_query(query, job['supports'], backend.rosetta, database=backend.database,
+                                       export_writers=job.get('export_writers', 0), on_stage=on_stage,
+                                       support_seconds=job.get('support_seconds'),
+                                       support_calls=job.get('support_calls'),
+                                       **backend.run_options)
+            result = {'graph_id': query_fingerprint(query, job['supports']),
+                      'nodes': len(kgraph.graph.nodes()),
+                      'edges': len(kgraph.graph.edges()),
+                      'support': kgraph.support_failures}
+        except Exception:
+            connection.send(('failed', job_id, traceback.format_exc()))
+        else:
+            connection.send(('done', job_id, result))
+
+
+class WorkerPool:
+    """Worker processes that each set up a backend once and are then sent jobs (dicts with an id) one at
+    a time over their own pipes, from a queue the pool holds.  Since the pool hands the jobs out, it
+    knows which job each worker has, even one that dies before reporting it started.  events() sends
+    waiting jobs to idle workers and collects what the workers report:
+        ('ready', None, pid)                  the worker's backend is set up
+        ('started', job_id, pid)
+        ('stage', job_id, (stage, seconds))
+        ('done', job_id, result)
+        ('failed', job_id, error)
+        ('setup_failed', None, error)         the worker couldn't set up its backend, and exited
+        ('exited', None, pid)                 the worker died, and will be replaced
+    A worker that dies with a job, started or not, also produces a 'failed' event for the job.  A worker
+    that exits before it is ready is restarted after restart_delay seconds, doubling with each such exit
+    in a row up to max_restart_delay; after max_setup_failures of them the pool is broken() until a
+    worker gets ready, and the jobs waiting are for the caller to fail (drain())."""
+
+    restart_delay = 1.0
+    max_restart_delay = 60.0
+    max_setup_failures = 5
+
+    def __init__(self, backend_spec, options=None, n_workers=2, queue_size=0):
+        self.logger = logging.getLogger('application')
+        self.backend_spec = backend_spec
+        self.options = options or {}
+        self.jobs = queue.Queue(queue_size)
+        self.workers = [None] * n_workers
+        self.connections = [None] * n_workers
+        self.running = [None] * n_workers
+        self.idle = [False] * n_workers
+        self.ever_ready = [False] * n_workers
+        # Worker -> when to restart it
+        self.restarts = {}
+        self.setup_failures = 0
+        self.setup_error = None
+        self.stopping = False
+        # Wakes events() when a job is submitted from another thread
+        self.wakeup, self.waker = multiprocessing.Pipe(duplex=False)
+        self.wake_lock = threading.Lock()
+        self.woken = False
+
+    def start(self):
+        for i in range(len(self.workers)):
+            self.start_worker(i)
+
+    def start_worker(self, i):
+        connection, worker_connection = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=work, args=(self.backend_spec, self.options, worker_connection),
+                                         daemon=True)
+        worker.start()
+        # Only the worker holds its end now, so the pipe reads as closed once it exits
+        worker_connection.close()
+        self.workers[i] = worker
+        self.connections[i] = connection
+        self.running[i] = None
+        self.idle[i] = False
+        self.ever_ready[i] = False
+        self.logger.info('Started worker %d', worker.pid)
+
+    def submit(self, job, block=True):
+        """Queue job for the next idle worker.  With block false, raises queue.Full if the queue is."""
+        self.jobs.put(job, block)
+        with self.wake_lock:
+            if not self.woken:
+                self.woken = True
+                self.waker.send_bytes(b'')
+
+    def drain(self):
+        """Take the jobs still waiting off the queue, and return them"""
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.jobs.get_nowait())
+            except queue.Empty:
+                return jobs
+
+    def broken(self):
+        """Whether workers keep failing to set up"""
+        return self.setup_failures >= self.max_setup_failures
+
+    def alive(self):
+        return len([worker for worker in self.workers if worker is not None and worker.is_alive()])
+
+    def dispatch(self):
+        """Send the next waiting job to each idle worker"""
+        for i, connection in enumerate(self.connections):
+            if connection is None or not self.idle[i]:
+                continue
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            self.idle[i] = False
+            self.running[i] = job['id']
+            try:
+                connection.send(job)
+            except OSError:
+                # The worker has died; reading its pipe will say so, and fail the job
+                pass
+
+    def restart_due(self):
+        now = time.time()
+        for i, when in sorted(self.restarts.items()):
+            if when <= now:
+                del self.restarts[i]
+                self.start_worker(i)
+
+    def events(self, timeout=1):
+        """The events reported within timeout seconds (possibly none)"""
+        self.restart_due()
+        self.dispatch()
+        if self.restarts:
+            timeout = max(0, min(timeout, min(self.restarts.values()) - time.time()))
+        connections = [connection for connection in self.connections if connection is not None]
+        events = []
+        for connection in multiprocessing.connection.wait(connections + [self.wakeup], timeout):
+            if connection is self.wakeup:
+                with self.wake_lock:
+                    while self.wakeup.poll():
+                        self.wakeup.recv_bytes()
+                    self.woken = False
+                continue
+            i = self.connections.index(connection)
+            try:
+                while connection.poll():
+                    event = connection.recv()
+                    kind, job_id, detail = event
+                    if kind == 'ready':
+                        self.idle[i] = self.ever_ready[i] = True
+                        self.setup_failures = 0
+                        self.setup_error = None
+                    elif kind in ('done', 'failed'):
+                        self.running[i] = None
+                        self.idle[i] = True
+                    elif kind == 'setup_failed':
+                        self.setup_error = detail
+                    events.append(event)
+            except (EOFError, OSError):
+                events.extend(self.replace(i))
+        self.dispatch()
+        return events
+
+    def replace(self, i):
+        worker = self.workers[i]
+        worker.join(5)
+        self.connections[i].close()
+        self.connections[i] = None
+        events = []
+        if self.running[i] is not None:
+            events.append(('failed', self.running[i], 'Worker exited with {}'.format(worker.exitcode)))
+        self.running[i] = None
+        self.idle[i] = False
+        events.append(('exited', None, worker.pid))
+        if self.stopping:
+            return events
+        delay = 0
+        if not self.ever_ready[i]:
+            self.setup_failures += 1
+            delay = min(self.max_restart_delay, self.restart_delay * 2 ** (self.setup_failures - 1))
+        self.logger.error('Worker %d exited with %s%s; restarting it in %.1fs', worker.pid, worker.exitcode,
+                          '' if self.ever_ready[i] else ' before it was ready', delay)
+        self.restarts[i] = time.time() + delay
+        return events
+
+    def stop(self, timeout=30):
+        self.stopping = True
+        self.restarts = {}
+        for connection in self.connections:
+            if connection is not None:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+        for worker in self.workers:
+            if worker is None:
+                continue
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+
+
+class BuilderService:
+    """The job table and the worker pool behind the HTTP interface.  Jobs go to the workers through a
+    bounded queue, and a listener thread applies what they report to the job table.  A worker that dies
+    is replaced, and the job it had marked failed.  While the pool is broken (its workers keep failing to
+    set up the backend) the service is unhealthy, refuses jobs and fails the ones waiting."""
+
+    def __init__(self, backend_spec, options=None, n_workers=2, queue_size=16, history=1000):
+        self.logger = logging.getLogger('application')
+        self.backend = load_backend(backend_spec)
+        self.pool = WorkerPool(backend_spec, options, n_workers=n_workers, queue_size=queue_size)
+        self.history = history
+        self.table = OrderedDict()
+        self.lock = threading.Lock()
+        self.ready = set()
+        self.stopping = threading.Event()
+        self.listener = threading.Thread(target=self.listen, name='service-listener', daemon=True)
+
+    def start(self):
+        self.pool.start()
+        self.listener.start()
+
+    def stop(self, timeout=30):
+        self.stopping.set()
+        self.listener.join(timeout)
+        self.pool.stop(timeout)
+
+    def submit(self, job):
+        """Queue a job (a dict as posted); returns its id.  Raises ValueError for a job that can't be run,
+        queue.Full when the service is already holding as many jobs as it will, and Unavailable when its
+        workers can't be set up."""
+        if not isinstance(job, dict):
+            raise ValueError('A job is a JSON object')
+        self.backend.validate(job)
+        if self.pool.broken():
+            raise Unavailable('The workers could not set up the backend: ' + last_line(self.pool.setup_error))
+        job = dict(job, id=uuid.uuid4().hex)
+        record = {'id': job['id'], 'job': job, 'state': QUEUED, 'submitted': time.time(), 'stage': None,
+                  'timings': OrderedDict(), 'worker': None, 'result': None, 'error': None}
+        with self.lock:
+            self.table[job['id']] = record
+        try:
+            self.pool.submit(job, block=False)
+        except queue.Full:
+            with self.lock:
+                del self.table[job['id']]
+            raise
+        return job['id']
+
+    def status(self, job_id):
+        with self.lock:
+            record = self.table.get(job_id)
+            return None if record is None else json.loads(json.dumps(record))
+
+    def statuses(self):
+        with self.lock:
+            return [{'id': record['id'], 'state': record['state'], 'stage': record['stage']}
+                    for record in self.table.values()]
+
+    def health(self):
+        with self.lock:
+            states = [record['state'] for record in self.table.values()]
+            ready = len(self.ready)
+        return {'healthy': not self.pool.broken(),
+                'workers': self.pool.alive(),
+                'ready': ready,
+                'queued': states.count(QUEUED),
+                'running': states.count(RUNNING),
+                'setup_failures': self.pool.setup_failures,
+                'setup_error': last_line(self.pool.setup_error)}
+
+    def listen(self):
+        while not self.stopping.is_set():
+            for kind, job_id, detail in self.pool.events(timeout=1):
+                with self.lock:
+                    self.apply(kind, job_id, detail)
+
+    def apply(self, kind, job_id, detail):
+        """Update the job table with one worker event.  Called with the lock held."""
+        if kind == 'ready':
+            self.ready.add(detail)
+            return
+        if kind == 'exited':
+            self.ready.discard(detail)
+            return
+        if kind == 'setup_failed':
+            self.logger.error('A worker could not set up the backend:\n%s', detail)
+            if self.pool.broken():
+                error = 'The workers could not set up the backend:\n' + detail
+                for job in self.pool.drain():
+                    self.apply(FAILED, job['id'], error)
+            return
+        record = self.table.get(job_id)
+        if record is None:
+            return
+        if kind == 'started':
+            record['state'] = RUNNING
+            record['worker'] = detail
+            record['started'] = time.time()
+        elif kind == 'stage':
+            stage, seconds = detail
+            record['stage'] = stage
+            record['timings'][stage] = seconds
+        elif kind == 'done':
+            record['state'] = DONE
+            record['result'] = detail
+            record['finished'] = time.time()
+        elif kind == 'failed':
+            record['state'] = FAILED
+            record['error'] = detail
+            record['finished'] = time.time()
+        if kind in ('done', 'failed'):
+            self.logger.info('Job %s %s', job_id, record['state'])
+            self.forget_old_jobs()
+
+    def forget_old_jobs(self):
+        """Keep at most history finished jobs.  Called with the lock held."""
+        finished = [job_id for job_id, record in self.table.items() if record['state'] in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.table[job_id]
+
+
+def last_line(text):
+    """The last line of a traceback, i.e. the exception"""
+    return text.strip().split('\n')[-1] if text else None
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    JOB_PATH = re.compile(r'^/jobs/([0-9a-f]+)$')
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            health = service.health()
+            self.reply(200 if health['healthy'] else 503, health)
+        elif self.path == '/jobs':
+            self.reply(200, service.statuses())
+        else:
+            match = self.JOB_PATH.match(self.path)
+            record = service.status(match.group(1)) if match is not None else None
+            if record is None:
+                self.reply(404, {'error': 'No such job'})
+            else:
+                self.reply(200, record)
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self.reply(404, {'error': 'Jobs are posted to /jobs'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            job_id = self.server.service.submit(job)
+        except ValueError as e:
+            self.reply(400, {'error': str(e)})
+        except queue.Full:
+            self.reply(503, {'error': 'The job queue is full; try again later'})
+        except Unavailable as e:
+            self.reply(503, {'error': str(e)})
+        else:
+            self.reply(202, {'id': job_id})
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.getLogger('application').debug('%s ' + format, self.address_string(), *args)
+
+
+class ServiceServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the builder as a service with a job queue and warm workers')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes, each running one job at a time')
+    parser.add_argument('--queue-size', type=int, default=16, help='Jobs waiting beyond this are refused with 503')
+    parser.add_argument('--backend', default='service:RosettaBackend',
+                        help='module:Class to run jobs with, e.g. bench.stubs:StubBackend')
+    parser.add_argument('-c', '--config', help='Rosetta environment configuration file.', default='greent.conf')
+    parser.add_argument('--db-sessions', help='Most neo4j sessions open at once in each worker',
+                        type=int, default=8)
+    parser.add_argument('--limit-services', action='store_true',
+                        help='Adapt the calls in flight to each remote service to its latency and errors')
+    parser.add_argument('--service-ceilings', type=builder.parse_ceilings,
+                        help='Most calls in flight to a service from each worker, e.g. omnicorp=4,chemotext=2')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], default='INFO')
+    args = parser.parse_args()
+    logger = logging.getLogger('application')
+    logger.setLevel(getattr(logging, args.log_level))
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    options = {'config': args.config, 'db_sessions': args.db_sessions, 'log_level': args.log_level}
+    if args.limit_services:
+        options['limit_services'] = True
+    if args.service_ceilings is not None:
+        options['service_ceilings'] = args.service_ceilings
+    service = BuilderService(args.backend, options,
+                             n_workers=args.workers, queue_size=args.queue_size)
+    service.start()
+    server = ServiceServer((args.host, args.port), service)
+    logger.info('Builder service listening on %s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
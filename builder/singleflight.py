@@ -0,0 +1,82 @@
+"""Coalescing of identical calls that are in flight at the same time.  When programs (or queries) run
+concurrently they ask for the same things at once, e.g. synonymize(MONDO:0005136) from several
+programs within the same second; only the first of them should go to the service."""
+import threading
+import time
+from instrument import NULL_INSTRUMENTATION
+
+class Lease:
+    """The pending result of one in-flight call, which the calls that coalesce with it wait on"""
+
+    def __init__(self):
+        self.owner = threading.get_ident()
+        self.taken = time.monotonic()
+        self.done = threading.Event()
+        self.value = None
+
+
+class CoalescingCache:
+    """Wraps rosetta.cache, which Programs (and supporters) check before calling a service and set
+    afterwards.  The first thread to miss on a key takes a lease on it until it sets the key; other
+    threads getting the key meanwhile wait for that value rather than missing too and repeating the
+    service call.  A leaseholder whose call failed releases the lease (or all it holds, when the program
+    it was running raises); waiters then miss as they would have.  A lease never set or released expires
+    after lease_timeout seconds, and the next to miss takes a new one.
+    Counts singleflight_calls (misses that went on to the service) and singleflight_coalesced (waits
+    that got the leaseholder's value)."""
+
+    def __init__(self, cache, instrumentation=None, lease_timeout=30):
+        self.cache = cache
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.lease_timeout = lease_timeout
+        self.lock = threading.Lock()
+        self.leases = {}
+
+    def get(self, key):
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        now = time.monotonic()
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or now - lease.taken > self.lease_timeout:
+                lease = None
+                self.leases[key] = Lease()
+        if lease is None:
+            self.metrics.count('singleflight_calls')
+            return None
+        if lease.owner == threading.get_ident():
+            # Asking again before setting it; waiting would be waiting on ourselves
+            return None
+        if lease.done.wait(lease.taken + self.lease_timeout - now) and lease.value is not None:
+            self.metrics.count('singleflight_coalesced')
+            return lease.value
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+        with self.lock:
+            lease = self.leases.pop(key, None)
+        if lease is not None:
+            lease.value = value
+            lease.done.set()
+
+    def release(self, key):
+        """Give up a lease without a value, e.g. when the call it was taken for failed"""
+        with self.lock:
+            lease = self.leases.pop(key, None)
+        if lease is not None:
+            lease.done.set()
+
+    def release_held(self):
+        """Give up every lease the calling thread holds, e.g. when the program it was running has ended
+        (failed, perhaps) without setting them"""
+        owner = threading.get_ident()
+        with self.lock:
+            held = [key for key, lease in self.leases.items() if lease.owner == owner]
+            leases = [self.leases.pop(key) for key in held]
+        for lease in leases:
+            lease.done.set()
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
@@ -0,0 +1,360 @@
+"""Binary snapshots of a built KnowledgeGraph, so that a graph can be supported again, exported again or
+ranked without crawling for it again.
+
+A snapshot is a directory of numpy arrays (like the CDW index) and a small manifest.  Strings (ids,
+types, labels, predicates) are interned into one table and everything else refers to them by number;
+nodes and edges are stored column-wise, with each node's synonyms, node_map keys and path contexts as
+CSR lists (one flat array and per-node offsets).  Property dicts and other values without a column of
+their own are stored once each as JSON (or a pickle, if they aren't JSON) in a table of blobs.
+
+Snapshot.open memory-maps the arrays, so a snapshot opens in milliseconds however big it is, and a
+string, blob, node or edge is only decoded when it is asked for."""
+import datetime
+import json
+import logging
+import os
+import pickle
+import shutil
+from collections import defaultdict
+import numpy as np
+
+FORMAT = 1
+MANIFEST = 'manifest.json'
+# Attributes of nodes and edges that hold a string (or None), each stored as a column of string ids
+NODE_STRINGS = ('identifier', 'node_type', 'label')
+EDGE_STRINGS = ('edge_source', 'predicate_id', 'predicate_label', 'input_id', 'standard_predicate_id',
+                'standard_predicate_label', 'url')
+# Attributes stored as one blob each; anything else an object carries goes into its 'extra' blob
+NODE_BLOBS = ('properties', 'mesh_identifiers')
+EDGE_BLOBS = ('publications', 'properties')
+NODE_COLUMNS = NODE_STRINGS + NODE_BLOBS + ('synonyms', 'contexts')
+EDGE_COLUMNS = EDGE_STRINGS + EDGE_BLOBS + ('ctime', 'is_support', 'source_node', 'target_node')
+EPOCH = datetime.datetime(1970, 1, 1)
+NO_TIME = np.iinfo(np.int64).min
+# In a column of string or blob ids: the attribute is None / the object doesn't have the attribute
+NONE = -1
+ABSENT = -2
+# Blobs up to this size that decode to a flat dict or list are decoded once and copied after that
+SHARED_BLOB_BYTES = 128
+
+class Interner:
+    """Values (str, or encoded blobs as bytes) to ids, written out as one byte array and offsets"""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def add(self, value):
+        vid = self.ids.get(value)
+        if vid is None:
+            vid = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return vid
+
+    def arrays(self):
+        data = [value.encode('utf-8') if isinstance(value, str) else value for value in self.values]
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in data], out=offsets[1:])
+        return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+
+def encode_blob(value):
+    """JSON if value survives a round trip through it, otherwise a pickle"""
+    try:
+        text = json.dumps(value, sort_keys=True)
+        if json.loads(text) == value:
+            return b'j' + text.encode('utf-8')
+    except (TypeError, ValueError):
+        pass
+    return b'p' + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def is_flat(value):
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, list):
+        return False
+    return all(x is None or isinstance(x, (str, int, float)) for x in value)
+
+
+def decode_blob(data):
+    if data[:1] == b'j':
+        return json.loads(data[1:].decode('utf-8'))
+    return pickle.loads(data[1:])
+
+
+class CSRBuilder:
+    """Per-node lists (or lists of rows of width values) as one flat array and offsets into it"""
+
+    def __init__(self):
+        self.offsets = [0]
+        self.values = []
+
+    def add(self, values):
+        self.values.extend(values)
+        self.offsets.append(len(self.values))
+
+    def arrays(self, dtype, width=None):
+        values = np.array(self.values, dtype=dtype)
+        if width is not None:
+            values = values.reshape(-1, width)
+        return values, np.array(self.offsets, dtype=np.int64)
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self.strings = Interner()
+        self.blobs = Interner()
+        self.columns = defaultdict(list)
+
+    def string_id(self, value):
+        return NONE if value is None else self.strings.add(value)
+
+    def blob_id(self, value):
+        return self.blobs.add(encode_blob(value))
+
+    def add_object(self, prefix, obj, string_fields, blob_fields, columned):
+        """Columns for obj's string and blob attributes, and its other attributes as one 'extra' blob.
+        A value that doesn't fit its column (see fits_column) goes in the extra blob instead."""
+        attributes = dict(getattr(obj, '__dict__', {}))
+        extra = {}
+        for name, value in attributes.items():
+            if name not in columned or not fits_column(name, value, string_fields):
+                extra[name] = value
+        for name in string_fields:
+            if name in attributes and name not in extra:
+                self.columns[prefix + name].append(self.string_id(attributes[name]))
+            else:
+                self.columns[prefix + name].append(ABSENT)
+        for name in blob_fields:
+            self.columns[prefix + name].append(self.blob_id(attributes[name]) if name in attributes else ABSENT)
+        self.columns[prefix + 'extra'].append(self.blob_id(extra) if extra else ABSENT)
+        return attributes
+
+
+def fits_column(name, value, string_fields):
+    if name in string_fields:
+        return value is None or isinstance(value, str)
+    if name == 'ctime':
+        return isinstance(value, datetime.datetime) and value.tzinfo is None
+    if name == 'is_support':
+        return isinstance(value, bool)
+    return True
+
+
+def write(directory, graph, node_keys, stage, fingerprint=None):
+    """Write graph (a networkx MultiDiGraph of KNodes, with each KEdge as the 'object' of an edge) to
+    directory.  node_keys(node) gives the identifiers node_map sends to node.  The snapshot is built to
+    the side and moved into place, replacing any older one."""
+    writer = SnapshotWriter()
+    nodes = graph.nodes()
+    index = {}
+    synonyms = CSRBuilder()
+    keys = CSRBuilder()
+    contexts = CSRBuilder()
+    for i, node in enumerate(nodes):
+        index[node] = i
+        attributes = writer.add_object('node_', node, NODE_STRINGS, NODE_BLOBS, NODE_COLUMNS)
+        synonyms.add(writer.strings.add(s) for s in sorted(attributes.get('synonyms', ())))
+        keys.add(writer.strings.add(k) for k in node_keys(node))
+        node_contexts = attributes.get('contexts') or {}
+        contexts.add((program_number, position) for program_number in sorted(node_contexts)
+                     for position in sorted(node_contexts[program_number]))
+    columns = writer.columns
+    edge = None
+    for source, target, data in graph.edges(data=True):
+        edge = data['object']
+        attributes = writer.add_object('edge_', edge, EDGE_STRINGS, EDGE_BLOBS, EDGE_COLUMNS)
+        columns['edge_source_node'].append(index[source])
+        columns['edge_target_node'].append(index[target])
+        is_support = attributes.get('is_support')
+        columns['edge_is_support'].append(int(is_support) if fits_column('is_support', is_support, EDGE_STRINGS)
+                                          else ABSENT)
+        ctime = attributes.get('ctime')
+        if fits_column('ctime', ctime, EDGE_STRINGS):
+            columns['edge_ctime'].append((ctime - EPOCH) // datetime.timedelta(microseconds=1))
+        else:
+            columns['edge_ctime'].append(NO_TIME)
+    arrays = {}
+    for name, values in writer.columns.items():
+        if name == 'edge_is_support':
+            arrays[name] = np.array(values, dtype=np.int8)
+        elif name == 'edge_ctime':
+            arrays[name] = np.array(values, dtype=np.int64)
+        else:
+            arrays[name] = np.array(values, dtype=np.int32)
+    arrays['node_synonyms'], arrays['node_synonyms_offsets'] = synonyms.arrays(np.int32)
+    arrays['node_keys'], arrays['node_keys_offsets'] = keys.arrays(np.int32)
+    arrays['node_contexts'], arrays['node_contexts_offsets'] = contexts.arrays(np.int32, width=2)
+    arrays['strings'], arrays['string_offsets'] = writer.strings.arrays()
+    arrays['blobs'], arrays['blob_offsets'] = writer.blobs.arrays()
+    manifest = {'format': FORMAT, 'stage': stage, 'fingerprint': fingerprint,
+                'nodes': len(nodes), 'edges': len(arrays.get('edge_source_node', ())),
+                'node_class': class_name(nodes[0]) if nodes else None,
+                'edge_class': class_name(edge) if edge is not None else None,
+                'arrays': sorted(arrays)}
+    temporary = '{}.{}.tmp'.format(directory.rstrip(os.sep), os.getpid())
+    os.makedirs(temporary)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, name + '.npy'), array)
+    with open(os.path.join(temporary, MANIFEST), 'w') as outf:
+        json.dump(manifest, outf, indent=1)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(temporary, directory)
+    logging.getLogger('application').info('Snapshot of %d nodes and %d edges written to %s',
+                                          manifest['nodes'], manifest['edges'], directory)
+
+
+def class_name(obj):
+    return '{}:{}'.format(type(obj).__module__, type(obj).__qualname__)
+
+
+def load_class(name):
+    module_name, _, qualname = name.partition(':')
+    obj = __import__(module_name, fromlist=[qualname])
+    for part in qualname.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+class Snapshot:
+    """A snapshot opened for reading.  Nodes and edges are numbered in the order they were written;
+    node(i) and edge(k) decode them (edges referring to the same node objects), and the rest of the
+    snapshot stays on disk until touched."""
+
+    def __init__(self, directory, manifest, arrays):
+        self.directory = directory
+        self.manifest = manifest
+        self.arrays = arrays
+        # What node() and edge() read from: the arrays, or once preloaded, lists of their values
+        self.columns = arrays
+        self.n_nodes = manifest['nodes']
+        self.n_edges = manifest['edges']
+        self.stage = manifest['stage']
+        self.fingerprint = manifest.get('fingerprint')
+        self.decoded_strings = {}
+        self.decoded_nodes = {}
+        self.shared_blobs = {}
+        self.node_class = load_class(manifest['node_class']) if manifest.get('node_class') else None
+        self.edge_class = load_class(manifest['edge_class']) if manifest.get('edge_class') else None
+
+    @classmethod
+    def open(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, MANIFEST), 'r') as inf:
+            manifest = json.load(inf)
+        if manifest.get('format') != FORMAT:
+            raise ValueError('{} is a snapshot in format {}, not {}'.format(directory, manifest.get('format'), FORMAT))
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in manifest['arrays']}
+        return cls(directory, manifest, arrays)
+
+    def preload(self):
+        """Read every column into memory at once, which is much quicker than reading a value at a time
+        from the mapped arrays when all of the snapshot is going to be decoded anyway"""
+        columns = {name: array.tolist() for name, array in self.arrays.items() if name not in ('strings', 'blobs')}
+        columns['strings'] = self.arrays['strings'].tobytes()
+        columns['blobs'] = self.arrays['blobs'].tobytes()
+        self.columns = columns
+
+    def string(self, sid):
+        if sid == NONE:
+            return None
+        value = self.decoded_strings.get(sid)
+        if value is None:
+            offsets = self.columns['string_offsets']
+            value = bytes(self.columns['strings'][offsets[sid]:offsets[sid + 1]]).decode('utf-8')
+            self.decoded_strings[sid] = value
+        return value
+
+    def blob(self, bid):
+        """The value of blob bid.  Callers may change what they get, so each gets its own copy."""
+        value = self.shared_blobs.get(bid)
+        if value is not None:
+            return value.copy()
+        offsets = self.columns['blob_offsets']
+        data = bytes(self.columns['blobs'][offsets[bid]:offsets[bid + 1]])
+        value = decode_blob(data)
+        if len(data) <= SHARED_BLOB_BYTES and is_flat(value):
+            # A small dict or list of plain values, such as the {'reversed': False} many edges share, is kept
+            # decoded, since a shallow copy of it is a lot cheaper than decoding it again
+            self.shared_blobs[bid] = value
+            return value.copy()
+        return value
+
+    def csr(self, name, i):
+        offsets = self.columns[name + '_offsets']
+        return self.columns[name][offsets[i]:offsets[i + 1]]
+
+    def identifier(self, i):
+        return self.string(int(self.columns['node_identifier'][i]))
+
+    def node_type(self, i):
+        return self.string(int(self.columns['node_node_type'][i]))
+
+    def node_keys(self, i):
+        """The identifiers node_map sent to node i"""
+        return [self.string(int(k)) for k in self.csr('node_keys', i)]
+
+    def attributes(self, prefix, i, string_fields, blob_fields):
+        attributes = {}
+        for name in string_fields:
+            sid = int(self.columns[prefix + name][i])
+            if sid != ABSENT:
+                attributes[name] = self.string(sid)
+        for name in blob_fields:
+            bid = int(self.columns[prefix + name][i])
+            if bid != ABSENT:
+                attributes[name] = self.blob(bid)
+        extra = int(self.columns[prefix + 'extra'][i])
+        if extra != ABSENT:
+            attributes.update(self.blob(extra))
+        return attributes
+
+    def node(self, i):
+        node = self.decoded_nodes.get(i)
+        if node is not None:
+            return node
+        attributes = self.attributes('node_', i, NODE_STRINGS, NODE_BLOBS)
+        attributes['synonyms'] = set(self.string(int(s)) for s in self.csr('node_synonyms', i))
+        contexts = defaultdict(set)
+        for program_number, position in self.csr('node_contexts', i):
+            contexts[program_number].add(position)
+        attributes['contexts'] = contexts
+        # Restored attribute by attribute rather than through the constructor, whose arguments
+        # have changed between greent versions
+        node = self.node_class.__new__(self.node_class)
+        node.__dict__.update(attributes)
+        self.decoded_nodes[i] = node
+        return node
+
+    def edge(self, k):
+        """(source node number, target node number, KEdge)"""
+        attributes = self.attributes('edge_', k, EDGE_STRINGS, EDGE_BLOBS)
+        source = int(self.columns['edge_source_node'][k])
+        target = int(self.columns['edge_target_node'][k])
+        is_support = int(self.columns['edge_is_support'][k])
+        if is_support != ABSENT:
+            attributes['is_support'] = bool(is_support)
+        ctime = int(self.columns['edge_ctime'][k])
+        if ctime != NO_TIME:
+            attributes['ctime'] = EPOCH + datetime.timedelta(microseconds=ctime)
+        attributes['source_node'] = self.node(source)
+        attributes['target_node'] = self.node(target)
+        edge = self.edge_class.__new__(self.edge_class)
+        edge.__dict__.update(attributes)
+        return source, target, edge
+
+    def edge_numbers(self, support=True):
+        """The numbers of the edges, leaving out the support edges unless support"""
+        if support or self.n_edges == 0:
+            return range(self.n_edges)
+        return np.flatnonzero(self.arrays['edge_is_support'] != 1).tolist()
+
+    def nodes(self):
+        for i in range(self.n_nodes):
+            yield self.node(i)
+
+    def edges(self):
+        for k in range(self.n_edges):
+            yield self.edge(k)
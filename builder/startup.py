@@ -0,0 +1,28 @@
+"""Deferred loading of the heavy modules (greent's Rosetta and service stack, networkx, numpy,
+supporter modules), so that the CLI can show help, validate a pathway or list supporters without
+paying for them.  Modules loaded through load() are timed for the import report."""
+import time
+from collections import OrderedDict
+from importlib import import_module
+
+# Module name -> seconds its first load took (including whatever it imported in turn)
+IMPORT_SECONDS = OrderedDict()
+
+def load(module_name):
+    """import_module, timing the first load of each module"""
+    if module_name in IMPORT_SECONDS:
+        return import_module(module_name)
+    start = time.perf_counter()
+    module = import_module(module_name)
+    IMPORT_SECONDS[module_name] = time.perf_counter() - start
+    return module
+
+
+def report(since=None):
+    """Lines describing the deferred imports so far, slowest first.  since (a time.perf_counter()
+    value, normally taken at process start) adds a line for the total time elapsed."""
+    lines = ['{:<30} {:>8.3f}s'.format(name, seconds)
+             for name, seconds in sorted(IMPORT_SECONDS.items(), key=lambda item: -item[1])]
+    if since is not None:
+        lines.append('{:<30} {:>8.3f}s'.format('total since start', time.perf_counter() - since))
+    return lines
@@ -0,0 +1,79 @@
+class SupportFailure:
+    """In place of a result from term_to_terms, for a pair whose lookup raised exception"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+    def __repr__(self):
+        return 'SupportFailure({!r})'.format(self.exception)
+
+
+def term_to_terms(supporter, pairs):
+    """supporter.term_to_term for each pair, with a SupportFailure in place of any that raised"""
+    results = []
+    for node_a, node_b in pairs:
+        try:
+            results.append(supporter.term_to_term(node_a, node_b))
+        except Exception as e:
+            results.append(SupportFailure(e))
+    return results
+
+
+def has_bulk_lookup(supporter):
+    """Whether supporter's term_to_terms is its own, rather than a term_to_term per pair"""
+    method = getattr(type(supporter), 'term_to_terms', None)
+    return method is not None and method is not Supporter.term_to_terms
+
+
+class Supporter:
+    """Base class for the support modules.  A support module provides get_supporter(greent),
+    returning an object with this interface.
+
+    Beyond prepare(nodes) and term_to_term(node_a, node_b), a supporter says which nodes it can
+    say anything about, so that the builder can skip impossible pairs before looking in any cache:
+        node_types: the node types it can support, or None for any
+        prefixes:   identifier prefixes (e.g. 'ICD9') of which a node needs at least one among its
+                    synonyms, or None for any
+        symmetric:  whether term_to_term(a, b) and term_to_term(b, a) give the same answer
+    Subclasses with more particular needs override applicable(node).  Applicability is only asked
+    after prepare, so it can depend on what prepare found."""
+
+    node_types = None
+    prefixes = None
+    symmetric = False
+
+    def __init__(self, greent):
+        self.greent = greent
+
+    def prepare(self, nodes):
+        pass
+
+    def applicable(self, node):
+        """Whether term_to_term can find anything for a pair including node"""
+        if self.node_types is not None and node.node_type not in self.node_types:
+            return False
+        if self.prefixes is not None and not any(synonym.startswith(self.prefixes) for synonym in node.synonyms):
+            return False
+        return True
+
+    def eligible_pairs(self, pairs):
+        """The (node_a, node_b) pairs that term_to_term might find support for"""
+        applicable = {}
+        eligible = []
+        for node_a, node_b in pairs:
+            for node in (node_a, node_b):
+                if id(node) not in applicable:
+                    applicable[id(node)] = self.applicable(node)
+            if applicable[id(node_a)] and applicable[id(node_b)]:
+                eligible.append((node_a, node_b))
+        return eligible
+
+    def term_to_terms(self, pairs):
+        """Support for each (node_a, node_b) pair: a list, in the same order, of a KEdge, None (no support)
+        or a SupportFailure for a pair that couldn't be answered.  Supporters with a bulk lookup override
+        this; by default it is one term_to_term per pair."""
+        return term_to_terms(self, pairs)
+
+    def term_to_term(self, node_a, node_b):
+        """The support edge between two nodes, or None"""
+        raise NotImplementedError
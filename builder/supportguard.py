@@ -0,0 +1,90 @@
+import logging
+from collections import Counter
+
+class SupporterGuard:
+    """Wraps a supporter so that an exception from one pair does not stop the support stage.
+    Failures are counted by exception type, with the first max_examples kept by key, and once the
+    error rate of the supporter's calls (errors / calls, both counting only pairs the supporter was
+    asked about) passes max_error_rate (after at least min_calls calls) the supporter is switched
+    off for the rest of the run.  Failures with results that came from a store or cache are counted
+    apart, as other_errors, since they say nothing about the supporter's service."""
+
+    def __init__(self, supporter, max_error_rate=0.2, min_calls=50, max_examples=20):
+        self.logger = logging.getLogger('application')
+        self.supporter = supporter
+        self.name = supporter.__class__.__name__
+        self.max_error_rate = max_error_rate
+        self.min_calls = min_calls
+        self.max_examples = max_examples
+        self.calls = 0
+        self.errors = 0
+        self.other_errors = 0
+        self.error_types = Counter()
+        # (key, exception type name) for the first pairs that raised
+        self.failures = []
+        # The number of pairs that were not tried because the supporter had been disabled, and the first few keys
+        self.skipped = 0
+        self.skipped_examples = []
+        self.disabled = False
+
+    def prepare(self, nodes):
+        """A supporter that cannot prepare cannot be trusted with any pair, so disable it."""
+        try:
+            self.supporter.prepare(nodes)
+        except Exception as e:
+            self.error_types[type(e).__name__] += 1
+            self.failures.append(('prepare', type(e).__name__))
+            self.disabled = True
+            self.logger.exception('{} failed in prepare. Disabling it.'.format(self.name))
+
+    def record_failure(self, key, exception, call=True):
+        """Record that the pair with key failed: in a call to the supporter, or (not call) with a stored
+        or cached result"""
+        if call:
+            self.errors += 1
+        else:
+            self.other_errors += 1
+        self.error_types[type(exception).__name__] += 1
+        if len(self.failures) < self.max_examples:
+            self.failures.append((key, type(exception).__name__))
+        # The totals go to log_summary; a line per pair would swamp the log of a supporter that is down
+        self.logger.debug('%s failed on %s: %s: %s', self.name, key, type(exception).__name__, exception)
+        if call and self.calls >= self.min_calls and self.errors > self.max_error_rate * self.calls:
+            self.disabled = True
+            self.logger.error('{} failed {} of {} calls. Disabling it for the rest of the run.'.
+                              format(self.name, self.errors, self.calls))
+
+    def skip(self, key, n=1):
+        """Record that n pairs, the first with key, were not tried"""
+        self.skipped += n
+        if len(self.skipped_examples) < self.max_examples:
+            self.skipped_examples.append(key)
+
+    def summary(self):
+        return {'supporter': self.name,
+                'calls': self.calls,
+                'errors': self.errors,
+                'other_errors': self.other_errors,
+                'error_types': dict(self.error_types),
+                'disabled': self.disabled,
+                'failed_pairs': self.errors + self.other_errors,
+                'failed_examples': self.failures,
+                'skipped_pairs': self.skipped,
+                'skipped_examples': self.skipped_examples}
+
+    def log_summary(self, max_listed=20):
+        n_failed = self.errors + self.other_errors
+        if n_failed == 0 and not self.disabled:
+            return
+        self.logger.warning('{}: {} errors in {} calls{} ({}){}'.format(
+            self.name, self.errors, self.calls,
+            ', {} more with stored or cached results'.format(self.other_errors) if self.other_errors else '',
+            ', '.join('{} x{}'.format(k, v) for k, v in self.error_types.most_common()),
+            '; disabled' if self.disabled else ''))
+        for key, error_type in self.failures[:max_listed]:
+            self.logger.warning('  failed: {} ({})'.format(key, error_type))
+        if n_failed > min(len(self.failures), max_listed):
+            self.logger.warning('  ... and {} more failed pairs'.format(n_failed - min(len(self.failures), max_listed)))
+        if self.skipped > 0:
+            self.logger.warning('  {} pairs skipped after disabling, e.g. {}'.format(self.skipped,
+                                                                                     self.skipped_examples[0]))
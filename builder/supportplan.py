@@ -0,0 +1,108 @@
+"""Ordering and budgeting of the support stage.  Support asks about every pair of nodes, which on a big
+graph can take longer than anyone is willing to wait.  With a SupportBudget, the pairs are ordered so
+that the ones most likely to matter come first, and support stops once the budget is spent, leaving
+the rest unevaluated rather than running until it finishes or crashes."""
+import time
+from collections import deque
+from itertools import chain
+
+class SupportBudget:
+    """A limit on the support stage, in wall-clock seconds and/or calls to supporters (lookups answered
+    by the support store or the cache are free).  Each supporter gets an even share of what is left
+    when it starts, so that one supporter can't use up the budget of the ones after it.  The budget is
+    checked between chunks, so with a time limit the chunks are kept small enough to stop on time: the
+    first of each share is one pair, and each after that no more than the pairs checked so far in the
+    share would take, at the rate they took, to use half the time left.  A supporter overruns its share
+    by about the time of one lookup."""
+
+    def __init__(self, seconds=None, calls=None):
+        self.seconds = seconds
+        self.calls = calls
+        self.started = None
+        self.calls_made = 0
+        self.deadline = None
+        self.call_limit = None
+        # When the current share started, and the pairs checked in it
+        self.share_started = None
+        self.share_pairs = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def share(self, n_supporters):
+        """Start the share of the next supporter, with n_supporters (counting it) still to go"""
+        now = time.perf_counter()
+        self.share_started = now
+        self.share_pairs = 0
+        if self.seconds is not None:
+            self.deadline = now + max(0, self.started + self.seconds - now) / n_supporters
+        if self.calls is not None:
+            self.call_limit = self.calls_made + max(0, self.calls - self.calls_made) // n_supporters
+
+    def charge(self, calls):
+        self.calls_made += calls
+
+    def checked(self, pairs):
+        """pairs more were checked, by lookups or otherwise"""
+        self.share_pairs += pairs
+
+    def chunk_size(self, chunk_size):
+        """The next chunk's size: no more pairs than there are calls left, or than would take half the time
+        left at the rate so far"""
+        if self.deadline is not None:
+            now = time.perf_counter()
+            if self.share_pairs == 0:
+                chunk_size = 1
+            else:
+                rate = self.share_pairs / max(now - self.share_started, 1e-6)
+                chunk_size = min(chunk_size, int(rate * (self.deadline - now) / 2))
+        if self.call_limit is not None:
+            chunk_size = min(chunk_size, self.call_limit - self.calls_made)
+        return max(1, chunk_size)
+
+    def exhausted(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return True
+        return self.call_limit is not None and self.calls_made >= self.call_limit
+
+
+def endpoint_distances(graph, endpoints):
+    """Hops from each node to the nearest of endpoints, ignoring edge direction"""
+    distances = {node: 0 for node in endpoints}
+    frontier = deque(distances)
+    while frontier:
+        node = frontier.popleft()
+        distance = distances[node] + 1
+        for other in chain(graph.successors(node), graph.predecessors(node)):
+            if other not in distances:
+                distances[other] = distance
+                frontier.append(other)
+    return distances
+
+
+def prioritize(links, node_map, graph, endpoints=(), path_links=(), known_identifiers=frozenset()):
+    """links (pairs of interned ids) sorted most valuable first.  Pairs are ranked by, in turn:
+        whether both nodes are on one query path (path_links, in either order)
+        the farther of the two nodes' distances from the query's endpoints
+        whether both nodes are known to the support store, so the pair is likely a free lookup
+        the sum of the nodes' degrees
+    Ties keep their order."""
+    on_path = set((min(a, b), max(a, b)) for a, b in path_links)
+    distances = endpoint_distances(graph, [node for node in endpoints if graph.has_node(node)])
+    unreachable = len(node_map) + 1
+    features = {}
+    for a, b in links:
+        for iid in (a, b):
+            if iid not in features:
+                node = node_map[iid]
+                features[iid] = (distances.get(node, unreachable), node.identifier in known_identifiers,
+                                 graph.degree(node))
+
+    def priority(link):
+        a, b = link
+        distance_a, known_a, degree_a = features[a]
+        distance_b, known_b, degree_b = features[b]
+        return ((min(a, b), max(a, b)) not in on_path, max(distance_a, distance_b),
+                not (known_a and known_b), -(degree_a + degree_b))
+
+    return sorted(links, key=priority)
@@ -0,0 +1,161 @@
+import argparse
+import logging
+import pickle
+import sqlite3
+import time
+
+# What get_many returns for a pair that has no stored result.  (A stored None is a real answer:
+# the supporter was asked and found nothing.)
+MISSING = object()
+
+# Pairs per statement in get_many; each pair is two parameters and SQLite allows 999
+CHUNK = 400
+
+# Seconds to wait for another process (e.g. a batch worker) to finish writing before giving up
+BUSY_TIMEOUT = 30
+
+class SupportResultStore:
+    """A local SQLite store of support results, keyed by (supporter, generation, source, target).
+
+    Each supporter has a current generation.  Reads and writes only see the current generation,
+    so bumping it invalidates everything stored for that supporter in one update; compact()
+    deletes the rows of old generations.  If a supporter declares a data_version and it differs
+    from the one recorded for the supporter, the generation is bumped automatically.  Generations
+    are read from the database every time rather than remembered, since other processes sharing the
+    store may bump them.
+
+    Results are pickled without their source and target nodes, which the caller already has."""
+
+    def __init__(self, path):
+        self.logger = logging.getLogger('application')
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS generations
+                           (supporter TEXT PRIMARY KEY, generation INTEGER NOT NULL, data_version TEXT)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS results
+                           (supporter TEXT NOT NULL, generation INTEGER NOT NULL, source TEXT NOT NULL,
+                            target TEXT NOT NULL, ctime REAL NOT NULL, result BLOB,
+                            PRIMARY KEY (supporter, generation, source, target)) WITHOUT ROWID''')
+        self.db.commit()
+
+    def generations(self):
+        """supporter -> (current generation, data_version), as the database has them now"""
+        return {supporter: (generation, data_version)
+                for supporter, generation, data_version in self.db.execute('SELECT * FROM generations')}
+
+    def read_generation(self, supporter):
+        return self.db.execute('SELECT generation, data_version FROM generations WHERE supporter=?',
+                               (supporter,)).fetchone()
+
+    def generation(self, supporter, data_version=None):
+        """The current generation for supporter, registering it (or bumping it, if data_version changed)"""
+        row = self.read_generation(supporter)
+        if row is not None and (data_version is None or data_version == row[1]):
+            return row[0]
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO generations VALUES (?,0,?)', (supporter, data_version))
+            generation, stored_version = self.read_generation(supporter)
+            if data_version is not None and data_version != stored_version:
+                self.logger.info('%s data version changed (%s -> %s); invalidating stored results',
+                                 supporter, stored_version, data_version)
+                self.db.execute('UPDATE generations SET generation=generation+1, data_version=? WHERE supporter=?',
+                                (data_version, supporter))
+                generation += 1
+        return generation
+
+    def bump(self, supporter):
+        """Invalidate every stored result for supporter"""
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO generations VALUES (?,-1,NULL)', (supporter,))
+            self.db.execute('UPDATE generations SET generation=generation+1 WHERE supporter=?', (supporter,))
+            return self.read_generation(supporter)[0]
+
+    def get_many(self, supporter, pairs):
+        """Map each (source, target) identifier pair to its stored result, or MISSING"""
+        generation = self.generation(supporter)
+        found = {}
+        for start in range(0, len(pairs), CHUNK):
+            chunk = pairs[start:start + CHUNK]
+            placeholders = ','.join(['(?,?)'] * len(chunk))
+            parameters = [supporter, generation]
+            for source, target in chunk:
+                parameters.append(source)
+                parameters.append(target)
+            rows = self.db.execute('SELECT source, target, result FROM results WHERE supporter=? AND generation=? '
+                                   'AND (source, target) IN (VALUES %s)' % placeholders, parameters)
+            for source, target, result in rows:
+                found[(source, target)] = None if result is None else pickle.loads(result)
+        return {pair: found.get(pair, MISSING) for pair in pairs}
+
+    def put_many(self, supporter, results):
+        """Store an iterable of ((source, target), result), result being a KEdge or None"""
+        generation = self.generation(supporter)
+        now = time.time()
+        rows = [(supporter, generation, source, target, now, self.dumps(result))
+                for (source, target), result in results]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?)', rows)
+
+    @staticmethod
+    def dumps(edge):
+        if edge is None:
+            return None
+        source_node, target_node = edge.source_node, edge.target_node
+        edge.source_node = edge.target_node = None
+        try:
+            return pickle.dumps(edge, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            edge.source_node, edge.target_node = source_node, target_node
+
+    def compact(self):
+        """Delete rows from old generations and give the space back"""
+        with self.db:
+            n_deleted = 0
+            for supporter, (generation, _) in self.generations().items():
+                n_deleted += self.db.execute('DELETE FROM results WHERE supporter=? AND generation<?',
+                                             (supporter, generation)).rowcount
+        self.db.execute('VACUUM')
+        self.logger.info('Compacted %s: removed %d stale results', self.path, n_deleted)
+        return n_deleted
+
+    def counts(self):
+        """Number of current results per supporter"""
+        return {supporter: self.db.execute('SELECT COUNT(*) FROM results WHERE supporter=? AND generation=?',
+                                           (supporter, generation)).fetchone()[0]
+                for supporter, (generation, _) in self.generations().items()}
+
+    def identifiers(self):
+        """Every identifier in a current result of any supporter: nodes whose pairs are likely stored"""
+        found = set()
+        for supporter, (generation, _) in self.generations().items():
+            for column in ('source', 'target'):
+                rows = self.db.execute('SELECT DISTINCT %s FROM results WHERE supporter=? AND generation=?' % column,
+                                       (supporter, generation))
+                found.update(row[0] for row in rows)
+        return found
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain a local support result store')
+    parser.add_argument('store', help='Path to the store')
+    parser.add_argument('--bump', action='append', default=[],
+                        help='Invalidate all results for this supporter class (e.g. OmnicorpSupport)')
+    parser.add_argument('--compact', action='store_true', help='Delete invalidated results')
+    args = parser.parse_args()
+    store = SupportResultStore(args.store)
+    for supporter in args.bump:
+        print('{} is now at generation {}'.format(supporter, store.bump(supporter)))
+    if args.compact:
+        print('Removed {} stale results'.format(store.compact()))
+    for supporter, count in sorted(store.counts().items()):
+        print('{}: {} results'.format(supporter, count))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import logging
+import os
+import numpy as np
+from idtable import IdentifierTable
+
+# Numeric statistics that supporters attach to their edges (CDW: counts, expected counts and p value,
+# chemotext2: similarity).  Missing or non-numeric values (e.g. CDW's '<11') are stored as NaN.
+STAT_COLUMNS = ('c1', 'c2', 'c', 'e', 'p', 'similarity')
+
+class GrowableColumn:
+    """A numpy array that doubles its capacity as it is appended to"""
+
+    def __init__(self, dtype, capacity=1024, fill=0):
+        self.data = np.full(capacity, fill, dtype=dtype)
+        self.fill = fill
+        self.n = 0
+
+    def reserve(self, extra):
+        needed = self.n + extra
+        if needed > len(self.data):
+            capacity = max(needed, 2 * len(self.data))
+            grown = np.full(capacity, self.fill, dtype=self.data.dtype)
+            grown[:self.n] = self.data[:self.n]
+            self.data = grown
+
+    def append(self, value):
+        self.reserve(1)
+        self.data[self.n] = value
+        self.n += 1
+
+    def extend(self, values):
+        self.reserve(len(values))
+        self.data[self.n:self.n + len(values)] = values
+        self.n += len(values)
+
+    def values(self):
+        return self.data[:self.n]
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _pmid(publication):
+    """'PMID:12345' (or a bare number) -> 12345, anything else -> None"""
+    if isinstance(publication, str):
+        publication = publication.rsplit(':', 1)[-1].rsplit('/', 1)[-1]
+    try:
+        return int(publication)
+    except (TypeError, ValueError):
+        return None
+
+
+class SupportTable:
+    """Support results held column-wise rather than as one KEdge per pair.
+
+    Identifiers (through an IdentifierTable, normally the KnowledgeGraph's) and supporter names are
+    interned to integer ids.  Each row is one supported pair:
+    source and target ids, the supporter, its PMIDs (as integers, stored CSR-style in one flat array
+    with per-row offsets) and the numeric statistics in STAT_COLUMNS.  Ranking features are computed
+    over whole columns at once in features()."""
+
+    def __init__(self, capacity=1024, ids=None):
+        self.logger = logging.getLogger('application')
+        self.ids = ids if ids is not None else IdentifierTable()
+        self.supporter_names = []
+        self.supporter_ids = {}
+        self.source = GrowableColumn(np.int32, capacity)
+        self.target = GrowableColumn(np.int32, capacity)
+        self.supporter = GrowableColumn(np.int16, capacity)
+        self.pmid_offsets = GrowableColumn(np.int64, capacity + 1)
+        self.pmid_offsets.append(0)
+        self.pmids = GrowableColumn(np.int64, 4 * capacity)
+        self.stats = {name: GrowableColumn(np.float64, capacity, fill=np.nan) for name in STAT_COLUMNS}
+
+    def __len__(self):
+        return self.source.n
+
+    @property
+    def strings(self):
+        return self.ids.strings
+
+    def supporter_id(self, name):
+        sid = self.supporter_ids.get(name)
+        if sid is None:
+            sid = self.supporter_ids[name] = len(self.supporter_names)
+            self.supporter_names.append(name)
+        return sid
+
+    def add(self, supporter_name, source_identifier, target_identifier, edge):
+        """Record the support edge that supporter_name found between the two identifiers"""
+        self.add_ids(supporter_name, self.ids.intern(source_identifier), self.ids.intern(target_identifier), edge)
+
+    def add_ids(self, supporter_name, source_id, target_id, edge):
+        """As add, for identifiers already interned in the table's IdentifierTable"""
+        self.source.append(source_id)
+        self.target.append(target_id)
+        self.supporter.append(self.supporter_id(supporter_name))
+        publications = getattr(edge, 'publications', None) or []
+        pmids = [p for p in (_pmid(x) for x in publications) if p is not None]
+        self.pmids.extend(pmids)
+        self.pmid_offsets.append(self.pmids.n)
+        properties = getattr(edge, 'properties', None) or {}
+        for name in STAT_COLUMNS:
+            self.stats[name].append(_number(properties.get(name)))
+
+    def publication_counts(self):
+        return np.diff(self.pmid_offsets.values())
+
+    def node_publication_counts(self):
+        """For each (supporter, identifier), the number of distinct PMIDs across all of its rows"""
+        counts = self.publication_counts()
+        pmids = self.pmids.values()
+        n_strings = max(len(self.strings), 1)
+        if len(pmids) == 0:
+            return np.zeros(len(self.supporter_names) * n_strings, dtype=np.int64)
+        row_of_pmid = np.repeat(np.arange(len(counts)), counts)
+        supporter = self.supporter.values().astype(np.int64)[row_of_pmid]
+        nodes = np.concatenate([supporter * n_strings + self.source.values()[row_of_pmid],
+                                supporter * n_strings + self.target.values()[row_of_pmid]])
+        both_pmids = np.concatenate([pmids, pmids])
+        stride = int(both_pmids.max()) + 1
+        unique_keys = np.unique(nodes * stride + both_pmids)
+        return np.bincount(unique_keys // stride, minlength=len(self.supporter_names) * n_strings)
+
+    def features(self):
+        """Per-row ranking features:
+            publication_count: PMIDs supporting the pair
+            shared_pmid_jaccard: shared PMIDs over the union of the PMIDs seen for either node (same supporter)
+            cdw_observed_expected: CDW shared count over expected count (NaN where the count is censored)"""
+        counts = self.publication_counts()
+        node_counts = self.node_publication_counts()
+        n_strings = max(len(self.strings), 1)
+        supporter = self.supporter.values().astype(np.int64)
+        union = node_counts[supporter * n_strings + self.source.values()] + \
+                node_counts[supporter * n_strings + self.target.values()] - counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jaccard = np.where(union > 0, counts / np.maximum(union, 1), 0.0)
+            observed_expected = self.stats['c'].values() / self.stats['e'].values()
+        return {'publication_count': counts,
+                'shared_pmid_jaccard': jaccard,
+                'cdw_observed_expected': observed_expected}
+
+    def columns(self):
+        """The table as flat columns, identifiers decoded, ready for a dataframe or arrow table"""
+        strings = np.array(self.strings, dtype=object)
+        names = np.array(self.supporter_names, dtype=object)
+        columns = {'source': strings[self.source.values()] if len(self) else np.array([], dtype=object),
+                   'target': strings[self.target.values()] if len(self) else np.array([], dtype=object),
+                   'supporter': names[self.supporter.values()] if len(self) else np.array([], dtype=object)}
+        for name in STAT_COLUMNS:
+            columns[name] = self.stats[name].values()
+        columns.update(self.features())
+        return columns
+
+    def write(self, path):
+        """Write to path.  .parquet and .arrow (feather) need pyarrow; anything else, or a missing pyarrow,
+        gets a compressed .npz with the PMIDs kept in their CSR form."""
+        extension = os.path.splitext(path)[1]
+        if extension in ('.parquet', '.arrow'):
+            try:
+                import pyarrow as pa
+            except ImportError:
+                self.logger.warning('pyarrow is not installed; writing %s as .npz instead', path)
+                return self.write_npz(os.path.splitext(path)[0] + '.npz')
+            columns = self.columns()
+            counts = self.publication_counts()
+            offsets = self.pmid_offsets.values()
+            pmids = self.pmids.values()
+            columns['pmids'] = [pmids[offsets[i]:offsets[i] + counts[i]] for i in range(len(self))]
+            table = pa.table(columns)
+            if extension == '.parquet':
+                import pyarrow.parquet as pq
+                pq.write_table(table, path)
+            else:
+                import pyarrow.feather as feather
+                feather.write_feather(table, path)
+            return path
+        return self.write_npz(path)
+
+    def write_npz(self, path):
+        np.savez_compressed(path,
+                            strings=np.array(self.strings, dtype=str),
+                            supporter_names=np.array(self.supporter_names, dtype=str),
+                            source=self.source.values(),
+                            target=self.target.values(),
+                            supporter=self.supporter.values(),
+                            pmid_offsets=self.pmid_offsets.values(),
+                            pmids=self.pmids.values(),
+                            **{name: self.stats[name].values() for name in STAT_COLUMNS},
+                            **self.features())
+        return path if path.endswith('.npz') else path + '.npz'
@@ -0,0 +1,155 @@
+"""Synonymization of the nodes a query's programs find, a program step at a time rather than a node
+at a time.  Programs synonymize each node of each step's results on its own, one cache round trip
+(and, on a miss, one service call) after another, and again every time the same identifier turns up;
+one query logs tens of thousands of synonymize lines.  While programs run, BatchSynonymizer takes the
+place of rosetta.synonymizer: each step's results are synonymized as soon as the step returns, with the
+identifiers deduplicated, their cached synonyms fetched in one multi-get and the misses synonymized
+concurrently.  The program's own per-node calls that follow, and any later call for the same
+identifier in the query, are then answered from memory."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from instrument import NULL_INSTRUMENTATION
+
+# The rosetta.cache key synonyms are kept under
+KEY = 'synonymize({})'
+
+class PrefetchCache:
+    """Wraps rosetta.cache with values fetched ahead of the gets that will ask for them.  Each
+    prefetched value is handed out once and then forgotten, so they don't pile up."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.prefetched = {}
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+    def prefetch(self, keys):
+        """Fetch keys in one round trip if the cache has a multi-get, otherwise one at a time.
+        Returns the set of those that were there."""
+        mget = getattr(self.cache, 'mget', None)
+        values = mget(keys) if mget is not None else [self.cache.get(key) for key in keys]
+        found = {key: value for key, value in zip(keys, values) if value is not None}
+        with self.lock:
+            self.prefetched.update(found)
+        return set(found)
+
+    def forget(self, keys):
+        """Drop whatever of keys was prefetched but never asked for"""
+        with self.lock:
+            for key in keys:
+                self.prefetched.pop(key, None)
+
+    def get(self, key):
+        with self.lock:
+            value = self.prefetched.pop(key, None)
+        if value is not None:
+            return value
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+
+class BatchSynonymizer:
+    """Stands in for rosetta.synonymizer (and wraps rosetta.get_ops) while programs run.  Results are
+    remembered per (identifier, node type) for the rest of the query: the identifier the node ended up
+    with, since synonymization can normalize it, and its synonyms.  Counts synonymize_nodes (nodes
+    synonymized, individually or in a batch), synonymize_round_trips (those that went to the wrapped
+    synonymizer), synonymize_prefetched (of those, the ones whose synonyms came in a multi-get) and
+    synonymize_batches.  With a limiter (a ratelimit.AdaptiveLimiter), the cache misses of a batch,
+    which are the calls that go to the services, are made within its limit."""
+
+    def __init__(self, synonymizer, cache, instrumentation=None, workers=8, limiter=None):
+        self.synonymizer = synonymizer
+        self.limiter = limiter
+        self.cache = cache
+        self.metrics = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.known = {}
+
+    def __getattr__(self, name):
+        return getattr(self.synonymizer, name)
+
+    def synonymize(self, node):
+        """Synonymize one node, as Programs do"""
+        self.metrics.count('synonymize_nodes')
+        if not self.recall(node):
+            self.look_up(node)
+
+    def recall(self, node):
+        with self.lock:
+            known = self.known.get((node.identifier, node.node_type))
+        if known is None:
+            return False
+        node.identifier, synonyms = known
+        node.add_synonyms(synonyms)
+        return True
+
+    def look_up(self, node):
+        key = (node.identifier, node.node_type)
+        self.metrics.count('synonymize_round_trips')
+        self.synonymizer.synonymize(node)
+        with self.lock:
+            self.known[key] = (node.identifier, frozenset(node.synonyms))
+
+    def fetch(self, node):
+        """look_up a node whose synonyms aren't cached"""
+        if self.limiter is None:
+            self.look_up(node)
+        else:
+            self.limiter.call(self.look_up, node)
+
+    def synonymize_all(self, nodes):
+        """Synonymize a step's worth of nodes: each new identifier once, with the cached synonyms of all
+        of them asked for together and the rest synonymized in up to workers threads"""
+        nodes = list(nodes)
+        if not nodes:
+            return
+        self.metrics.count('synonymize_batches')
+        self.metrics.count('synonymize_nodes', len(nodes))
+        pending = {}
+        for node in nodes:
+            if not self.recall(node):
+                pending.setdefault((node.identifier, node.node_type), []).append(node)
+        if not pending:
+            return
+        firsts = [group[0] for group in pending.values()]
+        misses = firsts
+        if hasattr(self.cache, 'prefetch'):
+            keys = [KEY.format(node.identifier) for node in firsts]
+            found = self.cache.prefetch(keys)
+            self.metrics.count('synonymize_prefetched', len(found))
+            # Nodes with cached synonyms are quick to do here; the rest may wait on a service
+            for key, node in zip(keys, firsts):
+                if key in found:
+                    self.look_up(node)
+            misses = [node for key, node in zip(keys, firsts) if key not in found]
+            self.cache.forget(found)
+        if self.workers > 1 and len(misses) > 1:
+            with ThreadPoolExecutor(min(self.workers, len(misses))) as pool:
+                list(pool.map(self.fetch, misses))
+        else:
+            for node in misses:
+                self.fetch(node)
+        for group in pending.values():
+            for node in group[1:]:
+                self.recall(node)
+
+    def batched_op(self, op):
+        """op, synonymizing the nodes of its (edge, node) results as a batch before returning them"""
+        def run(*args, **kwargs):
+            results = op(*args, **kwargs)
+            if isinstance(results, list) and all(isinstance(result, tuple) and len(result) == 2 for result in results):
+                self.synonymize_all(node for _, node in results)
+            return results
+        return run
+
+    def get_ops(self, get_ops):
+        """Wrap rosetta.get_ops so that the ops it hands out are batched"""
+        def get(*args, **kwargs):
+            op = get_ops(*args, **kwargs)
+            return self.batched_op(op) if callable(op) else op
+        return get
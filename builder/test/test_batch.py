@@ -0,0 +1,47 @@
+import logging
+from builder.bench.stubs import StubBackend
+from builder.test.test_service import entry_point
+
+class FlakyBackend(StubBackend):
+    """Fails every query that starts from 'bad'"""
+    def query(self, job):
+        if job['start'] == 'bad':
+            raise RuntimeError('No such start')
+        return super().query(dict(job, nodes=20))
+
+def test_failed_queries_are_retried_after_a_doubling_delay(caplog):
+    batch = entry_point('batch')
+    caplog.set_level(logging.WARNING, logger='application')
+    outcomes = batch.run_batch([('bad', None), ('good', None)], 'SG', ['bench.fakesupport'],
+                               backend_spec='builder.test.test_batch:FlakyBackend', n_workers=1,
+                               max_retries=2, retry_delay=0.1)
+    assert [(outcome['state'], outcome['attempts']) for outcome in outcomes] == [('failed', 3), ('done', 1)]
+    assert 'No such start' in outcomes[0]['error']
+    retries = [record.args for record in caplog.records if 'retrying in' in record.msg]
+    assert [(args[0], args[2], args[3]) for args in retries] == [('bad', 1, 0.1), ('bad', 2, 0.2)]
+
+def test_a_batch_whose_workers_cannot_set_up_ends(monkeypatch):
+    batch = entry_point('batch')
+    monkeypatch.setattr(batch.WorkerPool, 'restart_delay', 0.01)
+    outcomes = batch.run_batch([('a', None), ('b', None), ('c', None)], 'SG', ['bench.fakesupport'],
+                               backend_spec='builder.test.test_service:BrokenBackend', n_workers=2)
+    assert [(outcome['state'], outcome['attempts']) for outcome in outcomes] == [('failed', 0)] * 3
+    assert all('neo4j is down' in outcome['error'] for outcome in outcomes)
+
+def test_concept_plans_are_kept_for_a_bounded_number_of_queries():
+    from builder.userquery import PLAN_CACHE_SIZE, concept_plans
+    class TypeGraph:
+        def __init__(self):
+            self.asked = []
+        def get_transitions(self, cypher):
+            self.asked.append(cypher)
+            return [cypher]
+    type_graph = TypeGraph()
+    concept_plans.cache_clear()
+    assert concept_plans('a', type_graph) == concept_plans('a', type_graph) == ['a']
+    assert type_graph.asked == ['a']
+    for i in range(PLAN_CACHE_SIZE):
+        concept_plans(str(i), type_graph)
+    assert concept_plans.cache_info().currsize == PLAN_CACHE_SIZE
+    concept_plans('a', type_graph)
+    assert type_graph.asked.count('a') == 2
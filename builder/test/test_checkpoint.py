@@ -0,0 +1,69 @@
+import gzip
+import os
+from builder.builder import KnowledgeGraph
+from builder.bench.stubs import StubRosetta, SyntheticQuery
+from builder.checkpoint import Checkpointer
+
+class Budget:
+    """A memory budget with no room for support pairs"""
+    max_bytes = 0
+
+    def used(self):
+        return 0
+
+    def allows(self, extra_bytes):
+        return extra_bytes == 0
+
+def knowledge_graph(checkpointer, **options):
+    return KnowledgeGraph(SyntheticQuery(60, 180), StubRosetta(), checkpointer, **options)
+
+def graph_state(kgraph):
+    nodes = sorted((node.identifier, tuple(sorted(node.synonyms))) for node in kgraph.graph.nodes())
+    edges = sorted((a.identifier, b.identifier, data['object'].edge_source)
+                   for a, b, data in kgraph.graph.edges(data=True))
+    return nodes, edges
+
+def test_resume_after_a_stage(tmpdir):
+    checkpointer = Checkpointer(str(tmpdir), 'query')
+    kgraph = knowledge_graph(checkpointer)
+    kgraph.execute()
+    kgraph.checkpoint('execute')
+    resumed = knowledge_graph(checkpointer)
+    assert resumed.resume() == 'execute'
+    assert graph_state(resumed) == graph_state(kgraph)
+    # node_map still points at the graph's own nodes
+    assert all(resumed.node_map[resumed.node_records[node].iid] is node for node in resumed.graph.nodes())
+
+def test_resume_in_the_middle_of_support_with_spilled_pairs(tmpdir):
+    checkpointer = Checkpointer(str(tmpdir), 'query')
+    kgraph = knowledge_graph(checkpointer, memory_budget=Budget())
+    kgraph.execute()
+    links = kgraph.choose_links()
+    assert links.filename == checkpointer.links_path()
+    kgraph.checkpoint('support', {'links': links, 'supporter': 0, 'position': 10, 'n_supported': 2})
+    # The pairs are referred to, not copied into the pickle
+    with gzip.open(checkpointer.path(), 'rb') as inf:
+        assert b'SpilledLinks' in inf.read()
+    resumed = knowledge_graph(checkpointer)
+    assert resumed.resume() == 'enhance'
+    state = resumed.support_state
+    assert (state['supporter'], state['position'], state['n_supported']) == (0, 10, 2)
+    assert state['links'].tolist() == links.tolist()
+    assert graph_state(resumed) == graph_state(kgraph)
+    # Without its pairs, the checkpoint can't be resumed from
+    os.remove(checkpointer.links_path())
+    assert knowledge_graph(checkpointer).resume() is None
+
+def test_a_partial_or_corrupt_checkpoint_is_ignored(tmpdir):
+    checkpointer = Checkpointer(str(tmpdir), 'query')
+    kgraph = knowledge_graph(checkpointer)
+    kgraph.execute()
+    kgraph.checkpoint('execute')
+    with open(checkpointer.path(), 'rb') as inf:
+        data = inf.read()
+    with open(checkpointer.path(), 'wb') as outf:
+        outf.write(data[:len(data) // 2])
+    assert knowledge_graph(checkpointer).resume() is None
+    with open(checkpointer.path(), 'wb') as outf:
+        outf.write(b'not a checkpoint')
+    assert knowledge_graph(checkpointer).resume() is None
@@ -0,0 +1,69 @@
+import pytest
+from builder.dbaccess import Database
+from builder.instrument import Instrumentation
+
+class Transaction:
+    def __init__(self, session):
+        self.session = session
+
+    def commit(self):
+        self.session.commits += 1
+
+    def rollback(self):
+        self.session.rollbacks += 1
+
+class Session:
+    """Raises error from the first failures units of work run in it"""
+    def __init__(self, failures, error):
+        self.failures = failures
+        self.error = error
+        self.commits = 0
+        self.rollbacks = 0
+
+    def begin_transaction(self):
+        return Transaction(self)
+
+    def run(self, query):
+        if self.failures > 0:
+            self.failures -= 1
+            raise self.error
+        return query
+
+    def close(self):
+        pass
+
+class Driver:
+    def __init__(self, session):
+        self.session = lambda: session
+
+def database(monkeypatch, failures, error=ConnectionError('connection reset'), **options):
+    session = Session(failures, error)
+    sleeps = []
+    monkeypatch.setattr('builder.dbaccess.time.sleep', sleeps.append)
+    metrics = Instrumentation()
+    return Database(Driver(session), instrumentation=metrics, **options), session, sleeps, metrics
+
+def counter(metrics, name):
+    return sum(item['value'] for item in metrics.report()['counters'].get(name, []))
+
+def test_transient_errors_are_retried_with_backoff(monkeypatch):
+    db, session, sleeps, metrics = database(monkeypatch, 2, retry_delay=0.5)
+    assert db.write(lambda tx, query: tx.session.run(query), 'CREATE (n)') == 'CREATE (n)'
+    assert sleeps == [0.5, 1.0]
+    assert (session.rollbacks, session.commits) == (2, 1)
+    assert counter(metrics, 'db_retries') == 2 and counter(metrics, 'db_transaction_errors') == 0
+
+def test_retries_stop_after_max_retries(monkeypatch):
+    db, session, sleeps, metrics = database(monkeypatch, 10, max_retries=3, retry_delay=1)
+    with pytest.raises(ConnectionError):
+        db.read(lambda tx: tx.session.run('MATCH (n) RETURN n'))
+    assert sleeps == [1, 2, 4]
+    assert session.commits == 0 and session.rollbacks == 4
+    assert counter(metrics, 'db_retries') == 3 and counter(metrics, 'db_transaction_errors') == 1
+
+def test_other_errors_are_not_retried(monkeypatch):
+    db, session, sleeps, metrics = database(monkeypatch, 1, error=ValueError('bad query'))
+    with pytest.raises(ValueError):
+        db.read(lambda tx: tx.session.run('MATCH'))
+    assert sleeps == [] and session.rollbacks == 1
+    assert counter(metrics, 'db_transaction_errors') == 1
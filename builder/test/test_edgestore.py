@@ -0,0 +1,94 @@
+from builder.edgestore import EdgeResultStore, StoreBackedCache, MISSING, step_key
+
+class FakeEdge:
+    def __init__(self, edge_source):
+        self.edge_source = edge_source
+
+class Cache:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.gets = []
+
+    def get(self, key):
+        self.gets.append(key)
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+def test_round_trip_with_provenance(tmpdir):
+    store = EdgeResultStore(str(tmpdir.join('edges.db')))
+    results = [(FakeEdge('chembio.graph_pubchem_to_ncbigene'), 'NCBIGene:1'),
+               (FakeEdge('ctd.drug_to_gene'), 'NCBIGene:2')]
+    store.put('chembio~graph_pubchem_to_ncbigene', 'PUBCHEM:2244', results, query='aspirin')
+    found = store.get('chembio~graph_pubchem_to_ncbigene', 'PUBCHEM:2244')
+    assert [node for _, node in found] == ['NCBIGene:1', 'NCBIGene:2']
+    _, n_results, sources, query = store.provenance('chembio~graph_pubchem_to_ncbigene', 'PUBCHEM:2244')
+    assert (n_results, sources, query) == (2, ['chembio.graph_pubchem_to_ncbigene', 'ctd.drug_to_gene'], 'aspirin')
+    assert store.get('chembio~graph_pubchem_to_ncbigene', 'PUBCHEM:1') is MISSING
+    assert store.provenance('chembio~graph_pubchem_to_ncbigene', 'PUBCHEM:1') is None
+    store.close()
+
+def test_expired_steps_are_missing_and_purged(tmpdir):
+    path = str(tmpdir.join('edges.db'))
+    store = EdgeResultStore(path)
+    store.put('ctd~drug_to_gene', 'MESH:1', [])
+    store.put('ctd~drug_to_gene', 'MESH:2', [])
+    store.db.execute('UPDATE steps SET ctime=ctime-100 WHERE input=?', ('MESH:1',))
+    store.db.commit()
+    store.close()
+    store = EdgeResultStore(path, ttl=50)
+    assert store.get('ctd~drug_to_gene', 'MESH:1') is MISSING
+    assert store.get('ctd~drug_to_gene', 'MESH:2') == []
+    assert store.counts() == {'ctd~drug_to_gene': 1}
+    assert store.purge() == 1
+    store.close()
+
+def test_only_step_keys_are_stored(tmpdir):
+    assert step_key('ctd~drug_to_gene(MESH:1)') == ('ctd~drug_to_gene', 'MESH:1')
+    assert step_key('synonymize(MESH:1)') is None
+    assert step_key('not a step') is None
+    store = EdgeResultStore(str(tmpdir.join('edges.db')))
+    rosetta_cache = Cache({'ctd~drug_to_gene(MESH:1)': ['cached'], 'synonymize(MESH:1)': ['MESH:1', 'CHEBI:1']})
+    cache = StoreBackedCache(rosetta_cache, store)
+    # A Rosetta cache hit is copied into the store, and served from there next time
+    assert cache.get('ctd~drug_to_gene(MESH:1)') == ['cached']
+    del rosetta_cache.data['ctd~drug_to_gene(MESH:1)']
+    assert cache.get('ctd~drug_to_gene(MESH:1)') == ['cached']
+    cache.set('ctd~drug_to_gene(MESH:2)', ['fetched'])
+    assert store.get('ctd~drug_to_gene', 'MESH:2') == ['fetched']
+    assert cache.get('synonymize(MESH:1)') == ['MESH:1', 'CHEBI:1']
+    cache.set('synonymize(MESH:2)', ['MESH:2'])
+    assert rosetta_cache.data['synonymize(MESH:2)'] == ['MESH:2']
+    assert store.counts() == {'ctd~drug_to_gene': 2}
+    store.close()
+
+def test_a_corrupt_row_falls_back_to_the_cache(tmpdir):
+    from builder.instrument import Instrumentation
+    path = str(tmpdir.join('edges.db'))
+    store = EdgeResultStore(path)
+    assert store.db.execute('PRAGMA busy_timeout').fetchone()[0] == 30000
+    store.put('ctd~drug_to_gene', 'MESH:1', ['stored'])
+    store.db.execute('UPDATE steps SET results=? WHERE input=?', (b'not a pickle', 'MESH:1'))
+    store.db.commit()
+    metrics = Instrumentation()
+    cache = StoreBackedCache(Cache({'ctd~drug_to_gene(MESH:1)': ['cached']}), store, instrumentation=metrics)
+    assert cache.get('ctd~drug_to_gene(MESH:1)') == ['cached']
+    # and the good value replaces the corrupt one
+    assert store.get('ctd~drug_to_gene', 'MESH:1') == ['cached']
+    errors = metrics.report()['counters']['edge_store_errors']
+    assert [item['value'] for item in errors] == [1]
+    store.close()
+
+def test_a_locked_store_falls_back_to_the_cache():
+    import sqlite3
+    class LockedStore:
+        """Held by another process past the busy timeout"""
+        def get(self, operation, identifier):
+            raise sqlite3.OperationalError('database is locked')
+        def put(self, operation, identifier, results, query=None):
+            raise sqlite3.OperationalError('database is locked')
+    cache = StoreBackedCache(Cache({'ctd~drug_to_gene(MESH:1)': ['cached']}), LockedStore())
+    assert cache.get('ctd~drug_to_gene(MESH:1)') == ['cached']
+    cache.set('ctd~drug_to_gene(MESH:2)', ['fetched'])
+    assert cache.cache.data['ctd~drug_to_gene(MESH:2)'] == ['fetched']
@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+import pytest
+from builder.exporter import BackgroundExporter, ExportError, export_snapshot
+
+class Node:
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.node_type = 'gene'
+        self.label = identifier
+        self.synonyms = set([identifier])
+
+class Database:
+    """Runs each unit of work straight away, keeping what it wrote only if all of it succeeded"""
+    max_sessions = 4
+
+    def __init__(self, no_sessions=False):
+        self.no_sessions = no_sessions
+        self.written = []
+
+    @contextmanager
+    def session(self):
+        if self.no_sessions:
+            raise ConnectionError('no database')
+        yield object()
+
+    def write(self, work, *args, session=None):
+        tx = []
+        work(tx, *args)
+        self.written.extend(tx)
+
+def write_node(node, tx):
+    if node.identifier == 'B':
+        raise ValueError('bad node')
+    tx.append(('node', node.identifier, node.synonyms))
+
+def write_edge(edge, tx):
+    tx.append(('edge', edge[0].identifier, edge[1].identifier))
+
+def test_a_bad_node_does_not_lose_the_rest_of_its_batch():
+    database = Database()
+    exporter = BackgroundExporter(database, write_node, write_edge, n_writers=2, batch_size=10)
+    for identifier in 'ABCD':
+        exporter.put_node(export_snapshot(Node(identifier)))
+    exporter.nodes_complete()
+    exporter.put_edge((Node('A'), Node('C'), {}))
+    with pytest.raises(ExportError):
+        exporter.close()
+    assert sorted(item[1] for item in database.written if item[0] == 'node') == ['A', 'C', 'D']
+    assert [item for item in database.written if item[0] == 'edge'] == [('edge', 'A', 'C')]
+    assert [(kind, item) for kind, item, _ in exporter.errors] == [('node', 'B')]
+
+def test_queued_nodes_are_written_as_they_were_when_queued():
+    database = Database()
+    exporter = BackgroundExporter(database, write_node, write_edge, n_writers=1)
+    node = Node('A')
+    exporter.put_node(export_snapshot(node))
+    # e.g. a supporter's prepare, on the main thread, while the writers run
+    node.synonyms.add('ALIAS:1')
+    exporter.close()
+    assert database.written == [('node', 'A', ('A',))]
+
+def test_writers_that_cannot_get_a_session_do_not_hang_the_export():
+    exporter = BackgroundExporter(Database(no_sessions=True), write_node, write_edge, n_writers=2)
+    exporter.put_node(export_snapshot(Node('A')))
+    exporter.nodes_complete()
+    exporter.put_edge((Node('A'), Node('C'), {}))
+    with pytest.raises(ExportError):
+        exporter.close()
@@ -1,5 +1,6 @@
 import pytest
 from builder.builder import export_node
+from builder.dbaccess import Database
 from greent.graph_components import KNode
 from greent.conftest import rosetta,conf
 from greent import node_types
@@ -7,12 +8,14 @@ from greent import node_types
 TEST_ID = "FAKEY:MCFAKERSON"
 ORIGINAL_SYNONYMS = set(["ORIGINAL_SYN", "ORIGINAL_SYN_2"])
 
+@pytest.fixture(scope='module')
+def database(rosetta):
+    return Database(rosetta.type_graph.driver, max_sessions=1)
+
 @pytest.fixture(scope='function')
-def session(rosetta):
-    driver = rosetta.type_graph.driver
-    session = driver.session()
-    yield session
-    session.close()
+def session(database):
+    with database.session() as session:
+        yield session
 
 def get_node(identifier,session):
     result = session.run("MATCH (a {id: {identifier}}) RETURN a", {"identifier":identifier} )
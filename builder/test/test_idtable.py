@@ -0,0 +1,64 @@
+import sys
+from greent.graph_components import KEdge, KNode
+from builder.idtable import IdentifierTable, NodeRecord
+
+def test_intern_round_trip():
+    table = IdentifierTable()
+    a = table.intern('MONDO:0005148')
+    b = table.intern('HP:0001513')
+    assert (a, b) == (0, 1) and table.intern('MONDO:' + '0005148') == a
+    assert table.string(a) == 'MONDO:0005148' and table.string(b) == 'HP:0001513'
+    # One copy of each string
+    assert table.string(a) is sys.intern('MONDO:0005148')
+    assert table.get('HP:0001513') == b and table.get('DOID:9351') is None
+    assert 'HP:0001513' in table and 'DOID:9351' not in table
+    assert len(table) == 2
+
+def test_synonyms_for_export_follow_the_node():
+    node = KNode('MONDO:1', 'disease')
+    record = NodeRecord(0)
+    assert record.synonyms_for_export(node) == ['MONDO:1']
+    assert record.synonyms_for_export(node) is record.synonyms_for_export(node)
+    node.add_synonyms(['DOID:9'])
+    assert record.synonyms_for_export(node) == ['DOID:9', 'MONDO:1']
+
+def edge(source, target):
+    e = KEdge('test', None, 'RO:1', 'related', source.identifier)
+    e.source_node, e.target_node = source, target
+    return e
+
+def knowledge_graph():
+    from builder.builder import KnowledgeGraph
+    from builder.bench.stubs import StubRosetta, SyntheticQuery
+    return KnowledgeGraph(SyntheticQuery(10, 10), StubRosetta())
+
+def test_a_node_named_by_a_synonym_is_the_same_node():
+    kgraph = knowledge_graph()
+    disease = KNode('MONDO:1', 'disease')
+    disease.add_synonyms(['DOID:9'])
+    kgraph.add_edges([edge(KNode('CHEBI:1', 'chemical_substance'), disease)])
+    other = KNode('DOID:9', 'disease')
+    other.add_synonyms(['OMIM:5'])
+    kgraph.add_edges([edge(KNode('HGNC:1', 'gene'), other)])
+    assert kgraph.find_node(KNode('DOID:9', 'disease')) is disease
+    assert sorted(node.identifier for node in kgraph.graph.nodes()) == ['CHEBI:1', 'HGNC:1', 'MONDO:1']
+    assert [target for _, target in kgraph.graph.edges()] == [disease, disease]
+    assert disease.synonyms == {'MONDO:1', 'DOID:9', 'OMIM:5'}
+
+def test_merge_moves_edges_and_names_to_the_node_kept():
+    kgraph = knowledge_graph()
+    disease = KNode('MONDO:1', 'disease')
+    disease.add_synonyms(['DOID:9'])
+    phenotype = KNode('HP:1', 'phenotypic_feature')
+    phenotype.add_synonyms(['UMLS:1'])
+    chemical, gene = KNode('CHEBI:1', 'chemical_substance'), KNode('HGNC:1', 'gene')
+    kgraph.add_edges([edge(chemical, disease), edge(phenotype, gene)])
+    kgraph.merge(disease, phenotype)
+    assert phenotype not in kgraph.graph.nodes() and phenotype not in kgraph.node_records
+    [moved] = [data['object'] for _, _, data in kgraph.graph.edges(data=True) if data['object'].target_node is gene]
+    assert moved.source_node is disease and kgraph.graph.has_edge(disease, gene)
+    for identifier in ('MONDO:1', 'DOID:9', 'HP:1', 'UMLS:1'):
+        assert kgraph.node_map[kgraph.ids.get(identifier)] is disease
+    record = kgraph.node_records[disease]
+    assert sorted(kgraph.ids.string(k) for k in set(record.keys)) == ['DOID:9', 'HP:1', 'MONDO:1', 'UMLS:1']
+    assert record.synonyms_for_export(disease) == ['DOID:9', 'HP:1', 'MONDO:1', 'UMLS:1']
@@ -0,0 +1,85 @@
+import json
+from builder.instrument import Instrumentation, NULL_INSTRUMENTATION
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_timers_accumulate_into_one_histogram_per_name_and_labels(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('builder.instrument.time.perf_counter', clock)
+    metrics = Instrumentation()
+    for seconds in (0.002, 0.3, 0.004):
+        with metrics.timer('stage_seconds', stage='support'):
+            clock.now += seconds
+    with metrics.timer('stage_seconds', stage='export') as timer:
+        clock.now += 70
+    assert abs(timer.elapsed - 70) < 1e-9
+    [support] = [entry for entry in metrics.report()['histograms']['stage_seconds']
+                 if entry['labels'] == {'stage': 'support'}]
+    assert support['count'] == 3 and abs(support['sum'] - 0.306) < 1e-9 and abs(support['max'] - 0.3) < 1e-9
+    assert support['buckets']['0.0025'] == 1 and support['buckets']['0.005'] == 1 and support['buckets']['0.5'] == 1
+    assert sum(support['buckets'].values()) == 3
+    [export] = [entry for entry in metrics.report()['histograms']['stage_seconds']
+                if entry['labels'] == {'stage': 'export'}]
+    assert export['buckets']['+Inf'] == 1
+
+def test_labels_key_counters_whatever_their_order():
+    metrics = Instrumentation()
+    metrics.count('support_errors', supporter='omnicorp', error='TimeoutError')
+    metrics.count('support_errors', 2, error='TimeoutError', supporter='omnicorp')
+    metrics.count('support_errors', supporter='chemotext', error='TimeoutError')
+    metrics.count('support_pairs', 5)
+    metrics.gauge('memory_bytes', 10)
+    metrics.gauge('memory_bytes', 7)
+    report = metrics.report()
+    assert report['counters']['support_errors'] == [
+        {'labels': {'error': 'TimeoutError', 'supporter': 'chemotext'}, 'value': 1},
+        {'labels': {'error': 'TimeoutError', 'supporter': 'omnicorp'}, 'value': 3}]
+    assert report['counters']['support_pairs'] == [{'labels': {}, 'value': 5}]
+    assert report['gauges']['memory_bytes'] == [{'labels': {}, 'value': 7}]
+
+def test_json_report(tmpdir):
+    metrics = Instrumentation()
+    metrics.count('support_pairs', 4, supporter='omnicorp')
+    metrics.observe('db_transaction_seconds', 0.02, mode='write')
+    metrics.detail('support', [{'supporter': 'omnicorp', 'failed_pairs': 0}])
+    path = str(tmpdir.join('metrics.json'))
+    metrics.write_json(path)
+    with open(path) as infile:
+        report = json.load(infile)
+    assert report['counters'] == {'support_pairs': [{'labels': {'supporter': 'omnicorp'}, 'value': 4}]}
+    [histogram] = report['histograms']['db_transaction_seconds']
+    assert histogram['labels'] == {'mode': 'write'} and histogram['count'] == 1
+    assert report['details'] == {'support': [{'supporter': 'omnicorp', 'failed_pairs': 0}]}
+    assert report['elapsed'] >= 0
+
+def test_prometheus_text(tmpdir):
+    metrics = Instrumentation()
+    metrics.count('support_pairs', 4, supporter='omnicorp')
+    metrics.gauge('ratelimit_limit', 2.5, service='mondo')
+    metrics.observe('db_transaction_seconds', 0.003, mode='write')
+    metrics.observe('db_transaction_seconds', 0.2, mode='write')
+    path = str(tmpdir.join('metrics.prom'))
+    metrics.write_prometheus(path)
+    with open(path) as infile:
+        lines = infile.read().splitlines()
+    assert 'robokop_builder_support_pairs_total{supporter="omnicorp"} 4' in lines
+    assert 'robokop_builder_ratelimit_limit{service="mondo"} 2.5' in lines
+    # Buckets are cumulative, as Prometheus expects
+    assert 'robokop_builder_db_transaction_seconds_bucket{mode="write",le="0.0025"} 0' in lines
+    assert 'robokop_builder_db_transaction_seconds_bucket{mode="write",le="0.005"} 1' in lines
+    assert 'robokop_builder_db_transaction_seconds_bucket{mode="write",le="0.25"} 2' in lines
+    assert 'robokop_builder_db_transaction_seconds_bucket{mode="write",le="+Inf"} 2' in lines
+    assert 'robokop_builder_db_transaction_seconds_count{mode="write"} 2' in lines
+    assert 'robokop_builder_db_transaction_seconds_sum{mode="write"} 0.203' in lines
+
+def test_null_instrumentation_records_nothing():
+    NULL_INSTRUMENTATION.count('support_pairs', supporter='omnicorp')
+    NULL_INSTRUMENTATION.detail('support', [])
+    with NULL_INSTRUMENTATION.timer('stage_seconds', stage='support'):
+        pass
+    assert NULL_INSTRUMENTATION.report() == {}
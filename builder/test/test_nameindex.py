@@ -0,0 +1,50 @@
+from builder.nameindex import NameIndex, open_index
+
+OBO = """format-version: 1.2
+ontology: mondo
+
+[Term]
+id: MONDO:0005149
+name: pulmonary hypertension
+synonym: "PH" EXACT []
+synonym: "hypertension, pulmonary" RELATED []
+
+[Term]
+id: MONDO:0011122
+name: Obesity,  Morbid
+synonym: "severe \\"obesity\\"" EXACT [MONDO:patterns]
+
+[Term]
+id: MONDO:0000001
+name: obsolete disease
+is_obsolete: true
+
+[Term]
+id: HP:0001513
+name: Obesity
+
+[Typedef]
+id: part_of
+name: part of
+"""
+
+def test_lookup(tmpdir):
+    tmpdir.join('mondo.obo').write(OBO)
+    index = open_index('mondo', data_directory=str(tmpdir))
+    assert index.lookup('Pulmonary  Hypertension') == ['MONDO:0005149']
+    # Inverted either way round: the query, or the name in the ontology
+    assert index.lookup('Hypertension, Pulmonary') == ['MONDO:0005149']
+    assert index.lookup('morbid obesity') == ['MONDO:0011122']
+    assert index.lookup('severe "obesity"') == ['MONDO:0011122']
+    assert index.lookup('obesity') == []
+    assert index.lookup('obsolete disease') == []
+    assert index.lookup('part of') == []
+    assert index.prefix('pulmonary') == [('pulmonary hypertension', 'MONDO:0005149')]
+    assert [name for name, _ in index.prefix('', limit=3)] == ['morbid obesity', 'obesity, morbid', 'ph']
+
+def test_saved_index_is_used_without_the_dump(tmpdir):
+    assert open_index('hp', data_directory=str(tmpdir)) is None
+    NameIndex.build([('Abdominal pain', 'HP:0002027')]).save(str(tmpdir.join('name-index', 'hp')))
+    index = open_index('hp', data_directory=str(tmpdir))
+    assert index.lookup('pain, abdominal') == ['HP:0002027']
+    assert len(index) == 1
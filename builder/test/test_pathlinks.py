@@ -0,0 +1,45 @@
+from builder.pathlinks import path_pairs
+from builder.test.test_prune import Node, Program, build
+
+def test_pairs_each_node_with_the_nodes_before_it():
+    a, b, c = Node('a', 0), Node('b', 1), Node('c', 2)
+    # d follows a, but isn't at the next position; e is at position 2, but b -> e runs the wrong way
+    d, e = Node('d', 2), Node('e', 2)
+    graph = build([(a, b), (c, b), (a, d), (b, e)])
+    ids = {a: 1, b: 2, c: 3, d: 4, e: 5}
+    assert set(path_pairs(graph, [Program()], ids.get)) == set([(2, 1), (3, 2), (3, 1)])
+
+def test_pairs_come_once_across_programs():
+    a, b, c = Node('a', 0), Node('b', 1), Node('c', 2)
+    graph = build([(a, b), (c, b)])
+    ids = {a: 1, b: 2, c: 3}
+    assert sorted(path_pairs(graph, [Program(), Program()], ids.get)) == [(2, 1), (3, 1), (3, 2)]
+
+class Budget:
+    """A memory budget with room for n_links more support pairs, whatever else is in use"""
+    def __init__(self, n_links):
+        from builder.memprofile import LINK_BYTES
+        self.max_bytes = 10 ** 12 + n_links * LINK_BYTES
+
+    def used(self):
+        return 10 ** 12
+
+    def allows(self, extra_bytes):
+        return self.used() + extra_bytes <= self.max_bytes
+
+def test_path_pairs_over_the_memory_budget_are_spilled_as_they_come():
+    from builder.builder import KnowledgeGraph
+    from builder.bench.stubs import StubRosetta, SyntheticQuery
+    kgraph = KnowledgeGraph(SyntheticQuery(80, 240), StubRosetta())
+    kgraph.execute()
+    expected = sorted(kgraph.generate_links_from_paths())
+    kgraph.memory_budget = Budget(len(expected))
+    assert kgraph.choose_links() == expected
+    kgraph.memory_budget = Budget(len(expected) // 3)
+    spilled = kgraph.choose_links()
+    assert hasattr(spilled, 'tolist') and sorted(map(tuple, spilled.tolist())) == expected
+    # The path pairs were found once, by choose_links
+    kgraph.memory_budget = Budget(len(expected))
+    links = kgraph.choose_links()
+    kgraph.generate_links_from_paths = None
+    assert sorted(kgraph.prioritize_links(links)) == expected
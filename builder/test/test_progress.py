@@ -0,0 +1,65 @@
+import logging
+from builder.progress import ProgressLog
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Detail:
+    """Counts the times it is formatted"""
+    formatted = 0
+
+    def __str__(self):
+        Detail.formatted += 1
+        return 'pair'
+
+class Handler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+def logger(level):
+    log = logging.getLogger('test_progress')
+    log.propagate = False
+    log.handlers = [Handler()]
+    log.setLevel(level)
+    return log, log.handlers[0].records
+
+def test_events_are_summarised_at_info_without_formatting_each(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('builder.progress.time.time', clock)
+    log, records = logger(logging.INFO)
+    Detail.formatted = 0
+    progress = ProgressLog(log, 'OmnicorpSupport', total=10, interval=30)
+    for _ in range(3):
+        progress.event('stored', Detail())
+    progress.event('calls', n=4)
+    assert records == []
+    # The first event past the interval writes a summary
+    clock.now += 31
+    progress.event('cache hits', Detail())
+    assert records == [(logging.INFO, 'OmnicorpSupport: 8/10 (80%) in 31.0s (0/s) 1 cache hits, 4 calls, 3 stored')]
+    clock.now += 1
+    progress.event('stored', Detail())
+    progress.finish()
+    assert len(records) == 2
+    assert records[1][1].startswith('OmnicorpSupport done: 9/10 (90%) in 32.0s')
+    assert records[1][1].endswith('1 cache hits, 4 calls, 4 stored')
+    assert Detail.formatted == 0
+
+def test_events_are_logged_one_by_one_at_debug():
+    log, records = logger(logging.DEBUG)
+    Detail.formatted = 0
+    progress = ProgressLog(log, 'OmnicorpSupport')
+    progress.event('stored', Detail())
+    progress.event('calls')
+    progress.finish()
+    assert records[0] == (logging.DEBUG, 'OmnicorpSupport stored: pair')
+    assert Detail.formatted == 1
+    assert records[-1][0] == logging.INFO and 'done: 2 in' in records[-1][1]
@@ -0,0 +1,50 @@
+from collections import defaultdict
+import networkx as nx
+from builder.prune import dead_ends
+
+class Node:
+    def __init__(self, name, *positions):
+        self.name = name
+        self.contexts = defaultdict(set)
+        self.contexts[0].update(positions)
+
+    def __repr__(self):
+        return self.name
+
+class Program:
+    """A program along three positions, 0 -> 1 <- 2: the second edge runs against the path"""
+    program_number = 0
+
+    def get_path_descriptor(self):
+        return {0: (1, 1), 1: (2, -1)}
+
+def build(edges):
+    graph = nx.MultiDiGraph()
+    for source, target in edges:
+        graph.add_edge(source, target)
+    return graph
+
+def test_keeps_complete_paths():
+    a, b, c = Node('a', 0), Node('b', 1), Node('c', 2)
+    graph = build([(a, b), (c, b)])
+    assert dead_ends(graph, [Program()]) == []
+
+def test_removal_cascades_back_along_the_path():
+    a, b, c = Node('a', 0), Node('b', 1), Node('c', 2)
+    # b2 reaches no end, so b2 goes, and then a2 has nowhere to go
+    a2, b2 = Node('a2', 0), Node('b2', 1)
+    graph = build([(a, b), (c, b), (a2, b2)])
+    assert set(dead_ends(graph, [Program()])) == set([a2, b2])
+
+def test_edge_direction_and_position_matter():
+    a, b, c = Node('a', 0), Node('b', 1), Node('c', 2)
+    # c2 -> b is in the path's direction, but c3 is at the wrong position
+    c2, c3 = Node('c2', 2), Node('c3', 1)
+    graph = build([(a, b), (c, b), (b, c2), (c3, b)])
+    assert set(dead_ends(graph, [Program()])) == set([c2, c3])
+
+def test_kept_nodes_and_nodes_without_positions_stay():
+    a, b = Node('a', 0), Node('b', 1)
+    unknown = Node('unknown')
+    graph = build([(a, b), (unknown, b)])
+    assert set(dead_ends(graph, [Program()], keep=[a])) == set([b])
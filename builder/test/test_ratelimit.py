@@ -0,0 +1,68 @@
+import random
+import pytest
+from builder.ratelimit import AdaptiveLimiter, ServiceLimits, parse_ceilings
+
+def run_saturated(limiter, n_calls, latency):
+    """n_calls calls, each taking latency() seconds, with the limit always in use"""
+    for _ in range(n_calls):
+        while limiter.in_flight < int(limiter.limit):
+            limiter.acquire()
+        limiter.release(latency())
+
+def test_limit_grows_to_the_ceiling_while_latency_holds():
+    limiter = AdaptiveLimiter('omnicorp', ceiling=8)
+    run_saturated(limiter, 200, lambda: 0.1)
+    assert limiter.limit == 8
+
+def test_failures_and_slow_windows_cut_the_limit_once_per_round():
+    limiter = AdaptiveLimiter('omnicorp', ceiling=16)
+    run_saturated(limiter, 200, lambda: 0.1)
+    assert limiter.limit == 16
+    limiter.release(0.1, failed=True)
+    assert limiter.limit == 8
+    # The calls started under the old limit don't cut it again
+    for _ in range(limiter.holdover):
+        limiter.release(0.1, failed=True)
+    assert limiter.limit == 8 and limiter.holdover == 0
+    # One slow call is not a slow window
+    limiter.acquire()
+    limiter.release(10.0)
+    assert limiter.limit == 8
+    for _ in range(limiter.window):
+        limiter.acquire()
+        limiter.release(1.0)
+    assert limiter.limit == 4 and limiter.congested
+
+def test_a_steady_mix_of_quick_and_slow_calls_does_not_collapse_the_limit():
+    rng = random.Random(0)
+    limiter = AdaptiveLimiter('synonymize', ceiling=16)
+    # e.g. a service answering some calls from its own cache
+    run_saturated(limiter, 3000, lambda: 0.0005 if rng.random() < 0.3 else 0.02)
+    assert limiter.limit == 16
+
+def test_only_remote_methods_are_limited():
+    class Service:
+        def search(self, name):
+            return [name.upper()]
+        def is_valid_curie_prefix(self, prefix):
+            return True
+    class Core:
+        mondo = Service()
+        hpo = Service()
+        local = Service()
+    limits = ServiceLimits({'mondo': 2}, remote_methods={'mondo': ('search',), 'hpo': ('search',),
+                                                          'chemotext2': ('search',)})
+    core = limits.core(Core())
+    assert core.mondo.search('asthma') == ['ASTHMA']
+    assert core.mondo.is_valid_curie_prefix('MONDO')
+    core.hpo.search('pain')
+    assert core.local.search('x') == ['X']
+    core.chemotext2 = Service()
+    assert core.chemotext2.search('x') == ['X']
+    assert [(state['service'], state['ceiling'], state['calls']) for state in limits.state()] == \
+           [('chemotext2', 16, 1), ('hpo', 16, 1), ('mondo', 2, 1)]
+
+def test_parse_ceilings():
+    assert parse_ceilings('omnicorp=4, chemotext=2') == {'omnicorp': 4, 'chemotext': 2}
+    with pytest.raises(ValueError):
+        parse_ceilings('omnicorp')
@@ -0,0 +1,143 @@
+import importlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from builder.bench.stubs import StubBackend
+
+def entry_point(name):
+    """Import one of the builder's scripts (service, batch).  They import builder.py as builder, which
+    here is the package the tests are in."""
+    import builder.builder
+    package = sys.modules['builder']
+    sys.modules['builder'] = builder.builder
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.modules['builder'] = package
+
+
+class CrashingBackend(StubBackend):
+    """Its worker dies, as it would on a segfault or the OOM killer, on a job that asks it to"""
+    def query(self, job):
+        if job.get('crash'):
+            import os
+            os._exit(3)
+        return super().query(job)
+
+
+class BrokenBackend(StubBackend):
+    """Can't be set up, as when neo4j or the configuration can't be reached"""
+    def __init__(self, **options):
+        raise ConnectionError('neo4j is down')
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def post(port, body):
+    request = urllib.request.Request('http://127.0.0.1:{}/jobs'.format(port), json.dumps(body).encode('utf-8'),
+                                     {'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf-8'))
+
+def test_a_full_queue_answers_503():
+    service_module = entry_point('service')
+    # No workers, so nothing leaves the queue
+    service = service_module.BuilderService('bench.stubs:StubBackend', n_workers=0, queue_size=1)
+    service.start()
+    server = service_module.ServiceServer(('127.0.0.1', 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        job = {'nodes': 20, 'supports': ['bench.fakesupport']}
+        code, body = post(port, job)
+        assert code == 202
+        assert post(port, job)[0] == 503
+        assert post(port, {'nodes': 'many', 'supports': ['bench.fakesupport']})[0] == 400
+        assert [record['id'] for record in service.statuses()] == [body['id']]
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop(timeout=5)
+
+def test_a_dead_workers_job_fails_and_the_worker_is_replaced():
+    service_module = entry_point('service')
+    service = service_module.BuilderService('builder.test.test_service:CrashingBackend', n_workers=1)
+    service.start()
+    try:
+        assert wait_for(lambda: service.health()['ready'] == 1)
+        first_pid = service.pool.workers[0].pid
+        crashed = service.submit({'nodes': 20, 'supports': ['bench.fakesupport'], 'crash': True})
+        assert wait_for(lambda: service.status(crashed)['state'] == service_module.FAILED)
+        assert 'exited with 3' in service.status(crashed)['error']
+        assert service.pool.workers[0].pid != first_pid
+        job = service.submit({'nodes': 20, 'supports': ['bench.fakesupport']})
+        assert wait_for(lambda: service.status(job)['state'] in (service_module.DONE, service_module.FAILED))
+        assert service.status(job)['state'] == service_module.DONE, service.status(job)['error']
+        assert [summary['supporter'] for summary in service.status(job)['result']['support']] == ['FakeSupport']
+        assert service.health()['workers'] == 1
+    finally:
+        service.stop(timeout=5)
+
+def test_workers_that_cannot_set_up_are_restarted_with_backoff_and_fail_the_waiting_jobs(monkeypatch):
+    service_module = entry_point('service')
+    monkeypatch.setattr(service_module.WorkerPool, 'restart_delay', 0.05)
+    monkeypatch.setattr(service_module.WorkerPool, 'max_setup_failures', 3)
+    service = service_module.BuilderService('builder.test.test_service:BrokenBackend', n_workers=1)
+    job = service.submit({'nodes': 20, 'supports': ['bench.fakesupport']})
+    started = []
+    start_worker = service.pool.start_worker
+    service.pool.start_worker = lambda i: started.append(time.time()) or start_worker(i)
+    service.start()
+    try:
+        assert wait_for(lambda: service.status(job)['state'] == service_module.FAILED)
+        assert 'neo4j is down' in service.status(job)['error']
+        health = service.health()
+        assert not health['healthy'] and health['setup_failures'] >= 3
+        assert health['setup_error'] == 'ConnectionError: neo4j is down'
+        try:
+            service.submit({'nodes': 20, 'supports': ['bench.fakesupport']})
+        except service_module.Unavailable:
+            pass
+        else:
+            assert False, 'A broken service took a job'
+        time.sleep(0.5)
+        # Not a busy loop: the waits between restarts double
+        gaps = [b - a for a, b in zip(started, started[1:])]
+        assert len(started) < 8
+        assert all(later > 1.5 * earlier for earlier, later in zip(gaps, gaps[1:]))
+    finally:
+        service.stop(timeout=5)
+
+def test_a_job_sent_to_a_worker_that_dies_before_starting_it_fails():
+    service_module = entry_point('service')
+    pool = service_module.WorkerPool('bench.stubs:StubBackend', n_workers=1)
+    pool.start()
+    try:
+        events = []
+        assert wait_for(lambda: events.extend(pool.events(0.1)) or any(kind == 'ready' for kind, _, _ in events))
+        pid = pool.workers[0].pid
+        # Stopped, it can't report the job started
+        os.kill(pid, signal.SIGSTOP)
+        pool.submit({'id': 'lost', 'nodes': 20, 'supports': ['bench.fakesupport']})
+        assert wait_for(lambda: events.extend(pool.events(0.1)) or pool.running[0] == 'lost')
+        os.kill(pid, signal.SIGKILL)
+        assert wait_for(lambda: events.extend(pool.events(0.1)) or ('failed', 'lost') in
+                        [(kind, job_id) for kind, job_id, _ in events])
+        assert ('started', 'lost') not in [(kind, job_id) for kind, job_id, _ in events]
+        assert wait_for(lambda: events.extend(pool.events(0.1)) or pool.workers[0].pid != pid)
+    finally:
+        pool.stop(timeout=5)
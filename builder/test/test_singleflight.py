@@ -0,0 +1,107 @@
+import threading
+import time
+from builder.singleflight import CoalescingCache
+from builder.instrument import Instrumentation
+
+class SlowService:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+
+    def lookup(self, cache, key):
+        """What a Program does for one step: the cache, else the service and then the cache"""
+        value = cache.get(key)
+        if value is None:
+            self.calls.append(key)
+            time.sleep(self.delay)
+            value = ['result of ' + key]
+            cache.set(key, value)
+        return value
+
+class DictCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+def run_threads(n, target):
+    results = [None] * n
+    def run(i):
+        results[i] = target()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_misses_share_one_call():
+    metrics = Instrumentation()
+    cache = CoalescingCache(DictCache(), metrics)
+    service = SlowService()
+    results = run_threads(8, lambda: service.lookup(cache, 'synonymize(MONDO:0005136)'))
+    assert service.calls == ['synonymize(MONDO:0005136)']
+    assert results == [['result of synonymize(MONDO:0005136)']] * 8
+    assert metrics.counters[('singleflight_calls', ())] == 1
+    assert metrics.counters[('singleflight_coalesced', ())] == 7
+
+def test_failed_call_does_not_hold_up_others():
+    cache = CoalescingCache(DictCache(), lease_timeout=0.2)
+    assert cache.get('k') is None
+    # The same thread asking again doesn't wait on its own lease
+    assert cache.get('k') is None
+    start = time.perf_counter()
+    assert run_threads(1, lambda: cache.get('k')) == [None]
+    assert time.perf_counter() - start < 1
+    # After the lease expires, the next miss takes it over
+    time.sleep(0.25)
+    assert run_threads(1, lambda: cache.get('k')) == [None]
+    assert cache.leases['k'].owner != threading.get_ident()
+
+def test_release_wakes_waiters():
+    cache = CoalescingCache(DictCache(), lease_timeout=10)
+    assert cache.get('k') is None
+    timer = threading.Timer(0.05, cache.release, args=('k',))
+    timer.start()
+    start = time.perf_counter()
+    assert run_threads(2, lambda: cache.get('k')) == [None, None]
+    assert time.perf_counter() - start < 5
+
+def test_a_failed_program_releases_its_leases():
+    from builder.builder import KnowledgeGraph
+    from builder.bench.stubs import StubRosetta, SyntheticQuery
+    kgraph = KnowledgeGraph(SyntheticQuery(10, 10), StubRosetta())
+    cache = kgraph.rosetta.cache = CoalescingCache(DictCache(), lease_timeout=10)
+    leased = threading.Event()
+    class Program:
+        program_number = 0
+        def run_program(self):
+            assert cache.get('a') is None and cache.get('b') is None
+            leased.set()
+            time.sleep(0.1)
+            raise ConnectionError('service down')
+    def run_failing_program():
+        try:
+            kgraph.run_program(Program())
+        except ConnectionError:
+            pass
+    program = threading.Thread(target=run_failing_program)
+    program.start()
+    leased.wait()
+    start = time.perf_counter()
+    # Another program missing on the same keys waits only until the first one fails
+    assert run_threads(2, lambda: cache.get('a')) == [None, None]
+    assert time.perf_counter() - start < 5
+    program.join()
+    assert cache.leases == {}
+
+def test_release_held_leaves_other_threads_leases():
+    cache = CoalescingCache(DictCache(), lease_timeout=10)
+    run_threads(1, lambda: cache.get('theirs'))
+    assert cache.get('mine') is None
+    cache.release_held()
+    assert list(cache.leases) == ['theirs']
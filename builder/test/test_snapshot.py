@@ -0,0 +1,90 @@
+import datetime
+from collections import defaultdict
+import networkx as nx
+from builder.snapshot import Snapshot, write
+
+class Node:
+    def __init__(self, identifier, node_type, label=None):
+        self.identifier = identifier
+        self.node_type = node_type
+        self.label = label
+        self.properties = {}
+        self.mesh_identifiers = []
+        self.synonyms = set([identifier])
+        self.contexts = defaultdict(set)
+
+class Edge:
+    def __init__(self, edge_source, source_node, target_node, is_support=False):
+        self.edge_source = edge_source
+        self.ctime = datetime.datetime(2018, 3, 1, 12, 30, 15, 250)
+        self.predicate_id = 'RO:0002410'
+        self.predicate_label = None
+        self.publications = ['PMID:1234']
+        self.properties = {'reversed': False}
+        self.is_support = is_support
+        self.source_node = source_node
+        self.target_node = target_node
+
+def sample_graph():
+    drug = Node('CHEBI:15365', 'chemical_substance', 'aspirin')
+    drug.synonyms.update(['MESH:D001241', 'CHEMBL:CHEMBL25'])
+    drug.contexts[0].add(0)
+    drug.properties = {'mondo_identifiers': ['MONDO:1'], 'counts': (1, 2)}
+    gene = Node('HGNC:9604', 'gene')
+    gene.contexts[0].add(1)
+    gene.contexts[1].update([0, 2])
+    gene.reversed = True
+    graph = nx.MultiDiGraph()
+    graph.add_edge(drug, gene, object=Edge('ctd.drug_to_gene', drug, gene))
+    graph.add_edge(drug, gene, object=Edge('chemotext', drug, gene, is_support=True))
+    return graph, drug, gene
+
+def test_round_trip(tmpdir):
+    graph, drug, gene = sample_graph()
+    keys = {drug: ['CHEBI:15365', 'MESH:D001241'], gene: ['HGNC:9604']}
+    directory = str(tmpdir.join('snapshot'))
+    write(directory, graph, keys.get, 'support', 'abc')
+    snapshot = Snapshot.open(directory)
+    assert (snapshot.n_nodes, snapshot.n_edges, snapshot.stage, snapshot.fingerprint) == (2, 2, 'support', 'abc')
+    nodes = {node.identifier: node for node in snapshot.nodes()}
+    for original in (drug, gene):
+        loaded = nodes[original.identifier]
+        assert type(loaded) is Node
+        assert loaded.__dict__ == original.__dict__
+    i = [node.identifier for node in snapshot.nodes()].index('CHEBI:15365')
+    assert snapshot.node_keys(i) == ['CHEBI:15365', 'MESH:D001241']
+    edges = sorted((edge for _, _, edge in snapshot.edges()), key=lambda edge: edge.edge_source)
+    originals = sorted((data['object'] for _, _, data in graph.edges(data=True)), key=lambda edge: edge.edge_source)
+    for loaded, original in zip(edges, originals):
+        assert loaded.source_node is nodes['CHEBI:15365'] and loaded.target_node is nodes['HGNC:9604']
+        assert {k: v for k, v in loaded.__dict__.items() if not k.endswith('_node')} == \
+               {k: v for k, v in original.__dict__.items() if not k.endswith('_node')}
+    assert [snapshot.edge(k)[2].edge_source for k in snapshot.edge_numbers(support=False)] == ['ctd.drug_to_gene']
+
+def test_loaded_values_are_not_shared(tmpdir):
+    graph, drug, gene = sample_graph()
+    directory = str(tmpdir.join('snapshot'))
+    write(directory, graph, lambda node: [node.identifier], 'enhance')
+    snapshot = Snapshot.open(directory)
+    snapshot.preload()
+    first, second = [edge for _, _, edge in snapshot.edges()]
+    first.properties['reversed'] = True
+    assert second.properties == {'reversed': False}
+
+def test_a_snapshot_for_another_query_is_refused(tmpdir):
+    import pytest
+    from builder.builder import KnowledgeGraph
+    from builder.bench.stubs import StubRosetta, SyntheticQuery
+    directory = str(tmpdir.join('snapshot'))
+    kgraph = KnowledgeGraph(SyntheticQuery(20, 40, seed=1), StubRosetta())
+    kgraph.execute()
+    kgraph.save_snapshot(directory, 'enhance')
+    same = KnowledgeGraph(SyntheticQuery(20, 40, seed=1), StubRosetta())
+    assert same.load_snapshot(directory) == 'enhance'
+    assert same.graph.number_of_edges() == kgraph.graph.number_of_edges()
+    other = KnowledgeGraph(SyntheticQuery(20, 40, seed=1, pathway='SGPD'), StubRosetta())
+    with pytest.raises(ValueError):
+        other.load_snapshot(directory)
+    assert other.graph.number_of_nodes() == 0
+    assert other.load_snapshot(directory, any_query=True) == 'enhance'
+    assert other.graph.number_of_nodes() == kgraph.graph.number_of_nodes()
@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+
+BUILDER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('numpy', 'networkx', 'cdw', 'cdwindex', 'greent.rosetta', 'snapshot')
+
+def loaded_after(code):
+    """Which of HEAVY a fresh interpreter has imported after running code in the builder directory"""
+    script = code + '\nimport json, sys\nprint(json.dumps([name for name in {!r} if name in sys.modules]))'.format(HEAVY)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    output = subprocess.run([sys.executable, '-c', script], cwd=BUILDER_DIRECTORY, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode('utf-8').strip().split('\n')[-1])
+
+def test_importing_the_builder_loads_nothing_heavy():
+    assert loaded_after('import builder') == []
+
+def test_heavy_modules_load_on_first_use():
+    loaded = loaded_after('import builder\nbuilder.startup.load("networkx").MultiDiGraph()')
+    # networkx brings numpy with it, if it's installed
+    assert 'networkx' in loaded and set(loaded) <= {'networkx', 'numpy'}
+    assert loaded_after('import builder\nbuilder.startup.load("snapshot")') == ['numpy', 'snapshot']
+
+def test_the_cdw_counts_are_opened_on_the_first_lookup(monkeypatch):
+    import importlib
+    # As support loads it
+    cdw = importlib.import_module('cdw')
+    opened = []
+    class Index:
+        def count(self, code):
+            return None
+    monkeypatch.setattr(cdw.cdwindex, 'open_index', lambda: opened.append(1) or Index())
+    class Greent:
+        oxo = None
+    supporter = cdw.CDWSupport(Greent())
+    assert opened == []
+    class Node:
+        synonyms = {'ICD9:250'}
+    supporter.term_to_term(Node(), Node())
+    supporter.term_to_term(Node(), Node())
+    assert opened == [1]
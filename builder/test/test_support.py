@@ -0,0 +1,107 @@
+import importlib
+import json
+import logging
+# As builder.py sees them, i.e. as supportstore and supporter rather than builder.supportstore, etc.
+from builder.builder import KnowledgeGraph, MISSING, SupportFailure, orient_support_edge, run_query
+from builder.bench.stubs import StubRosetta, SyntheticQuery
+from builder.progress import ProgressLog
+from builder.supportguard import SupporterGuard
+
+class Node:
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+class PerPairSupport:
+    """A supporter with no bulk lookup, failing on the pairs in bad"""
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.calls = []
+
+    def term_to_term(self, node_a, node_b):
+        self.calls.append((node_a.identifier, node_b.identifier))
+        if node_b.identifier in self.bad:
+            raise ConnectionError('no answer for ' + node_b.identifier)
+        return 'edge {}-{}'.format(node_a.identifier, node_b.identifier)
+
+class BulkSupport(PerPairSupport):
+    """Its bulk lookup fails for the pairs in bad, or altogether"""
+    def __init__(self, bad=(), fail_whole_batch=False):
+        super().__init__()
+        self.bulk_bad = set(bad)
+        self.fail_whole_batch = fail_whole_batch
+        self.batches = []
+
+    def term_to_terms(self, pairs):
+        self.batches.append(len(pairs))
+        if self.fail_whole_batch:
+            raise TimeoutError('bulk lookup timed out')
+        return [SupportFailure(ValueError()) if b.identifier in self.bulk_bad
+                else 'bulk {}-{}'.format(a.identifier, b.identifier) for a, b in pairs]
+
+def compute(supporter, targets):
+    kgraph = KnowledgeGraph(SyntheticQuery(10, 10), StubRosetta())
+    guard = SupporterGuard(supporter)
+    rows = [(0, i, None, None, 'key({})'.format(target), Node('A'), Node(target), False)
+            for i, target in enumerate(targets)]
+    results = kgraph.compute_support(guard, rows, ProgressLog(logging.getLogger('application'), 'support'))
+    return guard, results
+
+def test_per_pair_failures_are_recorded_against_their_pairs():
+    supporter = PerPairSupport(bad=['C'])
+    guard, results = compute(supporter, ['B', 'C', 'D'])
+    assert results == ['edge A-B', MISSING, 'edge A-D']
+    # Not retried
+    assert len(supporter.calls) == 3
+    assert guard.calls == 3 and guard.errors == 1
+
+def test_only_the_pairs_a_bulk_lookup_failed_on_are_retried():
+    supporter = BulkSupport(bad=['C'])
+    guard, results = compute(supporter, ['B', 'C', 'D'])
+    assert results == ['bulk A-B', 'edge A-C', 'bulk A-D']
+    assert supporter.calls == [('A', 'C')]
+    assert guard.calls == 4 and guard.errors == 0
+
+def test_a_failed_bulk_lookup_is_retried_a_pair_at_a_time():
+    supporter = BulkSupport(fail_whole_batch=True)
+    supporter.bad = set(['C'])
+    guard, results = compute(supporter, ['B', 'C', 'D'])
+    assert results == ['edge A-B', MISSING, 'edge A-D']
+    assert supporter.batches == [3] and len(supporter.calls) == 3
+    assert guard.calls == 6 and guard.errors == 1
+
+class DirectionalSupport:
+    """Reorients in place, as a supporter may"""
+    def reorient(self, edge):
+        edge.properties['first'], edge.properties['second'] = edge.properties['second'], edge.properties['first']
+
+def test_a_cached_edge_serves_both_orientations_unchanged():
+    from greent.graph_components import KEdge
+    cached = KEdge('cdw', None, 'cdw:1', 'co-occurrence', 'A,B', properties={'first': 'A', 'second': 'B'})
+    a, b = Node('A'), Node('B')
+    forward = orient_support_edge(DirectionalSupport(), cached, a, b, False)
+    forward.properties['rank'] = 1
+    backward = orient_support_edge(DirectionalSupport(), cached, b, a, True)
+    assert (backward.source_node, backward.target_node) == (b, a)
+    assert backward.properties['first'] == 'B' and 'rank' not in backward.properties
+    assert forward.properties['first'] == 'A'
+    assert cached.properties == {'first': 'A', 'second': 'B'}
+
+def test_support_failures_are_in_the_metrics_report(tmpdir, monkeypatch):
+    # As support loads it
+    fake = importlib.import_module('bench.fakesupport').FakeSupport
+    term_to_term = fake.term_to_term
+    def failing(self, node_a, node_b):
+        if node_b.identifier.endswith('3'):
+            raise ConnectionError('no answer')
+        return term_to_term(self, node_a, node_b)
+    monkeypatch.setattr(fake, 'term_to_term', failing)
+    metrics = str(tmpdir.join('metrics.json'))
+    kgraph = run_query(SyntheticQuery(30, 60, seed=1), ['bench.fakesupport'], StubRosetta(), metrics_json=metrics)
+    with open(metrics) as infile:
+        support = json.load(infile)['details']['support']
+    assert support == json.loads(json.dumps(kgraph.support_failures))
+    [summary] = support
+    assert summary['supporter'] == 'FakeSupport' and summary['failed_pairs'] > 0
+    assert summary['error_types'] == {'ConnectionError': summary['failed_pairs']}
+    assert all(error == 'ConnectionError' for _, error in summary['failed_examples'])
+    assert summary['unevaluated_pairs'] == 0
@@ -0,0 +1,28 @@
+from builder.supportguard import SupporterGuard
+
+class OmnicorpSupport:
+    pass
+
+def test_failures_and_skips_are_counted_with_a_few_examples():
+    guard = SupporterGuard(OmnicorpSupport(), max_examples=3)
+    guard.calls = 1000
+    for i in range(100):
+        guard.record_failure('key({})'.format(i), ConnectionError())
+    assert not guard.disabled
+    guard.skip('key(100)', n=5000)
+    summary = guard.summary()
+    assert summary['errors'] == summary['failed_pairs'] == 100
+    assert summary['failed_examples'] == [('key(0)', 'ConnectionError'), ('key(1)', 'ConnectionError'),
+                                          ('key(2)', 'ConnectionError')]
+    assert summary['skipped_pairs'] == 5000 and summary['skipped_examples'] == ['key(100)']
+
+def test_only_failed_calls_count_towards_disabling():
+    guard = SupporterGuard(OmnicorpSupport(), min_calls=10)
+    guard.calls = 10
+    # e.g. stored results that can't be added to the graph
+    for i in range(10):
+        guard.record_failure('key({})'.format(i), ValueError(), call=False)
+    assert not guard.disabled and guard.errors == 0 and guard.other_errors == 10
+    for i in range(3):
+        guard.record_failure('key({})'.format(i), TimeoutError())
+    assert guard.disabled
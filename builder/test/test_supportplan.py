@@ -0,0 +1,60 @@
+import importlib
+import time
+import networkx
+from builder.bench.stubs import StubRosetta, SyntheticQuery
+from builder.builder import KnowledgeGraph
+from builder.supportplan import SupportBudget, prioritize
+
+class Node:
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+def test_path_and_endpoint_pairs_come_first():
+    # s - a - b - e, with c hanging off b and d off c
+    nodes = {name: Node(name) for name in 'sabecd'}
+    graph = networkx.MultiDiGraph()
+    for a, b in ['sa', 'ab', 'be', 'bc', 'cd']:
+        graph.add_edge(nodes[a], nodes[b])
+    node_map = dict(enumerate(nodes[name] for name in 'sabecd'))
+    iid = {node.identifier: i for i, node in node_map.items()}
+    links = [(iid[a], iid[b]) for a, b in ['cd', 'ac', 'bd', 'ae', 'sb', 'se']]
+    ordered = prioritize(links, node_map, graph, endpoints=[nodes['s'], nodes['e']],
+                         path_links=[(iid['e'], iid['a'])])
+    named = [node_map[a].identifier + node_map[b].identifier for a, b in ordered]
+    # The path pair, then by the farther node's distance from s or e
+    assert named == ['ae', 'se', 'sb', 'ac', 'bd', 'cd']
+    # Among pairs as far out, ones the support store knows first, then the better connected
+    ordered = prioritize(links, node_map, graph, endpoints=[nodes['s'], nodes['e']], known_identifiers={'c', 'd'})
+    assert [node_map[a].identifier + node_map[b].identifier for a, b in ordered] == ['se', 'sb', 'ae', 'ac', 'cd', 'bd']
+
+def test_a_spent_budget_stops_support_between_chunks():
+    budget = SupportBudget(calls=50)
+    kgraph = KnowledgeGraph(SyntheticQuery(60, 300, seed=1), StubRosetta(), support_budget=budget)
+    kgraph.execute()
+    checked = []
+    prioritize_links = kgraph.prioritize_links
+    kgraph.prioritize_links = lambda links: checked.extend(prioritize_links(links)) or checked
+    support_chunk = kgraph.support_chunk
+    chunks = []
+    kgraph.support_chunk = lambda guard, chunk, progress: chunks.append(len(chunk)) or \
+        support_chunk(guard, chunk, progress)
+    kgraph.support(['bench.fakesupport'], chunk_size=20)
+    assert chunks == [20, 20, 10] and budget.calls_made == 50
+    unevaluated = kgraph.support_unevaluated['FakeSupport']
+    assert list(unevaluated) == checked[50:] and len(unevaluated) > 0
+    assert kgraph.support_failures[0]['unevaluated_pairs'] == len(unevaluated)
+
+def test_a_time_budget_holds_when_each_call_is_slow(monkeypatch):
+    # As support loads it
+    monkeypatch.setattr(importlib.import_module('bench.fakesupport'), 'LATENCY', 0.02)
+    budget = SupportBudget(seconds=0.5)
+    kgraph = KnowledgeGraph(SyntheticQuery(60, 300, seed=1), StubRosetta(), support_budget=budget)
+    kgraph.execute()
+    start = time.perf_counter()
+    kgraph.support(['bench.fakesupport'])
+    elapsed = time.perf_counter() - start
+    # About 1700 pairs at 20ms each, were it not for the budget
+    assert elapsed < 0.5 + 0.15
+    # Each call takes at least 20ms, and at most one overruns
+    assert 0 < budget.calls_made <= 0.5 / 0.02 + 1
+    assert len(kgraph.support_unevaluated['FakeSupport']) > 1000
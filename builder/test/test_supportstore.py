@@ -0,0 +1,92 @@
+import sqlite3
+from builder.supportstore import SupportResultStore, MISSING
+
+class FakeEdge:
+    def __init__(self, publications, source_node='source', target_node='target'):
+        self.publications = publications
+        self.source_node = source_node
+        self.target_node = target_node
+
+def test_get_and_put(tmpdir):
+    store = SupportResultStore(str(tmpdir.join('support.db')))
+    edge = FakeEdge(['PMID:1'])
+    store.put_many('OmnicorpSupport', [(('A', 'B'), edge), (('A', 'C'), None)])
+    # The caller's edge keeps its nodes; the stored copy does not
+    assert edge.source_node == 'source'
+    found = store.get_many('OmnicorpSupport', [('A', 'B'), ('A', 'C'), ('B', 'C')])
+    assert found[('A', 'B')].publications == ['PMID:1']
+    assert found[('A', 'B')].source_node is None
+    assert found[('A', 'C')] is None
+    assert found[('B', 'C')] is MISSING
+    assert store.get_many('CDWSupport', [('A', 'B')])[('A', 'B')] is MISSING
+    store.close()
+
+def test_results_survive_reopening(tmpdir):
+    path = str(tmpdir.join('support.db'))
+    store = SupportResultStore(path)
+    store.put_many('OmnicorpSupport', [(('A', str(i)), FakeEdge([i])) for i in range(1000)])
+    store.close()
+    store = SupportResultStore(path)
+    pairs = [('A', str(i)) for i in range(1000)]
+    found = store.get_many('OmnicorpSupport', pairs)
+    assert [found[pair].publications for pair in pairs] == [[i] for i in range(1000)]
+    store.close()
+
+def test_bump_and_compact(tmpdir):
+    store = SupportResultStore(str(tmpdir.join('support.db')))
+    store.put_many('OmnicorpSupport', [(('A', 'B'), FakeEdge([1]))])
+    store.put_many('CDWSupport', [(('A', 'B'), FakeEdge([2]))])
+    store.bump('OmnicorpSupport')
+    assert store.get_many('OmnicorpSupport', [('A', 'B')])[('A', 'B')] is MISSING
+    assert store.get_many('CDWSupport', [('A', 'B')])[('A', 'B')].publications == [2]
+    assert store.compact() == 1
+    assert store.counts() == {'OmnicorpSupport': 0, 'CDWSupport': 1}
+    store.close()
+
+def test_data_version_change_invalidates(tmpdir):
+    store = SupportResultStore(str(tmpdir.join('support.db')))
+    store.generation('CDWSupport', 'v1')
+    store.put_many('CDWSupport', [(('A', 'B'), FakeEdge([1]))])
+    assert store.generation('CDWSupport', 'v1') == 0
+    assert store.get_many('CDWSupport', [('A', 'B')])[('A', 'B')] is not MISSING
+    assert store.generation('CDWSupport', 'v2') == 1
+    assert store.get_many('CDWSupport', [('A', 'B')])[('A', 'B')] is MISSING
+    store.close()
+
+def test_generations_bumped_elsewhere_are_seen(tmpdir):
+    path = str(tmpdir.join('support.db'))
+    store = SupportResultStore(path)
+    store.put_many('OmnicorpSupport', [(('A', 'B'), FakeEdge([1]))])
+    # e.g. another batch worker, or the command line tool
+    other = SupportResultStore(path)
+    assert other.bump('OmnicorpSupport') == 1
+    other.close()
+    assert store.get_many('OmnicorpSupport', [('A', 'B')])[('A', 'B')] is MISSING
+    assert store.generation('OmnicorpSupport') == 1
+    store.close()
+
+class BrokenStore:
+    """A support store whose database is locked"""
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise sqlite3.OperationalError('database is locked')
+        return fail
+
+def test_support_carries_on_when_the_store_fails():
+    import logging
+    from builder.builder import KnowledgeGraph
+    from builder.bench.fakesupport import FakeSupport
+    from builder.bench.stubs import StubRosetta, SyntheticQuery
+    from builder.instrument import Instrumentation
+    from builder.progress import ProgressLog
+    from builder.supportguard import SupporterGuard
+    metrics = Instrumentation()
+    kgraph = KnowledgeGraph(SyntheticQuery(30, 60), StubRosetta(), instrumentation=metrics,
+                            support_store=BrokenStore())
+    kgraph.execute()
+    links = kgraph.choose_links()[:100]
+    guard = SupporterGuard(FakeSupport(None))
+    kgraph.support_chunk(guard, links, ProgressLog(logging.getLogger('application'), 'support'))
+    assert guard.calls == len(links) and guard.errors == 0
+    errors = metrics.report()['counters']['support_store_errors']
+    assert sorted(error['labels']['operation'] for error in errors) == ['get_many', 'put_many']
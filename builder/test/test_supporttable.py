@@ -0,0 +1,44 @@
+import numpy as np
+from builder.supporttable import SupportTable
+
+class FakeEdge:
+    def __init__(self, publications=None, properties=None):
+        self.publications = publications
+        self.properties = properties
+
+def test_publication_counts_and_jaccard():
+    table = SupportTable(capacity=2)
+    table.add('OmnicorpSupport', 'A', 'B', FakeEdge(['PMID:1', 'PMID:2']))
+    table.add('OmnicorpSupport', 'A', 'C', FakeEdge(['PMID:2', 'PMID:3', 'PMID:4']))
+    table.add('OmnicorpSupport', 'B', 'C', FakeEdge(['PMID:5']))
+    assert len(table) == 3
+    features = table.features()
+    assert list(features['publication_count']) == [2, 3, 1]
+    # A has PMIDs {1,2,3,4}, B has {1,2,5}: union 5, shared 2
+    assert np.isclose(features['shared_pmid_jaccard'][0], 2 / 5)
+    # B has {1,2,5}, C has {2,3,4,5}: union 6, shared 1
+    assert np.isclose(features['shared_pmid_jaccard'][2], 1 / 6)
+
+def test_supporters_are_kept_apart():
+    table = SupportTable()
+    table.add('OmnicorpSupport', 'A', 'B', FakeEdge(['PMID:1']))
+    table.add('ChemotextSupport', 'A', 'C', FakeEdge(['PMID:2', 'PMID:3']))
+    features = table.features()
+    assert list(features['shared_pmid_jaccard']) == [1.0, 1.0]
+
+def test_cdw_stats():
+    table = SupportTable()
+    table.add('CDWSupport', 'A', 'B', FakeEdge(properties={'c1': '100', 'c2': '200', 'c': '40', 'e': 20.0, 'p': '0.01'}))
+    table.add('CDWSupport', 'A', 'C', FakeEdge(properties={'c1': 100, 'c2': 50, 'c': '<11', 'e': 5.0, 'p': None}))
+    features = table.features()
+    assert features['cdw_observed_expected'][0] == 2.0
+    assert np.isnan(features['cdw_observed_expected'][1])
+    assert list(features['publication_count']) == [0, 0]
+
+def test_write_npz(tmpdir):
+    table = SupportTable()
+    table.add('OmnicorpSupport', 'A', 'B', FakeEdge(['PMID:1', 'PMID:2']))
+    path = table.write(str(tmpdir.join('support.npz')))
+    loaded = np.load(path)
+    assert list(loaded['strings']) == ['A', 'B']
+    assert list(loaded['pmids']) == [1, 2]
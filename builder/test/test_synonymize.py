@@ -0,0 +1,96 @@
+from builder.ratelimit import AdaptiveLimiter
+from builder.synonymize import BatchSynonymizer, PrefetchCache
+
+class Node:
+    def __init__(self, identifier, node_type='gene'):
+        self.identifier = identifier
+        self.node_type = node_type
+        self.synonyms = set([identifier])
+
+    def add_synonyms(self, synonyms):
+        self.synonyms.update(synonyms)
+
+class Cache:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.gets = []
+        self.mgets = []
+
+    def get(self, key):
+        self.gets.append(key)
+        return self.data.get(key)
+
+    def mget(self, keys):
+        self.mgets.append(list(keys))
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.data[key] = value
+
+class Synonymizer:
+    """Looks synonyms up through the cache, as greent's does, making them up on a miss"""
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = []
+
+    def synonymize(self, node):
+        key = 'synonymize({})'.format(node.identifier)
+        synonyms = self.cache.get(key)
+        if synonyms is None:
+            self.calls.append(node.identifier)
+            synonyms = [node.identifier + '.alt']
+            self.cache.set(key, synonyms)
+        node.add_synonyms(synonyms)
+
+def test_each_identifier_is_synonymized_once():
+    cache = PrefetchCache(Cache({'synonymize(A)': ['A.cached']}))
+    synonymizer = Synonymizer(cache)
+    batch = BatchSynonymizer(synonymizer, cache, workers=4)
+    nodes = [Node('A'), Node('B'), Node('A'), Node('C'), Node('B')]
+    batch.synonymize_all(nodes)
+    assert sorted(synonymizer.calls) == ['B', 'C']
+    assert cache.cache.mgets == [['synonymize(A)', 'synonymize(B)', 'synonymize(C)']]
+    assert [sorted(node.synonyms) for node in nodes] == [['A', 'A.cached'], ['B', 'B.alt'], ['A', 'A.cached'],
+                                                         ['C', 'C.alt'], ['B', 'B.alt']]
+    # A program's own per-node call afterwards is answered from memory
+    later = Node('C')
+    batch.synonymize(later)
+    assert sorted(later.synonyms) == ['C', 'C.alt'] and sorted(synonymizer.calls) == ['B', 'C']
+    assert cache.prefetched == {}
+
+def test_ops_are_batched():
+    cache = PrefetchCache(Cache())
+    synonymizer = Synonymizer(cache)
+    batch = BatchSynonymizer(synonymizer, cache, workers=1)
+    op = batch.get_ops(lambda name: lambda node: [('edge1', Node('X')), ('edge2', Node('X'))])('step')
+    results = op(Node('start'))
+    assert synonymizer.calls == ['X']
+    assert [sorted(node.synonyms) for _, node in results] == [['X', 'X.alt'], ['X', 'X.alt']]
+
+def test_only_misses_go_through_the_limiter():
+    cache = PrefetchCache(Cache({'synonymize(A)': ['A.cached']}))
+    limiter = AdaptiveLimiter('synonymize')
+    batch = BatchSynonymizer(Synonymizer(cache), cache, workers=4, limiter=limiter)
+    batch.synonymize_all([Node('A'), Node('B'), Node('C')])
+    assert limiter.calls == 2
+
+def build(tmpdir=None, **options):
+    from builder.builder import KnowledgeGraph
+    from builder.bench.stubs import StubRosetta, SyntheticQuery
+    from builder.edgestore import EdgeResultStore
+    query = SyntheticQuery(60, 300, n_programs=3, seed=1, service_latency=0.0)
+    rosetta = StubRosetta()
+    store = None if tmpdir is None else EdgeResultStore(str(tmpdir.join('edges.db')))
+    kgraph = KnowledgeGraph(query, rosetta, edge_store=store, **options)
+    kgraph.execute()
+    nodes = sorted((node.identifier, tuple(sorted(node.synonyms))) for node in kgraph.graph.nodes())
+    return nodes, kgraph.graph.number_of_edges(), rosetta
+
+def test_execute_with_every_cache_wrapper_in_place(tmpdir):
+    """The edge store's and the coalescing cache's wrappers around rosetta.cache, under the prefetching one"""
+    expected = build(synonymize_workers=0)
+    nodes, n_edges, rosetta = build(tmpdir, program_workers=3, synonymize_workers=4)
+    assert (nodes, n_edges) == expected[:2]
+    assert len(rosetta.service_calls) == len(set(rosetta.service_calls))
+    # and the wrappers are gone afterwards
+    assert type(rosetta.cache).__name__ == 'StubCache' and type(rosetta.synonymizer).__name__ == 'StubSynonymizer'
@@ -1,9 +1,19 @@
 #from program import Program
+import functools
 from greent.node_types import node_types, UNSPECIFIED
 from greent.util import Text
 from greent.program import Program
 from greent.program import QueryDefinition
 
+# The concept-level plans kept per process.  The plans depend only on the types and transitions of a
+# query, so a process running a batch of queries of one shape asks the type graph once.
+PLAN_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def concept_plans(cypher, type_graph):
+    """The type graph's plans for the cypher, remembered for the last PLAN_CACHE_SIZE shapes of query"""
+    return type_graph.get_transitions(cypher)
+
 class Transition:
     def __init__(self, last_type, next_type, min_path_length, max_path_length):
         self.in_type = last_type
@@ -132,7 +142,7 @@ class UserQuery:
     def compile_query(self, rosetta):
         self.cypher = self.generate_cypher()
         print(self.cypher)
-        plans = rosetta.type_graph.get_transitions(self.cypher)
+        plans = concept_plans(self.cypher, rosetta.type_graph)
         self.programs = [Program(plan, self.definition, rosetta, i) for i,plan in enumerate(plans)]
         return len(self.programs) > 0
 